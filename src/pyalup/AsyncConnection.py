@@ -0,0 +1,101 @@
+import asyncio
+import logging
+
+
+class AsyncConnection:
+    """
+    Base class for asyncio based connections
+
+    Received data is collected in a buffer by the event loop and handed out by Read().
+    Subclasses have to call _DataReceived() for incoming data and _ConnectionLost()
+    when the connection is closed.
+    """
+
+    def __init__(self):
+        # a buffer for incoming bytes
+        self._rxBuffer = bytearray()
+        # set whenever new data was received or the connection was lost
+        self._rxEvent = asyncio.Event()
+        # the exception to raise when reading from a closed connection; None while connected
+        self._closedError = None
+        self.logger = logging.getLogger(__name__)
+
+    # function sending the given data over the connection
+    # NOTE: the data is only buffered by the event loop; use Drain() to wait until it was written
+    # @param data: a bytes-like object containing the data to send
+    def Send(self, data):
+        raise NotImplementedError
+
+    # wait until the buffered outgoing data was handed to the operating system
+    async def Drain(self):
+        pass
+
+    # Function reading in the given size of data from the connection
+    # Waits until the requested number of bytes was received or the timeout is exceeded
+    # @param size: an integer specifying the amount of bytes to read
+    # @param timeout: timeout in ms. If there is no data received within the timeout, a TimeoutError is raised.
+    #                 0 for non-blocking mode, None for waiting forever.
+    #                 Default: 0
+    # @return: a bytes object containing the read bytes
+    # @raises: TimeoutError if the given timeout is exceeded
+    # @raises: ConnectionError if the connection was closed
+    async def Read(self, size, timeout=0):
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout / 1_000
+        while (len(self._rxBuffer) < size):
+            if (self._closedError is not None):
+                raise self._closedError
+            remaining = None if deadline is None else deadline - loop.time()
+            if (remaining is not None and remaining <= 0):
+                raise TimeoutError
+            self._rxEvent.clear()
+            try:
+                await asyncio.wait_for(self._rxEvent.wait(), remaining)
+            except asyncio.TimeoutError:
+                # NOTE: asyncio.TimeoutError is not the built-in TimeoutError before python 3.11
+                raise TimeoutError
+
+        # get the requested amount of bytes from the buffer
+        result = bytes(self._rxBuffer[:size])
+        #delete the requested bytes from the buffer
+        del self._rxBuffer[:size]
+        self.logger.physical("[<<<]: %s", result)
+        return result
+
+    # Function reading in all data which is available from the connection
+    # Waits until at least one byte was received or the timeout is exceeded
+    # @param timeout: timeout in ms. If there is no data received within the timeout, a TimeoutError is raised.
+    #                 0 for non-blocking mode, None for waiting forever.
+    # @return: a bytes-like object containing all read bytes
+    # @raises: TimeoutError if the given timeout is exceeded
+    # @raises: ConnectionError if the connection was closed
+    async def ReadAvailable(self, timeout=0):
+        if (len(self._rxBuffer) == 0):
+            if (self._closedError is not None):
+                raise self._closedError
+            if (timeout == 0):
+                raise TimeoutError
+            self._rxEvent.clear()
+            try:
+                await asyncio.wait_for(self._rxEvent.wait(), None if timeout is None else timeout / 1_000)
+            except asyncio.TimeoutError:
+                raise TimeoutError
+            if (len(self._rxBuffer) == 0):
+                raise self._closedError
+
+        result = self._rxBuffer
+        self._rxBuffer = bytearray()
+        self.logger.physical("[<<<]: %s", result)
+        return result
+
+    # function called by subclasses for incoming data
+    # @param data: the received bytes
+    def _DataReceived(self, data):
+        self._rxBuffer += data
+        self._rxEvent.set()
+
+    # function called by subclasses when the connection was closed
+    # @param exc: the exception which closed the connection or None
+    def _ConnectionLost(self, exc):
+        self._closedError = exc if exc is not None else ConnectionError(f"{self} was closed")
+        self._rxEvent.set()
@@ -0,0 +1,482 @@
+from .Device import Device, ErrorCode, ConfigurationException, FrameException
+from .AsyncTcpConnection import AsyncTcpConnection
+from .AsyncUdpConnection import AsyncUdpConnection
+from .Frame import *
+from .ProtocolDecoder import *
+
+import asyncio
+import collections
+import time
+from timeit import default_timer as timer
+
+
+# An ALUP device driven by an asyncio event loop
+#
+# Shares the protocol logic (frame encoding, delta mode, time synchronization) with Device,
+# but all functions doing I/O are coroutines. The responses of the device are handled by a
+# reader task, so any number of frames up to the device's frame buffer size can be in flight
+# and one event loop can drive many devices without extra threads.
+#
+# Example:
+#   dev = AsyncDevice()
+#   await dev.TcpConnect("192.168.0.10", 5012)
+#   dev.SetColors([0xff0000] * dev.configuration.ledCount)
+#   await dev.Send()
+#   await dev.Disconnect()
+class AsyncDevice(Device):
+
+    # the time in ms by which a wait of the reader task may overrun before the event loop is considered blocked
+    _LOOP_STALL_TOLERANCE = 20
+
+    # default constructor
+    # @param _time_delta_buffer_size: see Device
+    # @param syncEstimator: see Device
+    def __init__(self, _time_delta_buffer_size=100, syncEstimator=None):
+        super().__init__(_time_delta_buffer_size, syncEstimator)
+        # the task handling the frame responses; None if not connected
+        self._readerTask = None
+        # notified whenever a frame was answered; created when connecting
+        self._bufferSpace = None
+        # held by Send() from checking the buffer space until the frame is added; created when connecting
+        self._sendLock = None
+        # the task sending the frames of SendLatest(); None if not running
+        self._pacerTask = None
+        # set whenever SendLatest() queued a frame; created with the pacer task
+        self._frameQueued = None
+
+    # function starting an ALUP/TCP connection
+    # @param ip: a string containing the ip address for the device to connect to
+    # @param port: an int containing the TCP port of the device to use
+    async def TcpConnect(self, ip, port):
+        self.connection = AsyncTcpConnection(ip, port)
+        await self.connection.Connect()
+        await self._AlupConnect()
+        self.logger.info("TCP Connection to %s:%d established successfully." % (ip, port))
+
+    # function starting an ALUP/UDP connection
+    # @param ip: a string containing the ip address for the device to connect to
+    # @param port: an int containing the UDP port of the device to use
+    # @param mtu: the maximum transmission unit of the network in bytes. Larger frames are split
+    #             into multiple frames with an offset. Default: 1500
+    async def UdpConnect(self, ip, port, mtu=1500):
+        self.connection = AsyncUdpConnection(ip, port, mtu)
+        await self.connection.Connect()
+        await self._AlupConnect()
+        self.logger.info("UDP Connection to %s:%d established successfully." % (ip, port))
+
+    # function starting an ALUP/Serial connection
+    # NOTE: only supported on platforms where serial ports have a file descriptor (e.g. Linux, macOS)
+    # @param port: a string containing the serial port to connect to
+    # @param baud: an integer defining the serial communication speed
+    async def SerialConnect(self, port, baud):
+        # NOTE: imported here so that pySerial is only needed for serial connections
+        from .AsyncSerialConnection import AsyncSerialConnection
+        self.connection = AsyncSerialConnection(port, baud)
+        await self.connection.Connect()
+        await self._AlupConnect()
+        self.logger.info("Serial Connection to %s:%d established successfully." % (port, baud))
+
+    # function establishing the ALUP connection and starting the reader task
+    # Note: the communication has to be established first
+    async def _AlupConnect(self):
+        self._decoder = ProtocolDecoder(self.PROTOCOL_VERSIONS)
+        self._receivedEvents.clear()
+        await self._WaitForConnectionRequest()
+        self._SendByte(self._CONNECTION_ACKNOWLEDGEMENT_BYTE)
+        self.configuration = await self._ReadConfiguration()
+        self.connected = True
+        self._bufferSpace = asyncio.Condition()
+        self._sendLock = asyncio.Lock()
+        self._readerTask = asyncio.create_task(self._ReadResponses())
+
+    # function terminating the connection
+    # @param timestamp: a time stamp at which to disconnect. Default: 0
+    async def Disconnect(self, timestamp=0):
+        # NOTE: a frame waiting in SendLatest() is discarded
+        await self._StopPacer()
+        try:
+            await self.FlushBuffer()
+        except TimeoutError:
+            self.logger.warning("Could not wait for unanswered frames (timed out). Disconnecting anyways...")
+
+        # Disconnect ALUP
+        frame = Frame()
+        frame.timestamp = timestamp
+        frame.command = Command.DISCONNECT
+        await self.Send(frame)
+        await self.connection.Drain()
+        self.connected = False
+        self._ledState = None
+
+        self._readerTask.cancel()
+        try:
+            await self._readerTask
+        except asyncio.CancelledError:
+            pass
+        self._readerTask = None
+
+        # Disconnect connection
+        await self.connection.Disconnect()
+        self.logger.info("Disconnected.")
+
+    # send some packets to calibrate the time synchronization
+    # @param tolerance, minSamples, maxProbes, timeout: see Device.Calibrate()
+    # @return: see Device.Calibrate()
+    async def Calibrate(self, tolerance=None, minSamples=5, maxProbes=200, timeout=Device._DEFAULT_READ_TIMEOUT):
+        if (tolerance is not None):
+            return await self._CalibrateBurst(tolerance, minSamples, maxProbes, timeout)
+
+        self.logger.info("Calibrating time synchronization")
+        for _ in range(len(self.syncEstimator) + 1):
+            # send an empty packet with no timestamp to collect synchronization data
+            self.frame.timestamp = 0
+            self.SetColors([])
+            await self.Send()
+        # wait until all open responses arrive
+        await self.FlushBuffer()
+
+    # function calibrating the time synchronization with pipelined probe frames (see Device.Calibrate())
+    # @return: the achieved uncertainty of the offset estimate in ms
+    async def _CalibrateBurst(self, tolerance, minSamples, maxProbes, timeout):
+        self.logger.info(f"Calibrating time synchronization (burst mode, tolerance: {tolerance} ms)")
+        await self.FlushBuffer()
+        probe = Frame()
+        probes = 0
+        lastProbeTime = 0
+        deadline = timer() + timeout / 1000
+        self._calibrationEstimates = collections.deque(maxlen=max(2, minSamples))
+        try:
+            while (not self._CalibrationConverged(tolerance)):
+                if (probes >= maxProbes or timer() >= deadline):
+                    self.logger.warning(f"Time synchronization did not converge within {probes} probe frames")
+                    break
+                if (len(self._unansweredFrames) > 0 and self._serviceTimeEstimateMs is None):
+                    # only one probe frame is in flight until the device's time per frame is known
+                    async with self._bufferSpace:
+                        try:
+                            await asyncio.wait_for(self._bufferSpace.wait(), deadline - timer())
+                        except asyncio.TimeoutError:
+                            pass
+                    continue
+                delay = lastProbeTime + self._ProbeInterval() - timer()
+                if (len(self._unansweredFrames) > 0 and delay > 0):
+                    await asyncio.sleep(delay)
+                lastProbeTime = timer()
+                # Send() only waits while the device's buffer is full
+                try:
+                    await self.Send(probe)
+                    probes += 1
+                except TimeoutError:
+                    pass
+            await self._CollectProbeResponses()
+        finally:
+            estimates = self._calibrationEstimates
+            self._calibrationEstimates = None
+        self.syncUncertainty = self._EstimateSpread(estimates)
+        self.logger.info(f"Calibrated time synchronization with {probes} probe frames. Offset: {self.time_delta_ms} ms +/- {self.syncUncertainty} ms")
+        return self.syncUncertainty
+
+    # function waiting for the responses of all probe frames in flight (see Device._CollectProbeResponses())
+    async def _CollectProbeResponses(self):
+        while (len(self._unansweredFrames) > 0):
+            async with self._bufferSpace:
+                try:
+                    await asyncio.wait_for(self._bufferSpace.wait_for(lambda: len(self._unansweredFrames) == 0), self._ProbeTimeout() / 1000)
+                    return
+                except asyncio.TimeoutError:
+                    pass
+            self._DropLostFrame()
+
+    # wait for all remaining answers for all unanswered frames
+    # @throws: TimeoutError: if not all responses are received within the _DEFAULT_READ_TIMEOUT
+    async def FlushBuffer(self):
+        self.logger.info(f"Flushing buffer: Waiting for {len(self._unansweredFrames)} open responses.")
+        if (getattr(self.connection, "lossy", False)):
+            await self._FlushLossy()
+            return
+        async with self._bufferSpace:
+            try:
+                await asyncio.wait_for(self._bufferSpace.wait_for(lambda: len(self._unansweredFrames) == 0),
+                                       self._DEFAULT_READ_TIMEOUT / 1000)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"No response for {len(self._unansweredFrames)} frames received within {self._DEFAULT_READ_TIMEOUT} ms")
+
+    # function waiting for all responses on a lossy connection; the reader task drops the frames which got lost
+    async def _FlushLossy(self):
+        async with self._bufferSpace:
+            await self._bufferSpace.wait_for(lambda: len(self._unansweredFrames) == 0)
+
+    # function sending a frame to the device without waiting for its acknowledgement
+    # Only waits if configuration.frameBufferSize frames are unanswered.
+    # @param frame: the frame to send or None. If None, the current device.frame will be sent
+    # @return: an asyncio.Future which is resolved with the SentFrame record of the frame as soon as
+    #          it is acknowledged. Fails with a FrameException if the device answers with a frame error
+    #          or with a TimeoutError if the frame was dropped.
+    #          In delta mode, the future belongs to the last frame sent.
+    # @raises: TimeoutError: if the device's buffer stays full for longer than _FRAME_DROP_TIMEOUT.
+    #                        The oldest unanswered frame is dropped in this case
+    async def Send(self, frame=None):
+        if frame is None:
+            frame = self.frame
+
+        loop = asyncio.get_running_loop()
+        start = timer()
+        # NOTE: concurrent calls would otherwise all see the same free slot in the device's buffer
+        #       while waiting for it, and send their frames in any order
+        async with self._sendLock:
+            # the reader task drops lost frames while waiting, so only compute the delta afterwards
+            await self._WaitForBufferSpace()
+            frames = self._FramesToSend(frame)
+            for _frame in frames:
+                await self._WaitForBufferSpace()
+                _frame._id = self._AllocateFrameID()
+                sentFrame = self._SendFrame(_frame)
+                self._AddUnansweredFrame(sentFrame)
+                self.logger.protocol("Added frame to unanswered Frames. Total: %d", len(self._unansweredFrames))
+            # only the last frame is returned, so only it gets a future
+            sentFrame._future = loop.create_future()
+        await self.connection.Drain()
+        self.latency = (timer() - start) * 1000
+        self.stats.sendLatency.Add(self.latency)
+        return sentFrame._future
+
+    # AsyncDevice.Send() never waits for acknowledgements
+    async def SendNoWait(self, frame=None):
+        return await self.Send(frame)
+
+    # function queueing a frame to be sent as soon as the connection can sustain it ("latest wins")
+    # Same as Device.SendLatest(), but the frames are sent by a task on the running event loop.
+    # NOTE: has to be called from within the event loop the device is connected with
+    # @param frame: the frame to send or None. If None, the current device.frame will be sent.
+    #               The frame is copied, so it can be modified right after calling this function
+    def SendLatest(self, frame=None):
+        if frame is None:
+            frame = self.frame
+        # encode the body right away to take a snapshot of the frame
+        snapshot = frame._WithColors(frame._BodyToBytes())
+        self._StartPacer()
+        if (self._pendingFrame is not None):
+            self.coalescedFrames += 1
+        self._pendingFrame = snapshot
+        self._frameQueued.set()
+
+    # function starting the task sending the frames of SendLatest() if it is not running yet
+    def _StartPacer(self):
+        if (self._pacerTask is not None and not self._pacerTask.done()):
+            return
+        self._frameQueued = asyncio.Event()
+        self._pacerTask = asyncio.get_running_loop().create_task(self._PaceFrames())
+
+    # function stopping the task sending the frames of SendLatest() if it is running
+    async def _StopPacer(self):
+        if (self._pacerTask is None):
+            return
+        self._pendingFrame = None
+        self._pacerTask.cancel()
+        try:
+            await self._pacerTask
+        except asyncio.CancelledError:
+            pass
+        self._pacerTask = None
+
+    # pacer task sending the latest frame whenever the connection can take another one
+    async def _PaceFrames(self):
+        while True:
+            await self._frameQueued.wait()
+            self._frameQueued.clear()
+            if (self._pendingFrame is None):
+                continue
+
+            # keep the frame rate sustainable for the connection
+            fps = self.EstimateFps()
+            if (fps is not None):
+                delay = self._lastPacedSend + 1 / fps - timer()
+                if (delay > 0):
+                    await asyncio.sleep(delay)
+
+            # wait until the device can take another frame
+            if (len(self._unansweredFrames) >= self._MaxFramesInFlight()):
+                async with self._bufferSpace:
+                    try:
+                        await asyncio.wait_for(
+                            self._bufferSpace.wait_for(lambda: len(self._unansweredFrames) < self._MaxFramesInFlight()),
+                            self._FRAME_DROP_TIMEOUT / 1000)
+                    except asyncio.TimeoutError:
+                        # let Send() handle the timeout
+                        pass
+            # take the newest frame
+            frame = self._pendingFrame
+            self._pendingFrame = None
+            if (frame is None):
+                continue
+
+            self._lastPacedSend = timer()
+            try:
+                future = await self.Send(frame)
+                # nobody awaits the frames of SendLatest(); errors are logged by Send() and the reader task
+                future.add_done_callback(lambda future: future.cancelled() or future.exception())
+            except Exception as e:
+                self.logger.error(f"Pacer could not send frame: {e!r}")
+                if (self._readerTask is None or self._readerTask.done()):
+                    return
+
+    # Set all LEDs to black by sending a clear command
+    # @param timestamp: the timestamp at which the command should be applied
+    # @return: see Send()
+    async def Clear(self, timestamp=0):
+        frame = Frame()
+        frame.timestamp = timestamp
+        frame.command = Command.CLEAR
+        return await self.Send(frame)
+
+    # function waiting until there is space for another frame in the device's buffer
+    # @raises: TimeoutError: if no response was received within _FRAME_DROP_TIMEOUT.
+    #                        The oldest unanswered frame is dropped in this case
+    async def _WaitForBufferSpace(self):
+        if (len(self._unansweredFrames) < self.configuration.frameBufferSize):
+            return
+        async with self._bufferSpace:
+            try:
+                await asyncio.wait_for(
+                    self._bufferSpace.wait_for(lambda: len(self._unansweredFrames) < self.configuration.frameBufferSize),
+                    self._AckTimeout() / 1000)
+                return
+            except asyncio.TimeoutError:
+                pass
+        if (getattr(self.connection, "lossy", False)):
+            # lost frames are expected on lossy connections; keep on sending
+            self._DropLostFrame()
+            return
+        # treat the oldest frame as dropped, same as Device
+        dropped_frame = self._DropOldestFrame()
+        error = TimeoutError(f"No Frame Acknowledgement or Frame Error for frame {dropped_frame._id} received from receiver within a time of {self._FRAME_DROP_TIMEOUT} ms. Dropped frame from queue.")
+        if (dropped_frame._future is not None and not dropped_frame._future.done()):
+            dropped_frame._future.set_exception(error)
+        self.logger.error("TimeoutError: " + str(error))
+        raise error
+
+    # reader task handling all frame responses until cancelled or the connection is closed
+    # On lossy connections, the reader task also drops the lost frames once no response arrived until their deadline
+    async def _ReadResponses(self):
+        lossy = getattr(self.connection, "lossy", False)
+        try:
+            while True:
+                if (not lossy):
+                    await self._HandleFrameResponse(timeout=None)
+                    continue
+                timeout = self._ReaderTimeout()
+                start = timer()
+                try:
+                    await self._HandleFrameResponse(timeout=timeout)
+                except TimeoutError:
+                    if ((timer() - start) * 1000 > timeout + self._LOOP_STALL_TOLERANCE):
+                        # the event loop was blocked, so received datagrams may not be delivered yet; wait again
+                        continue
+                    count = len(self._unansweredFrames)
+                    self._ExpireLostFrames()
+                    if (len(self._unansweredFrames) < count):
+                        async with self._bufferSpace:
+                            self._bufferSpace.notify_all()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.logger.error(f"Response reader stopped: {e!r}")
+            # fail all frames which will never be answered now
+            while (len(self._unansweredFrames) > 0):
+                _, sentFrame = self._unansweredFrames.popitem(last=False)
+                if (sentFrame._future is not None and not sentFrame._future.done()):
+                    sentFrame._future.set_exception(e)
+            async with self._bufferSpace:
+                self._bufferSpace.notify_all()
+
+    # @return: the time in ms the reader task waits for a response on lossy connections: until the oldest
+    #          unanswered frame is overdue, but at least 1 ms, so the event loop delivers all datagrams
+    #          which were already received before the frame is dropped
+    def _ReaderTimeout(self):
+        if (len(self._unansweredFrames) == 0):
+            return self._READER_POLL_TIMEOUT
+        oldest = next(iter(self._unansweredFrames.values()))
+        wait = self._ResponseDeadline(oldest) - time.time_ns() // 1000000
+        return min(max(wait, 1), self._READER_POLL_TIMEOUT)
+
+    # function reading and handling the next frame acknowledgement or frame error
+    # @param timeout: the timeout in ms for reading the response. None to wait forever
+    async def _HandleFrameResponse(self, timeout):
+        # read in next message, skipping everything which is not a response
+        event, _t_response_in = await self._NextEvent(timeout)
+        while (not isinstance(event, (FrameAcknowledgementEvent, FrameErrorEvent))):
+            self.logger.debug("Received Unexpected Message: " + type(event).__name__)
+            event, _t_response_in = await self._NextEvent(timeout)
+        tracer = self.tracer
+        if (tracer is not None):
+            handleStart = tracer.Now()
+
+        if (isinstance(event, FrameAcknowledgementEvent)):
+            self.logger.protocol("Received frame acknowledgement: ID: %d", event.frameID)
+            frame = self._PopFrameWithID(event.frameID)
+            if (frame is not None):
+                frame._t_response_in = _t_response_in
+                frame._t_receiver_in = event.t_receiver_in
+                frame._t_receiver_out = event.t_receiver_out
+                self.stats.AddAcknowledgement(frame)
+                self._SynchronizeDeviceTime(frame)
+                self._UpdatePacingEstimate(frame)
+                self._UpdateTxLatencyEstimate(frame)
+                if (self._onFrameResponse is not None):
+                    self._onFrameResponse(frame)
+                if (frame._future is not None and not frame._future.done()):
+                    frame._future.set_result(frame)
+                if (tracer is not None):
+                    self._TraceResponse(tracer, frame, handleStart)
+        else:
+            # response is a frame error
+            error_code = ErrorCode(event.errorCode)
+            self.logger.error("Received ALUP Frame Error for frame ID %d. Error Code: %s(%d)", event.frameID, error_code.name, error_code.value)
+            self.stats.frameErrors[error_code] += 1
+            frame = self._PopFrameWithID(event.frameID)
+            # the frame was not applied, so the LED state of the device is unknown now
+            self._ledState = None
+            if (frame is not None and frame._future is not None and not frame._future.done()):
+                frame._future.set_exception(FrameException(event.frameID, error_code))
+
+        async with self._bufferSpace:
+            self._bufferSpace.notify_all()
+
+    # function reading in the configuration
+    # @return: The configuration object read
+    # @throws: ConfigurationException if the protocol version of the devices are incompatible
+    async def _ReadConfiguration(self):
+        self.logger.protocol("Waiting for configuration start")
+        event, _ = await self._NextEvent(self._DEFAULT_READ_TIMEOUT)
+        while (not isinstance(event, ConfigurationEvent)):
+            event, _ = await self._NextEvent(self._DEFAULT_READ_TIMEOUT)
+        config = event.configuration
+
+        # check if the protocol version is compatible
+        if (not self._CheckProtocolVersion(config.protocolVersion)):
+            raise ConfigurationException("Incompatible protocol versions: Supported versions: " + str(self.PROTOCOL_VERSIONS)+ " but device has: " + config.protocolVersion)
+
+        self.logger.protocol("Received device configuration: " + str(config))
+        self._SendByte(self._CONFIGURATION_ACKNOWLEDGEMENT_BYTE)
+        self.logger.debug("Configuration acknowledgement sent.")
+        return config
+
+    # function waiting for a connection request
+    async def _WaitForConnectionRequest(self):
+        self.logger.protocol("Waiting for connection request from device")
+        event, _ = await self._NextEvent(self._DEFAULT_READ_TIMEOUT)
+        while (not isinstance(event, ConnectionRequestEvent)):
+            event, _ = await self._NextEvent(self._DEFAULT_READ_TIMEOUT)
+        self.logger.protocol("Received connection request from device")
+
+    # function returning the next message received from the device
+    # @param timeout: timeout in ms for reading from the connection. None to wait forever
+    # @return: a tuple with the decoded event (see ProtocolDecoder) and the time in ms when it was received
+    # @raises: TimeoutError if no complete message is received within the timeout
+    async def _NextEvent(self, timeout):
+        while (len(self._receivedEvents) == 0):
+            data = await self.connection.ReadAvailable(timeout)
+            receiveTime = time.time_ns() // 1000000
+            for event in self._decoder.Feed(data):
+                self._receivedEvents.append((event, receiveTime))
+        return self._receivedEvents.popleft()
@@ -0,0 +1,98 @@
+from .AsyncConnection import AsyncConnection
+
+import asyncio
+import logging
+import os
+import serial
+
+#
+#   This class requires pySerial to be installed
+#   Install using "pip3 install pySerial"
+#   NOTE: only supported on platforms where serial ports have a file descriptor (e.g. Linux, macOS)
+#
+class AsyncSerialConnection(AsyncConnection):
+    """
+    asyncio based serial connection for the AsyncDevice
+
+    Reads and writes are driven by the event loop watching the file descriptor of the serial port
+    """
+
+    # default constructor
+    # @param port: a string containing the Serial port to connect to
+    # @param baud: an integer defining the communication speed
+    def __init__(self, port, baud):
+        super().__init__()
+        self.port = port
+        self.baud = baud
+        self.connection = None
+        self._loop = None
+        # outgoing data which could not be written to the port yet
+        self._txBuffer = bytearray()
+        # set while the outgoing buffer is empty
+        self._txEmpty = asyncio.Event()
+        self._txEmpty.set()
+        self.logger = logging.getLogger(__name__)
+
+    # Establishes the connection
+    async def Connect(self):
+        self._loop = asyncio.get_running_loop()
+        self.connection = serial.Serial(self.port, self.baud, timeout=0)
+        self.connection.reset_output_buffer()
+        self.connection.reset_input_buffer()
+        self._loop.add_reader(self.connection.fileno(), self._ReadReady)
+
+    # function terminating the connection
+    async def Disconnect(self):
+        await self.Drain()
+        self._loop.remove_reader(self.connection.fileno())
+        self.connection.close()
+        self._ConnectionLost(None)
+
+    # function sending the given data over the connection
+    # NOTE: the data is only buffered if the port is busy; use Drain() to wait until it was written
+    # @param data: a bytes-like object containing the data to send
+    def Send(self, data):
+        if (self.logger.isEnabledFor(logging.PHYSICAL)):
+            self.logger.physical("[>>>]: " + str([int(b) for b in data]))
+        if (len(self._txBuffer) == 0):
+            # try to write directly
+            try:
+                written = os.write(self.connection.fileno(), data) if len(data) > 0 else 0
+            except BlockingIOError:
+                written = 0
+            if (written == len(data)):
+                return
+            data = data[written:]
+            self._txEmpty.clear()
+            self._loop.add_writer(self.connection.fileno(), self._WriteReady)
+        self._txBuffer += data
+
+    # wait until all buffered outgoing data was written to the port
+    async def Drain(self):
+        await self._txEmpty.wait()
+
+    # called by the event loop when data can be read from the port
+    def _ReadReady(self):
+        try:
+            data = os.read(self.connection.fileno(), max(1, self.connection.in_waiting))
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._loop.remove_reader(self.connection.fileno())
+            self._ConnectionLost(e)
+            return
+        self._DataReceived(data)
+
+    # called by the event loop when data can be written to the port
+    def _WriteReady(self):
+        try:
+            written = os.write(self.connection.fileno(), self._txBuffer)
+        except BlockingIOError:
+            return
+        del self._txBuffer[:written]
+        if (len(self._txBuffer) == 0):
+            self._loop.remove_writer(self.connection.fileno())
+            self._txEmpty.set()
+
+    def __str__(self):
+        return f"AsyncSerialConnection({self.port}:{self.baud})"
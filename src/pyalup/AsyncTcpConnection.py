@@ -0,0 +1,79 @@
+from .AsyncConnection import AsyncConnection
+
+import asyncio
+import logging
+import socket
+
+
+class AsyncTcpConnection(AsyncConnection):
+    """
+    asyncio based TCP connection for the AsyncDevice
+    """
+
+    # default constructor
+    # @param ip: a string containing the ip address of the remote device
+    # @param port: the port number of the remote socket
+    def __init__(self, ip, port):
+        super().__init__()
+        # ip and port of the ALUP client device
+        self.remote_ip = ip
+        self.remote_port = port
+        self._transport = None
+        self._protocol = None
+        self.logger = logging.getLogger(__name__)
+
+    # function establishing the TCP connection to the specified device
+    # @param timeout: timeout for establishing the connection in s. Default: 15
+    async def Connect(self, timeout=15):
+        loop = asyncio.get_running_loop()
+        self._transport, self._protocol = await asyncio.wait_for(
+            loop.create_connection(lambda: _TcpProtocol(self), self.remote_ip, self.remote_port),
+            timeout)
+        self._transport.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    # function disconnecting the TCP connection
+    async def Disconnect(self):
+        self._transport.close()
+
+    # function sending the given data over the Socket connection
+    # NOTE: the data is only buffered by the event loop; use Drain() to wait until it was written
+    # @param data: a bytes-like object containing the binary data to send
+    def Send(self, data):
+        if (self.logger.isEnabledFor(logging.PHYSICAL)):
+            self.logger.physical("[>>>]: " + str(bytes(data)))
+        # NOTE: the transport may keep a reference to data which can not be sent right away,
+        #       so reused buffers have to be copied
+        self._transport.write(bytes(data) if isinstance(data, memoryview) else data)
+
+    # wait until the buffered outgoing data was handed to the operating system
+    async def Drain(self):
+        await self._protocol.Drain()
+
+    def __str__(self):
+        return f"AsyncTcpConnection({self.remote_ip}:{self.remote_port})"
+
+
+# asyncio protocol forwarding all events to its AsyncTcpConnection
+class _TcpProtocol(asyncio.Protocol):
+    def __init__(self, connection):
+        self._connection = connection
+        # set while the transport's write buffer is below its high water mark
+        self._canWrite = asyncio.Event()
+        self._canWrite.set()
+
+    def data_received(self, data):
+        self._connection._DataReceived(data)
+
+    def connection_lost(self, exc):
+        self._canWrite.set()
+        self._connection._ConnectionLost(exc)
+
+    def pause_writing(self):
+        self._canWrite.clear()
+
+    def resume_writing(self):
+        self._canWrite.set()
+
+    # wait until the transport accepts more data
+    async def Drain(self):
+        await self._canWrite.wait()
@@ -0,0 +1,79 @@
+from .AsyncConnection import AsyncConnection
+from .UdpConnection import UdpConnection
+
+import asyncio
+import logging
+import socket
+
+
+class AsyncUdpConnection(AsyncConnection):
+    """
+    asyncio based UDP connection for the AsyncDevice
+    """
+
+    # see UdpConnection
+    lossy = True
+
+    # default constructor
+    # @param ip: a string containing the ip address of the remote device
+    # @param port: the port number of the remote socket
+    # @param mtu: see UdpConnection
+    def __init__(self, ip, port, mtu=1500):
+        super().__init__()
+        self.remote_ip = ip
+        self.remote_port = port
+        self.server_ip = '0.0.0.0'
+        # use the same port as the remote per default
+        self.server_port = port
+        self.maxFrameSize = mtu - UdpConnection._IP_UDP_HEADER_SIZE
+        # the resolved address of the remote device; datagrams from other addresses are discarded
+        self._remote_address = None
+        self.foreignDatagrams = 0
+        self._transport = None
+        self.logger = logging.getLogger(__name__)
+
+    # function establishing the UDP connection to the specified device
+    async def Connect(self):
+        loop = asyncio.get_running_loop()
+        addresses = await loop.getaddrinfo(self.remote_ip, self.remote_port, family=socket.AF_INET, type=socket.SOCK_DGRAM)
+        self._remote_address = addresses[0][4]
+        self._transport, _ = await loop.create_datagram_endpoint(
+            lambda: _UdpProtocol(self),
+            local_addr=(self.server_ip, self.server_port))
+        self.logger.debug("Listening to %s:%d, sending to %s:%d" % (self.server_ip, self.server_port, self.remote_ip, self.remote_port))
+
+    # function disconnecting the UDP connection
+    async def Disconnect(self):
+        self._transport.close()
+
+    # function sending the given data over the UDP connection
+    # @param data: a bytes-like object containing the binary data to send
+    def Send(self, data):
+        if (self.logger.isEnabledFor(logging.PHYSICAL)):
+            self.logger.physical("[>>>]: " + str(bytes(data)))
+        # NOTE: the transport may keep a reference to data which can not be sent right away,
+        #       so reused buffers have to be copied
+        self._transport.sendto(bytes(data) if isinstance(data, memoryview) else data, self._remote_address)
+
+    def __str__(self):
+        return f"AsyncUdpConnection({self.remote_ip}:{self.remote_port})"
+
+
+# asyncio protocol forwarding all events to its AsyncUdpConnection
+class _UdpProtocol(asyncio.DatagramProtocol):
+    def __init__(self, connection):
+        self._connection = connection
+
+    def datagram_received(self, data, addr):
+        # only accept datagrams from the ip and port of the device
+        if (addr != self._connection._remote_address):
+            self._connection.foreignDatagrams += 1
+            self._connection.logger.debug("Discarded datagram from foreign address %s:%d", addr[0], addr[1])
+            return
+        self._connection._DataReceived(data)
+
+    def error_received(self, exc):
+        self._connection.logger.warning(f"UDP error: {exc!r}")
+
+    def connection_lost(self, exc):
+        self._connection._ConnectionLost(exc)
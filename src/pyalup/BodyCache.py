@@ -0,0 +1,91 @@
+import array
+import collections
+import hashlib
+import threading
+
+try:
+    import numpy
+except ImportError:
+    # numpy is optional; it is only needed when colors are given as numpy arrays
+    numpy = None
+
+
+class BodyCache:
+    """
+    A size-bounded LRU cache of encoded frame bodies
+
+    Repeated content (blackouts, static looks, looping animations) is encoded only once:
+    the colors of each frame are reduced to a fingerprint, and bodies with a known fingerprint
+    are sent from the cache. The least recently used bodies are evicted once the cached bodies
+    take up more than maxBytes.
+
+    Caching is opt-in: assign a BodyCache to Device.bodyCache. One cache can be shared by
+    multiple devices, e.g. all devices of a Group.
+    Colors which are already packed RGB values (bytes or uint8 numpy arrays) are never cached,
+    as they are sent without encoding anyways.
+    """
+
+    # @param maxBytes: the maximum size of all cached bodies in bytes
+    def __init__(self, maxBytes=16 * 1024 * 1024):
+        self.maxBytes = maxBytes
+        # the cached bodies by fingerprint, least recently used first
+        self._bodies = collections.OrderedDict()
+        # the size of all cached bodies in bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    # function returning the encoded body of the given frame
+    # @param frame: the frame
+    # @return: a byte memoryview of the packed RGB values of the frame's colors
+    def Body(self, frame):
+        packed = frame._PackedBody()
+        if (packed is not None):
+            return packed
+        key = self._Fingerprint(frame.colors)
+        with self._lock:
+            body = self._bodies.get(key)
+            if (body is not None):
+                self._bodies.move_to_end(key)
+                self.hits += 1
+                return memoryview(body)
+            self.misses += 1
+
+        body = frame._BodyToBytes()
+        if (len(body) > self.maxBytes):
+            return memoryview(body)
+        with self._lock:
+            if (key not in self._bodies):
+                self._bodies[key] = body
+                self.size += len(body)
+                while (self.size > self.maxBytes):
+                    _, evicted = self._bodies.popitem(last=False)
+                    self.size -= len(evicted)
+                    self.evictions += 1
+        return memoryview(body)
+
+    # function removing all cached bodies
+    def Clear(self):
+        with self._lock:
+            self._bodies.clear()
+            self.size = 0
+
+    # @param colors: the colors of a frame which are not packed RGB values
+    # @return: a hashable fingerprint of the colors
+    @staticmethod
+    def _Fingerprint(colors):
+        if (numpy is not None and isinstance(colors, numpy.ndarray)):
+            colors = numpy.ascontiguousarray(colors)
+            return (colors.dtype.str, colors.shape, hashlib.blake2b(colors, digest_size=16).digest())
+        if (not isinstance(colors, array.array)):
+            # packing the integer colors is done in C and much cheaper than encoding
+            colors = array.array('I', colors)
+        return (colors.typecode, len(colors), hashlib.blake2b(colors, digest_size=16).digest())
+
+    def __len__(self):
+        return len(self._bodies)
+
+    def __str__(self):
+        return f"BodyCache({len(self._bodies)} bodies, {self.size}/{self.maxBytes} Bytes, hits: {self.hits}, misses: {self.misses}, evictions: {self.evictions})"
@@ -0,0 +1,182 @@
+try:
+    import numpy
+except ImportError:
+    # numpy is optional; it is only needed for canvases
+    numpy = None
+
+
+class Segment:
+    """
+    A run of LEDs of one device which shows a part of a Canvas
+
+    The i-th LED of the segment (starting at the device offset) shows the canvas pixel canvasIndices[i]
+    """
+
+    # @param device: the device the LEDs belong to
+    # @param deviceOffset: the index of the first LED of the segment on the device
+    # @param canvasIndices: a numpy array with the index of the canvas pixel for each LED of the segment
+    def __init__(self, device, deviceOffset, canvasIndices):
+        self.device = device
+        self.deviceOffset = deviceOffset
+        self.canvasIndices = canvasIndices
+
+    def __len__(self):
+        return len(self.canvasIndices)
+
+    def __str__(self):
+        return f"Segment({self.device.configuration.deviceName}, LEDs {self.deviceOffset}-{self.deviceOffset + len(self) - 1})"
+
+
+class Canvas:
+    """
+    One large pixel space spread across the devices of a Group
+
+    Declare which LEDs of which device show which pixels with AddSegment() and AddMatrix(),
+    write the colors of the whole canvas into Canvas.pixels and send them with Send().
+    The mapping from pixels to LEDs is precomputed into a single index map, so the bodies of all
+    devices are gathered with one vectorized numpy operation per frame. The bodies are views of one
+    buffer of packed RGB values which are sent without further copying.
+
+    LEDs of a device which lie between its segments but belong to none of them are set to black.
+
+    Example:
+        canvas = Canvas(group, 300)
+        canvas.AddSegment(device1, canvasStart=0, length=150)
+        canvas.AddSegment(device2, canvasStart=150, length=150, reverse=True)
+        canvas.pixels[:] = (255, 0, 0)
+        canvas.Send()
+    """
+
+    # @param group: the Group sending the frames
+    # @param width: the width of the canvas in pixels
+    # @param height: the height of the canvas in pixels. 1 for a one dimensional canvas
+    # @raises: ImportError if numpy is not installed
+    def __init__(self, group, width, height=1):
+        if (numpy is None):
+            raise ImportError("Canvas requires numpy (pip install pyalup[numpy])")
+        self.group = group
+        self.width = width
+        self.height = height
+        self.segments = []
+        # the RGB values of all pixels with an additional black pixel at the end for unmapped LEDs
+        self._pixels = numpy.zeros((width * height + 1, 3), dtype=numpy.uint8)
+        # the colors of the canvas as uint8 RGB values with shape (height, width, 3)
+        self.pixels = self._pixels[:-1].reshape(height, width, 3)
+        # the precomputed index map; rebuilt after the segments changed
+        self._indexMap = None
+        # the gathered bodies of all devices
+        self._bodies = None
+        # the devices with the LED offset and the range of their body in _bodies
+        self._deviceRanges = None
+
+    # function mapping a run of canvas pixels to LEDs of a device
+    # On two dimensional canvases, the pixels are counted row by row
+    # @param device: the device
+    # @param canvasStart: the index of the first pixel
+    # @param length: the number of LEDs
+    # @param deviceOffset: the index of the first LED on the device
+    # @param reverse: True if the LEDs are wired in the opposite direction of the canvas
+    # @return: the new Segment
+    def AddSegment(self, device, canvasStart, length, deviceOffset=0, reverse=False):
+        if (canvasStart < 0 or canvasStart + length > self.width * self.height):
+            raise ValueError(f"Pixels {canvasStart}-{canvasStart + length - 1} are not on the canvas of {self.width * self.height} pixels")
+        indices = numpy.arange(canvasStart, canvasStart + length, dtype=numpy.intp)
+        if (reverse):
+            indices = indices[::-1]
+        return self._AddSegment(Segment(device, deviceOffset, indices))
+
+    # function mapping a rectangle of canvas pixels to a LED matrix of a device
+    # @param device: the device
+    # @param x: the column of the upper left pixel on the canvas
+    # @param y: the row of the upper left pixel on the canvas
+    # @param width: the number of columns of the matrix
+    # @param height: the number of rows of the matrix
+    # @param deviceOffset: the index of the first LED of the matrix on the device
+    # @param serpentine: True if every second row runs in the opposite direction (zigzag wiring)
+    # @param vertical: True if the LEDs are wired column by column instead of row by row
+    # @param reverse: True if the first LED is at the end of the first row (or column) instead
+    # @return: the new Segment
+    def AddMatrix(self, device, x, y, width, height, deviceOffset=0, serpentine=True, vertical=False, reverse=False):
+        if (x < 0 or y < 0 or x + width > self.width or y + height > self.height):
+            raise ValueError(f"The matrix at ({x}, {y}) with size {width}x{height} is not on the canvas of {self.width}x{self.height} pixels")
+        rows, columns = numpy.mgrid[y:y + height, x:x + width]
+        indices = rows * self.width + columns
+        if (vertical):
+            indices = indices.T
+        if (reverse):
+            indices = indices[:, ::-1]
+        if (serpentine):
+            indices[1::2] = indices[1::2, ::-1]
+        return self._AddSegment(Segment(device, deviceOffset, indices.ravel().astype(numpy.intp)))
+
+    # function removing all segments of the given device
+    def RemoveDevice(self, device):
+        self.segments = [segment for segment in self.segments if segment.device is not device]
+        self._indexMap = None
+
+    def _AddSegment(self, segment):
+        self.segments.append(segment)
+        self._indexMap = None
+        return segment
+
+    # function precomputing the index map and the body ranges of all devices
+    # @raises: ValueError if segments of a device overlap or do not fit onto it
+    def _Build(self):
+        byDevice = {}
+        for segment in self.segments:
+            byDevice.setdefault(segment.device, []).append(segment)
+        # index of the additional black pixel
+        black = self.width * self.height
+        maps = []
+        self._deviceRanges = []
+        position = 0
+        for device, segments in byDevice.items():
+            segments.sort(key=lambda segment: segment.deviceOffset)
+            offset = segments[0].deviceOffset
+            end = max(segment.deviceOffset + len(segment) for segment in segments)
+            if (offset < 0 or (device.connected and end > device.configuration.ledCount)):
+                raise ValueError(f"The segments of {device.configuration.deviceName} do not fit onto its {device.configuration.ledCount} LEDs")
+            deviceMap = numpy.full(end - offset, black, dtype=numpy.intp)
+            covered = numpy.zeros(end - offset, dtype=bool)
+            for segment in segments:
+                start = segment.deviceOffset - offset
+                if (covered[start:start + len(segment)].any()):
+                    raise ValueError(f"{segment} overlaps another segment of the same device")
+                covered[start:start + len(segment)] = True
+                deviceMap[start:start + len(segment)] = segment.canvasIndices
+            maps.append(deviceMap)
+            self._deviceRanges.append((device, offset, position, position + len(deviceMap)))
+            position += len(deviceMap)
+        self._indexMap = numpy.concatenate(maps) if len(maps) > 0 else numpy.zeros(0, dtype=numpy.intp)
+        self._bodies = numpy.zeros((len(self._indexMap), 3), dtype=numpy.uint8)
+
+    # function setting the pixels from integer colors (e.g. 0xff0000)
+    # @param colors: integer colors for all pixels, either flat or with shape (height, width)
+    def SetColors(self, colors):
+        colors = numpy.asarray(colors, dtype=numpy.uint32).reshape(self.height, self.width)
+        self.pixels[..., 0] = colors >> 16
+        self.pixels[..., 1] = colors >> 8
+        self.pixels[..., 2] = colors
+
+    # function writing the pixels into the frames of all mapped devices
+    # The frames reference the canvas' internal buffer until the next call
+    def Apply(self):
+        if (self._indexMap is None):
+            self._Build()
+        # gather the bodies of all devices at once
+        numpy.take(self._pixels, self._indexMap, axis=0, out=self._bodies)
+        for device, offset, start, end in self._deviceRanges:
+            device.frame.colors = self._bodies[start:end]
+            device.frame.offset = offset
+
+    # function applying the pixels and sending them with the group
+    # @param delayTarget: see Group.Send()
+    def Send(self, delayTarget=None):
+        self.Apply()
+        self.group.Send(delayTarget)
+
+    def __str__(self):
+        out = f"Canvas of {self.width}x{self.height} pixels\n"
+        for segment in self.segments:
+            out += f"\t{segment}\n"
+        return out
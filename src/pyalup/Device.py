@@ -2,16 +2,23 @@ from .UdpConnection import UdpConnection
 from .TcpConnection import TcpConnection
 from .SerialConnection import SerialConnection
 from .Frame import *
-from .Configuration import Configuration
+from .ProtocolDecoder import *
+from .TimeSynchronization import MedianEstimator
+from .Statistics import DeviceStatistics
 
 import time
 import logging
 import collections
-import statistics
-import copy
+import threading
+from concurrent.futures import Future
 from timeit import default_timer as timer
 from enum import IntEnum
 
+try:
+    import numpy
+except ImportError:
+    # numpy is optional; it is only used to speed up the delta mode
+    numpy = None
 
 
 class Device:
@@ -33,6 +40,32 @@ class Device:
     # until the frame is dropped and a TimeoutError is raised  
     # default : 15_000 ms
     _FRAME_DROP_TIMEOUT = 15_000
+    # timeout in ms after which the background reader thread checks if it should stop
+    # default: 100 ms
+    _READER_POLL_TIMEOUT = 100
+
+    # the number of bytes a frame costs on top of its body (frame header + frame acknowledgement)
+    # used in delta mode to decide if two changed spans are sent as separate frames or merged into one
+    _FRAME_OVERHEAD = Frame.HEADER_SIZE + 10
+
+    # smoothing factor of the moving averages used to estimate the sustainable frame rate
+    _PACING_SMOOTHING = 0.2
+
+    # smoothing factors of the moving averages of the transmission latency and its deviation
+    _TX_LATENCY_SMOOTHING = 0.125
+    _TX_LATENCY_DEVIATION_SMOOTHING = 0.25
+
+    # the maximum time in ms to wait for the response to a frame on lossy connections (e.g. UDP)
+    # before it is treated as lost. Shorter if the measured round-trip time allows it
+    # default: 1000 ms
+    _LOSSY_ACK_TIMEOUT = 1000
+
+    # the maximum time in ms to wait for the response to a probe frame while calibrating in burst mode
+    # default: 1000 ms
+    _PROBE_TIMEOUT = 1000
+
+    # the number of distinct frame IDs (frame IDs are unsigned 8bit integers)
+    _FRAME_ID_COUNT = 256
 
     # a list of all supported protocol versions
     PROTOCOL_VERSIONS = ["0.3"]
@@ -40,26 +73,97 @@ class Device:
     # default constructor
     # @param _time_delta_buffer_size: The number of time measurements for the median used to calculate the time_delta.
     # This parameter does not need to be changed except if a device has a lot of time drift and packets are sent very sparsely (reduce to 10 or 1)
-    def __init__(self, _time_delta_buffer_size=100):
+    # @param syncEstimator: the estimator used for the time synchronization (see TimeSynchronization).
+    #                       Default: a MedianEstimator with _time_delta_buffer_size samples.
+    #                       Use a DriftEstimator for long running shows on devices with drifting clocks
+    def __init__(self, _time_delta_buffer_size=100, syncEstimator=None):
         self.connection = None
         self.connected = False
         self.frame = Frame()
         self.configuration = None
         self.logger = logging.getLogger(__name__)
         self.latency = 0 # NOTE: This is the Device Latency (the time from sending a Frame to receiving ANY Acknowledgement) 
+        # counters and histograms of the traffic to the device (see Statistics.DeviceStatistics)
+        self.stats = DeviceStatistics()
+        # the Tracing.Tracer recording the spans of sending and receiving frames; None to disable tracing
+        self.tracer = None
+        # the BodyCache.BodyCache serving encoded bodies of repeated colors; None to encode every frame
+        self.bodyCache = None
 
         self.time_delta_ms = 0 # the time offset from the system time to the receiver's system time in ms
         self._time_delta_ms_raw = 0
-        self._time_deltas_ms_raw = collections.deque(maxlen=_time_delta_buffer_size)
-
-        # a queue containing the unanswered frames
-        # oldest frames are stored to the left, new frames are appended to the right of the
-        self._unansweredFrames = collections.deque() # TODO: would it be useful to make it fixed-size or would this cause a problem?
+        # the estimator calculating the time_delta_ms from all measurements
+        self.syncEstimator = syncEstimator if syncEstimator is not None else MedianEstimator(_time_delta_buffer_size)
+        # the uncertainty of time_delta_ms in ms achieved by the last burst calibration; None if unknown
+        self.syncUncertainty = None
+        # the offset estimates after each accepted sample while calibrating in burst mode; None if not calibrating
+        self._calibrationEstimates = None
+        # the smoothed time in ms from sending a frame until the device received it, measured with the
+        # synchronized time; None until the first frame was acknowledged
+        self.txLatency = None
+        # the SentFrame record of the most recently sent frame
+        self._lastSentFrame = None
+        # the smoothed deviation of the transmission latency in ms
+        self._txLatencyDeviation = 0
+
+        # the unanswered frames indexed by their ID
+        # in the order they were sent, oldest frames first
+        self._unansweredFrames = collections.OrderedDict()
         self._nextFrameID = 0
+        # IDs of frames which were dropped without response, oldest first
+        # these IDs are not reused as long as possible to recognize late acknowledgements
+        self._droppedFrameIDs = collections.OrderedDict()
+        # IDs of frames which were answered and not reused since
+        self._answeredFrameIDs = set()
+        # number of responses which could not be matched to an unanswered frame
+        self.lateResponses = 0 # responses for frames which were dropped before
+        self.duplicateResponses = 0 # responses for frames which were already answered
+        self.unknownResponses = 0 # responses for frame IDs which were never sent
+        # condition guarding the unanswered frames, the time synchronization and the tx buffer
+        # while the background reader thread is running. Notified whenever a response was handled
+        self._lock = threading.Condition()
+        # background thread handling the frame responses for SendNoWait(); None if not running
+        self._readerThread = None
+        self._readerRunning = False
+        # pacing: frames passed to SendLatest() are sent by a background thread at the frame rate the
+        # connection can sustain. Frames which were not sent yet are replaced by newer ones
+        # the maximum number of unanswered frames when pacing; None to use the device's frame buffer size
+        # lower values reduce the latency from SendLatest() until the frame is shown
+        self.maxFramesInFlight = None
+        # an upper limit for the frame rate when pacing in frames per second; None for no limit
+        self.targetFps = None
+        # the number of frames passed to SendLatest() which were replaced before they were sent
+        self.coalescedFrames = 0
+        self._pendingFrame = None
+        self._pacerThread = None
+        self._pacerRunning = False
+        self._lastPacedSend = 0
+        # moving averages of the round-trip time and the time the connection needs per frame in ms
+        self._rttEstimateMs = None
+        self._serviceTimeEstimateMs = None
+        self._lastResponseTime = None
+
+        # decoder for all messages received from the device; created when connecting
+        self._decoder = None
+        # decoded messages which were not handled yet as tuples of (event, receive time in ms)
+        self._receivedEvents = collections.deque()
+        # reusable buffer the outgoing frames are encoded into
+        # NOTE: grows to the size of the largest frame sent and is never shrunk
+        self._txBuffer = bytearray()
+
+        # delta mode: if enabled, only the LEDs which changed since the last sent frame are transmitted
+        # using frames with an offset. Only applied to frames without a command.
+        self.deltaMode = False
+        # the maximum number of frames a single Send() is split into in delta mode
+        # changed spans are merged until this limit is met
+        self.deltaMaxSpans = 4
+        # the packed RGB state of all LEDs on the device after all sent frames are applied
+        # None if unknown, e.g. after connecting or when a frame was dropped or rejected
+        self._ledState = None
 
         # callback function called when a frame receives its response
         # Used e.g. for logging frame timestamps with buffering enabled
-        # has to have Signature: function(frame : Alup.Frame)
+        # has to have Signature: function(frame : Alup.SentFrame)
         self._onFrameResponse = None 
         
     # function starting an ALUP/TCP connection
@@ -74,8 +178,14 @@ class Device:
     # function starting an ALUP/UDP connection
     # @param ip: a string containing the ip address for the device to connect to
     # @param port: an int containing the UDP port of the device to use
-    def UdpConnect(self, ip, port):
-        self.connection = UdpConnection(ip,port)
+    # @param mtu: the maximum transmission unit of the network in bytes. Larger frames are split
+    #             into multiple frames with an offset. Default: 1500
+    # @param endpoint: a UdpEndpoint to share its socket with other devices, or None for an own socket
+    def UdpConnect(self, ip, port, mtu=1500, endpoint=None):
+        if (endpoint is None):
+            self.connection = UdpConnection(ip,port, mtu)
+        else:
+            self.connection = endpoint.Connection(ip, port, mtu)
         self.connection.Connect()
         self._AlupConnect()
         self.logger.info("UDP Connection to %s:%d established successfully." % (ip, port))
@@ -93,6 +203,8 @@ class Device:
     # function establishing the ALUP connection
     # Note: the communication has to be established first
     def _AlupConnect(self):
+        self._decoder = ProtocolDecoder(self.PROTOCOL_VERSIONS)
+        self._receivedEvents.clear()
         self._WaitForConnectionRequest()
         self._SendByte(self._CONNECTION_ACKNOWLEDGEMENT_BYTE)
         self.configuration = self._ReadConfiguration()
@@ -101,6 +213,8 @@ class Device:
     # function terminating the connection
     # @param timestamp: a time stamp at which to disconnect. Default: 0
     def Disconnect(self, timestamp=0):
+        # NOTE: a frame waiting in SendLatest() is discarded
+        self._StopPacer()
         try:
             self.FlushBuffer()
         except TimeoutError:
@@ -112,6 +226,8 @@ class Device:
         frame.command = Command.DISCONNECT
         self.Send(frame)
         self.connected = False
+        self._ledState = None
+        self._StopReader()
 
         # Disconnect connection
         self.connection.Disconnect()
@@ -119,9 +235,21 @@ class Device:
 
 
     # send some packets to calibrate the time synchronization
-    def Calibrate(self):
+    # By default, one frame per sample of the syncEstimator is sent one after another.
+    # If a tolerance is given, the calibration runs in burst mode: empty probe frames are pipelined
+    # up to the device's frame buffer size and the calibration stops as soon as the offset estimate converged.
+    # @param tolerance: burst mode only: the offset estimate is converged if it changed by at most
+    #                   +/- tolerance ms over the last minSamples samples. None to disable burst mode
+    # @param minSamples: burst mode only: the number of accepted samples the convergence is checked over
+    # @param maxProbes: burst mode only: the maximum number of probe frames to send
+    # @param timeout: burst mode only: the time in ms after which no more probe frames are sent
+    # @return: burst mode only: the achieved uncertainty of the offset estimate in ms (see syncUncertainty)
+    def Calibrate(self, tolerance=None, minSamples=5, maxProbes=200, timeout=_DEFAULT_READ_TIMEOUT):
+        if (tolerance is not None):
+            return self._CalibrateBurst(tolerance, minSamples, maxProbes, timeout)
+
         self.logger.info("Calibrating time synchronization")
-        for _ in range(len(self._time_deltas_ms_raw) + 1):
+        for _ in range(len(self.syncEstimator) + 1):
             # send an empty packet with no timestamp to collect synchronization data
             self.frame.timestamp = 0
             self.SetColors([])
@@ -129,16 +257,202 @@ class Device:
         # wait until all open responses arrive if buffering is used
         self.FlushBuffer()
 
+    # function calibrating the time synchronization with pipelined probe frames (see Calibrate())
+    # @return: the achieved uncertainty of the offset estimate in ms
+    def _CalibrateBurst(self, tolerance, minSamples, maxProbes, timeout):
+        self.logger.info(f"Calibrating time synchronization (burst mode, tolerance: {tolerance} ms)")
+        # answer all frames sent before, so that only probe frames are in flight
+        self.FlushBuffer()
+        probe = Frame()
+        probes = 0
+        lastProbeTime = 0
+        deadline = timer() + timeout / 1000
+        with self._lock:
+            self._calibrationEstimates = collections.deque(maxlen=max(2, minSamples))
+        try:
+            while (not self._CalibrationConverged(tolerance)):
+                now = timer()
+                if (probes >= maxProbes or now >= deadline):
+                    self.logger.warning(f"Time synchronization did not converge within {probes} probe frames")
+                    break
+
+                if (self._readerThread is not None):
+                    # the reader thread handles the responses
+                    with self._lock:
+                        if (len(self._unansweredFrames) > 0 and self._serviceTimeEstimateMs is None):
+                            # only one probe frame is in flight until the device's time per frame is known
+                            self._lock.wait(timeout=max(deadline - timer(), 0))
+                            continue
+                    delay = lastProbeTime + self._ProbeInterval() - timer()
+                    if (len(self._unansweredFrames) > 0 and delay > 0):
+                        time.sleep(delay)
+                    lastProbeTime = timer()
+                    try:
+                        self.SendNoWait(probe)
+                        probes += 1
+                    except TimeoutError:
+                        pass
+                    continue
+
+                nextProbeTime = lastProbeTime + self._ProbeInterval()
+                if (len(self._unansweredFrames) == 0 or (now >= nextProbeTime and len(self._unansweredFrames) < self.configuration.frameBufferSize)):
+                    probe._id = self._AllocateFrameID()
+                    self._AddUnansweredFrame(self._SendFrame(probe))
+                    probes += 1
+                    lastProbeTime = now
+                    continue
+
+                # wait for responses until the next probe frame is due or the oldest probe frame is lost
+                oldest = next(iter(self._unansweredFrames.values()))
+                wait = min(deadline - now, (oldest._t_frame_out + self._ProbeTimeout() - time.time_ns() // 1000000) / 1000)
+                if (len(self._unansweredFrames) < self.configuration.frameBufferSize):
+                    wait = min(wait, nextProbeTime - now)
+                try:
+                    self._HandleFrameResponse(timeout=max(wait, 0) * 1000)
+                except TimeoutError:
+                    if (time.time_ns() // 1000000 - oldest._t_frame_out >= self._ProbeTimeout()):
+                        self._DropLostFrame()
+            self._CollectProbeResponses()
+        finally:
+            with self._lock:
+                estimates = self._calibrationEstimates
+                self._calibrationEstimates = None
+        self.syncUncertainty = self._EstimateSpread(estimates)
+        self.logger.info(f"Calibrated time synchronization with {probes} probe frames. Offset: {self.time_delta_ms} ms +/- {self.syncUncertainty} ms")
+        return self.syncUncertainty
+
+    # function waiting for the responses of all probe frames in flight
+    # Probe frames which are not answered within _ProbeTimeout() are dropped
+    def _CollectProbeResponses(self):
+        while (len(self._unansweredFrames) > 0):
+            if (self._readerThread is None):
+                try:
+                    self._HandleFrameResponse(timeout=self._ProbeTimeout())
+                except TimeoutError:
+                    self._DropLostFrame()
+                continue
+            with self._lock:
+                if (not self._lock.wait_for(lambda: len(self._unansweredFrames) == 0, timeout=self._ProbeTimeout() / 1000)):
+                    self._DropLostFrame()
+
+    # function dropping the oldest unanswered frame because it or its response got lost
+    # Unlike a timeout on a reliable connection, this is not treated as an error
+    # NOTE: the lock has to be held by the caller while the reader thread is running
+    def _DropLostFrame(self):
+        dropped_frame = self._DropOldestFrame()
+        error = TimeoutError(f"No response for frame {dropped_frame._id} received. The frame or its response got lost. Dropped frame from queue.")
+        if (dropped_frame._future is not None and not dropped_frame._future.done()):
+            dropped_frame._future.set_exception(error)
+        self.logger.warning(str(error))
+
+    # function dropping all unanswered frames which are overdue on lossy connections (see _AckTimeout())
+    # so lost frames do not take up space in the device's buffer
+    # NOTE: all responses which were already received have to be handled first (see _HandlePendingResponses()),
+    #       else frames are dropped although their response is waiting, e.g. after a pause between two sends.
+    #       While the reader thread is running, only the reader thread expires frames
+    # NOTE: the lock has to be held by the caller while the reader thread is running
+    def _ExpireLostFrames(self):
+        if (not getattr(self.connection, "lossy", False)):
+            return
+        now = time.time_ns() // 1000000
+        while (len(self._unansweredFrames) > 0):
+            if (now <= self._ResponseDeadline(next(iter(self._unansweredFrames.values())))):
+                return
+            self._DropLostFrame()
+
+    # function handling all responses which were already received without waiting for more
+    # NOTE: only used without the reader thread
+    def _HandlePendingResponses(self):
+        while (len(self._unansweredFrames) > 0):
+            try:
+                self._HandleFrameResponse(timeout=0)
+            except TimeoutError:
+                return
+
+    # @param frame: the SentFrame record of an unanswered frame
+    # @return: the unix time in ms after which the frame is treated as lost on lossy connections
+    def _ResponseDeadline(self, frame):
+        # frames with a time stamp are only answered once they are shown
+        return max(frame._t_frame_out, frame.timestamp) + self._AckTimeout()
+
+    # @return: the time in ms after which an unanswered frame is dropped.
+    #          On lossy connections (e.g. UDP) a multiple of the measured round-trip time, so lost
+    #          frames or acknowledgements do not stall sending; else _FRAME_DROP_TIMEOUT
+    def _AckTimeout(self):
+        if (not getattr(self.connection, "lossy", False)):
+            return self._FRAME_DROP_TIMEOUT
+        if (self._rttEstimateMs is None):
+            return self._LOSSY_ACK_TIMEOUT
+        return min(4 * self._rttEstimateMs + 200, self._LOSSY_ACK_TIMEOUT)
+
+    # function returning the interval between two probe frames while calibrating in burst mode
+    # Probe frames are spaced by the time the device needs per frame, so they do not queue up on the
+    # device, which would delay them asymmetrically. Until this time was measured, only one probe frame is in flight
+    # @return: the interval in seconds
+    def _ProbeInterval(self):
+        if (self._serviceTimeEstimateMs is None):
+            return float('inf')
+        return self._serviceTimeEstimateMs / 1000
+
+    # @return: the time in ms after which a probe frame is treated as lost while calibrating in burst mode
+    def _ProbeTimeout(self):
+        if (self._rttEstimateMs is None):
+            return self._PROBE_TIMEOUT
+        return min(4 * self._rttEstimateMs + 100, self._PROBE_TIMEOUT)
+
+    # @param tolerance: see Calibrate()
+    # @return: True if the offset estimates collected during the calibration are converged within the tolerance
+    def _CalibrationConverged(self, tolerance):
+        with self._lock:
+            estimates = self._calibrationEstimates
+            if (len(estimates) < estimates.maxlen):
+                return False
+            return self._EstimateSpread(estimates) <= tolerance
+
+    # @param estimates: a collection of offset estimates in ms
+    # @return: half the range of the given offset estimates in ms. None if there are less than two
+    @staticmethod
+    def _EstimateSpread(estimates):
+        if (len(estimates) < 2):
+            return None
+        return (max(estimates) - min(estimates)) / 2
+
 
     # wait for all remaining answers for all unanswered frames
     # Use this eg. when pausing sending for a long time
+    # On lossy connections, frames without response are dropped after their ack timeout (see _AckTimeout())
     # @throws: TimeoutError: if a response is not received within the _DEFAULT_READ_TIMEOUT
     def FlushBuffer(self):
         self.logger.info(f"Flushing buffer: Waiting for {len(self._unansweredFrames)} open responses.")
+        if (getattr(self.connection, "lossy", False)):
+            self._FlushLossy()
+            return
+        if (self._readerThread is not None):
+            # responses are handled by the reader thread; wait until it answered all frames
+            with self._lock:
+                while (len(self._unansweredFrames) > 0):
+                    if (not self._lock.wait(timeout=self._DEFAULT_READ_TIMEOUT / 1000)):
+                        raise TimeoutError(f"No response for {len(self._unansweredFrames)} frames received within {self._DEFAULT_READ_TIMEOUT} ms")
+            return
         # read all remaining frame responses with a timeout of 15s each
         for _ in range(len(self._unansweredFrames)):
             self._HandleFrameResponse(timeout=self._DEFAULT_READ_TIMEOUT)
 
+    # function waiting for all responses on a lossy connection, dropping the frames which got lost
+    def _FlushLossy(self):
+        if (self._readerThread is not None):
+            # the reader thread drops the lost frames
+            with self._lock:
+                self._lock.wait_for(lambda: len(self._unansweredFrames) == 0)
+            return
+        while (len(self._unansweredFrames) > 0):
+            oldest = next(iter(self._unansweredFrames.values()))
+            wait = self._ResponseDeadline(oldest) - time.time_ns() // 1000000
+            try:
+                self._HandleFrameResponse(timeout=max(wait, 0))
+            except TimeoutError:
+                self._ExpireLostFrames()
+
 
 
     # function setting the color values for the next frame
@@ -154,44 +468,495 @@ class Device:
     # function sending the current frame to the device and waiting for an acknowledgement
     # @param frame: the frame to send or None. If None, the current device.frame will be sent
     def Send(self, frame=None):
-        # copy the current frame from the device to send it
-        # NOTE: we need this in order to save frame references into the _unansweredFrames deque:
-        #       self.frame should be modifiable from outside as part of the API, but as soon as we send
-        #       it, we need a fixed object to reference in the unanswered frames queue 
+        if (self._readerThread is not None):
+            # responses are handled by the reader thread; only wait for space in the device's buffer
+            start = timer()
+            self.SendNoWait(frame)
+            self.latency = (timer() - start) * 1000
+            self.stats.sendLatency.Add(self.latency)
+            return
+
+        # NOTE: the frame is not copied. Only a compact record of it is saved into
+        #       the _unansweredFrames deque, so the frame can be modified as soon as Send() returns
         if frame is None:
-            _frame = copy.deepcopy(self.frame)
-        else:
-            _frame = copy.deepcopy(frame)
-        _frame._id = self._nextFrameID
-        #self._nextFrameID = (self._nextFrameID + 1) % self.configuration.frameBufferSize #TODO: make this modulo maximum ID to also distinguish frames for small buffer sizes and make it more stable
-        self._nextFrameID = (self._nextFrameID + 1) % 256 #TODO: make this modulo maximum ID to also distinguish frames for small buffer sizes and make it more stable
+            frame = self.frame
 
+        # drop the lost frames before computing the delta, so it is not based on frames the device never showed
+        # NOTE: dropping frames resets the LED state, so a full frame is sent instead
+        if (getattr(self.connection, "lossy", False)):
+            self._HandlePendingResponses()
+            self._ExpireLostFrames()
+        frames = self._FramesToSend(frame)
 
         # send frame and wait for response while measuring time
         start = timer()
-        self._SendFrame(_frame)
-        self._unansweredFrames.append(_frame)
-        self.logger.protocol("Added frame to unanswered Frames. Total: " + str(len(self._unansweredFrames)))
-        self._WaitForResponse()
+        for _frame in frames:
+            _frame._id = self._AllocateFrameID()
+            self._AddUnansweredFrame(self._SendFrame(_frame))
+            self.logger.protocol("Added frame to unanswered Frames. Total: %d", len(self._unansweredFrames))
+            tracer = self.tracer
+            if (tracer is not None):
+                waitStart = tracer.Now()
+            self._WaitForResponse()
+            if (tracer is not None):
+                tracer.Record("Device._WaitForResponse", waitStart, tracer.Now(), frameID=_frame._id)
 
         # measure round-trip time in ms
         self.latency = (timer() - start)* 1000
-        self.logger.protocol(f"RTT measured manually: {self.latency}ms")
+        self.stats.sendLatency.Add(self.latency)
+        self.logger.protocol("RTT measured manually: %fms", self.latency)
+
+    # function sending the current frame to the device without waiting for its acknowledgement
+    # The responses are handled by a background reader thread which is started on the first call.
+    # Only blocks if configuration.frameBufferSize frames are unanswered.
+    # NOTE: once the reader thread is running, Send() also does not wait for acknowledgements anymore
+    # @param frame: the frame to send or None. If None, the current device.frame will be sent
+    # @return: a concurrent.futures.Future which is resolved with the SentFrame record of the frame as soon as
+    #          it is acknowledged. Fails with a FrameException if the device answers with a frame error
+    #          or with a TimeoutError if the frame was dropped.
+    #          In delta mode, the future belongs to the last frame sent.
+    # @raises: TimeoutError: if the device's buffer stays full for longer than _FRAME_DROP_TIMEOUT.
+    #                        The oldest unanswered frame is dropped in this case
+    def SendNoWait(self, frame=None):
+        self._StartReader()
+        if frame is None:
+            frame = self.frame
+
+        with self._lock:
+            # the reader thread drops lost frames while waiting, so only compute the delta afterwards
+            self._WaitForBufferSpace()
+            frames = self._FramesToSend(frame)
+            for _frame in frames:
+                self._WaitForBufferSpace()
+                _frame._id = self._AllocateFrameID()
+                sentFrame = self._SendFrame(_frame)
+                sentFrame._future = Future()
+                self._AddUnansweredFrame(sentFrame)
+                self.logger.protocol("Added frame to unanswered Frames. Total: %d", len(self._unansweredFrames))
+        return sentFrame._future
+
+    # function queueing a frame to be sent as soon as the connection can sustain it ("latest wins")
+    # The frames are sent by a background thread using SendNoWait(). If a frame is still waiting
+    # when the next one is passed, it is replaced and never sent, so the LEDs show the newest frame with
+    # bounded latency instead of sending every intermediate frame.
+    # The frame rate is limited to EstimateFps() and maxFramesInFlight.
+    # @param frame: the frame to send or None. If None, the current device.frame will be sent.
+    #               The frame is copied, so it can be modified right after calling this function
+    def SendLatest(self, frame=None):
+        if frame is None:
+            frame = self.frame
+        # encode the body right away to take a snapshot of the frame
+        snapshot = frame._WithColors(frame._BodyToBytes())
+        self._StartPacer()
+        with self._lock:
+            if (self._pendingFrame is not None):
+                self.coalescedFrames += 1
+            self._pendingFrame = snapshot
+            self._lock.notify_all()
+
+    # function estimating the frame rate the connection to the device can sustain
+    # based on the measured round-trip time, the time the connection needs per frame
+    # and the number of frames which can be in flight
+    # @return: the estimated frame rate in frames per second, limited to targetFps. None if nothing was measured yet
+    def EstimateFps(self):
+        fps = None
+        if (self._serviceTimeEstimateMs is not None):
+            frameTime = max(self._serviceTimeEstimateMs, self._rttEstimateMs / self._MaxFramesInFlight(), 0.001)
+            fps = 1000 / frameTime
+        if (self.targetFps is not None):
+            fps = self.targetFps if fps is None else min(fps, self.targetFps)
+        return fps
+
+    # @return: the maximum number of unanswered frames when pacing
+    def _MaxFramesInFlight(self):
+        limit = self.configuration.frameBufferSize
+        if (self.maxFramesInFlight is not None):
+            limit = min(limit, self.maxFramesInFlight)
+        return max(1, limit)
+
+    # function updating the estimates used for pacing with an acknowledged frame
+    # NOTE: the lock has to be held by the caller
+    # @param frame: the SentFrame record of the acknowledged frame
+    def _UpdatePacingEstimate(self, frame):
+        rtt = frame._t_response_in - frame._t_frame_out
+        # the time the connection was busy with this frame: since it was sent if the connection was idle,
+        # else since the previous response was received
+        serviceTime = rtt
+        if (self._lastResponseTime is not None and self._lastResponseTime > frame._t_frame_out):
+            serviceTime = frame._t_response_in - self._lastResponseTime
+        self._lastResponseTime = frame._t_response_in
+
+        if (self._rttEstimateMs is None):
+            self._rttEstimateMs = rtt
+            self._serviceTimeEstimateMs = serviceTime
+        else:
+            self._rttEstimateMs += self._PACING_SMOOTHING * (rtt - self._rttEstimateMs)
+            self._serviceTimeEstimateMs += self._PACING_SMOOTHING * (serviceTime - self._serviceTimeEstimateMs)
+
+    # function updating the transmission latency estimate with an acknowledged frame
+    # NOTE: the lock has to be held by the caller
+    # @param frame: the SentFrame record of the acknowledged frame
+    def _UpdateTxLatencyEstimate(self, frame):
+        latency = max(frame._t_receiver_in - self.time_delta_ms - frame._t_frame_out, 0)
+        if (self.txLatency is None):
+            self.txLatency = latency
+            self._txLatencyDeviation = latency / 2
+            return
+        self._txLatencyDeviation += self._TX_LATENCY_DEVIATION_SMOOTHING * (abs(latency - self.txLatency) - self._txLatencyDeviation)
+        self.txLatency += self._TX_LATENCY_SMOOTHING * (latency - self.txLatency)
+
+    # @return: the time in ms after which a frame sent now has arrived at the device with high confidence,
+    #          including the uncertainty of the time synchronization. None if it was not measured yet
+    def _TxLatencyBound(self):
+        if (self.txLatency is None):
+            return None
+        return self.txLatency + 4 * self._txLatencyDeviation + (self.syncUncertainty or 0)
+
+    # function starting the background thread sending the frames of SendLatest() if it is not running yet
+    def _StartPacer(self):
+        if (self._pacerThread is not None):
+            return
+        self._StartReader()
+        self._pacerRunning = True
+        self._pacerThread = threading.Thread(target=self._PaceFrames, name=f"ALUP pacer ({self.connection})", daemon=True)
+        self._pacerThread.start()
+
+    # function stopping the background thread sending the frames of SendLatest() if it is running
+    def _StopPacer(self):
+        if (self._pacerThread is None):
+            return
+        with self._lock:
+            self._pacerRunning = False
+            self._pendingFrame = None
+            self._lock.notify_all()
+        self._pacerThread.join()
+        self._pacerThread = None
+
+    # loop of the pacer thread sending the latest frame whenever the connection can take another one
+    def _PaceFrames(self):
+        while True:
+            with self._lock:
+                while (self._pacerRunning and self._pendingFrame is None):
+                    self._lock.wait()
+                if (not self._pacerRunning):
+                    return
+
+            # keep the frame rate sustainable for the connection
+            fps = self.EstimateFps()
+            if (fps is not None):
+                delay = self._lastPacedSend + 1 / fps - timer()
+                if (delay > 0):
+                    time.sleep(delay)
+
+            with self._lock:
+                # wait until the device can take another frame
+                while (self._pacerRunning and len(self._unansweredFrames) >= self._MaxFramesInFlight()):
+                    if (not self._lock.wait(timeout=self._FRAME_DROP_TIMEOUT / 1000)):
+                        # let SendNoWait() handle the timeout
+                        break
+                if (not self._pacerRunning):
+                    return
+                # take the newest frame
+                frame = self._pendingFrame
+                self._pendingFrame = None
+
+            self._lastPacedSend = timer()
+            try:
+                self.SendNoWait(frame)
+            except Exception as e:
+                self.logger.error(f"Pacer could not send frame: {e!r}")
+                if (not self._readerRunning):
+                    self._pacerRunning = False
+                    return
+
+    # function blocking until there is space for another frame in the device's buffer
+    # NOTE: the lock has to be held by the caller
+    # @raises: TimeoutError: if no response was received within _FRAME_DROP_TIMEOUT.
+    #                        The oldest unanswered frame is dropped in this case.
+    #                        On lossy connections, the frame is dropped without raising (see _AckTimeout())
+    def _WaitForBufferSpace(self):
+        while (len(self._unansweredFrames) >= self.configuration.frameBufferSize):
+            if (self._lock.wait(timeout=self._AckTimeout() / 1000)):
+                continue
+            if (not self._readerRunning):
+                raise ConnectionError("The response reader thread is not running")
+            if (getattr(self.connection, "lossy", False)):
+                self._DropLostFrame()
+                continue
+            # treat the oldest frame as dropped, same as when sending synchronously
+            dropped_frame = self._DropOldestFrame()
+            error = TimeoutError(f"No Frame Acknowledgement or Frame Error for frame {dropped_frame._id} received from receiver within a time of {self._FRAME_DROP_TIMEOUT} ms. Dropped frame from queue.")
+            if (dropped_frame._future is not None):
+                dropped_frame._future.set_exception(error)
+            self.logger.error("TimeoutError: " + str(error))
+            raise error
+
+    # function starting the background thread handling frame responses if it is not running yet
+    def _StartReader(self):
+        if (self._readerThread is not None):
+            return
+        # answer all frames sent synchronously first, so that the reader thread only
+        # has to handle frames sent with SendNoWait()
+        self.FlushBuffer()
+        self._readerRunning = True
+        self._readerThread = threading.Thread(target=self._ReadResponses, name=f"ALUP reader ({self.connection})", daemon=True)
+        self._readerThread.start()
+
+    # function stopping the background thread handling frame responses if it is running
+    def _StopReader(self):
+        if (self._readerThread is None):
+            return
+        self._readerRunning = False
+        if (self._readerThread is not threading.current_thread()):
+            self._readerThread.join()
+        self._readerThread = None
+
+    # loop of the background reader thread handling frame responses until stopped
+    # On lossy connections, the reader thread also drops the lost frames whenever it handled all received responses
+    def _ReadResponses(self):
+        lossy = getattr(self.connection, "lossy", False)
+        timeout = self._READER_POLL_TIMEOUT
+        while (self._readerRunning):
+            try:
+                self._HandleFrameResponse(timeout=timeout)
+                if (lossy):
+                    # handle all responses which are already received before dropping lost frames
+                    timeout = 0
+                continue
+            except TimeoutError:
+                timeout = self._READER_POLL_TIMEOUT
+                if (lossy):
+                    with self._lock:
+                        count = len(self._unansweredFrames)
+                        self._ExpireLostFrames()
+                        if (len(self._unansweredFrames) < count):
+                            self._lock.notify_all()
+                continue
+            except Exception as e:
+                if (not self._readerRunning):
+                    # the connection was closed while stopping
+                    break
+                self.logger.error(f"Response reader stopped: {e!r}")
+                self._readerRunning = False
+                # fail all frames which will never be answered now
+                with self._lock:
+                    while (len(self._unansweredFrames) > 0):
+                        _, sentFrame = self._unansweredFrames.popitem(last=False)
+                        if (sentFrame._future is not None):
+                            sentFrame._future.set_exception(e)
+                    self._lock.notify_all()
+                break
 
     # function sending the current frame without waiting for an acknowledgement
     # Improper usage may result in connection freeze
+    # @return: a SentFrame record of the sent frame
     def _SendFrame(self, frame):
-        self.logger.protocol("Sending frame (ID: " + str(frame._id) + "):")
-        self.logger.debug(f"Converting timestamp: local time stamp {frame.timestamp} + offset {self.time_delta_ms} = receiver time stamp {frame._LocalTimeToReceiverTime(self.time_delta_ms)}")
-        frameBytes = frame.ToBytes(self.time_delta_ms)
-        self.logger.debug("Frame:\n" + str(frame))
-        self.logger.debug("Total Frame size: %d Bytes" % (len(frameBytes)))
-        self.logger.debug("Device Buffer usage before sending: " + str(len(self._unansweredFrames)) + "/" + str(self.configuration.frameBufferSize))
+        self.logger.protocol("Sending frame (ID: %d):", frame._id)
+        if (frame.timestamp != 0):
+            # extrapolate the time offset to the current time
+            self.time_delta_ms = self.syncEstimator.Offset(time.time_ns() // 1000000)
+        tracer = self.tracer
+        if (tracer is not None):
+            encodeStart = tracer.Now()
+        if (self.bodyCache is not None):
+            # send the cached body instead of encoding the colors
+            cachedFrame = frame._WithColors(self.bodyCache.Body(frame))
+            cachedFrame._id = frame._id
+            frame = cachedFrame
+        # connections supporting scatter-gather sending get packed colors without copying them behind the header
+        body = frame._PackedBody() if hasattr(self.connection, "SendParts") else None
+        if (body is None):
+            frameSize = frame.ToBytesInto(self._txBuffer, self.time_delta_ms)
+        else:
+            frameSize = Frame.HEADER_SIZE + frame._BodySize()
+            if (len(self._txBuffer) < Frame.HEADER_SIZE):
+                self._txBuffer.extend(bytes(Frame.HEADER_SIZE - len(self._txBuffer)))
+            frame._HeaderInto(self._txBuffer, frameSize - Frame.HEADER_SIZE, self.time_delta_ms)
+        if (tracer is not None):
+            tracer.Record("Frame.ToBytes", encodeStart, tracer.Now(), frameID=frame._id)
+        # NOTE: only pass arguments to the debug logs, so nothing is formatted if debug logging is disabled
+        self.logger.debug("Converting timestamp: local time stamp %d + offset %s", frame.timestamp, self.time_delta_ms)
+        self.logger.debug("Frame:\n%s", frame)
+        self.logger.debug("Total Frame size: %d Bytes", frameSize)
+        self.logger.debug("Device Buffer usage before sending: %d/%d", len(self._unansweredFrames), self.configuration.frameBufferSize)
         #self.logger.debug("Hex Data:\n %s" % (frameBytes.hex()))
+        self.stats.AddSentFrame(frameSize, len(self._unansweredFrames))
 
+        sentFrame = SentFrame(frame, frameSize)
         # save timestamp when frame was sent
-        frame._t_frame_out = time.time_ns() // 1000000
-        self.connection.Send(frameBytes)
+        sentFrame._t_frame_out = time.time_ns() // 1000000
+        self._lastSentFrame = sentFrame
+        if (tracer is not None):
+            sendStart = tracer.Now()
+        # hand the encoded frame to the connection without copying it
+        if (body is None):
+            with memoryview(self._txBuffer) as view, view[:frameSize] as frameBytes:
+                self.connection.Send(frameBytes)
+        else:
+            with memoryview(self._txBuffer) as view, view[:Frame.HEADER_SIZE] as header, body:
+                self.connection.SendParts([header, body])
+        if (tracer is not None):
+            tracer.Record("connection.Send", sendStart, tracer.Now(), frameID=frame._id)
+        return sentFrame
+
+    # function calculating the frames which are sent for the given frame
+    # @param frame: the frame which should be sent
+    # @return: a list of frames resulting in the same LED state on the device as the given frame
+    def _FramesToSend(self, frame):
+        # only send the changed LEDs if delta mode is enabled
+        if (self.deltaMode):
+            frames = self._DeltaFrames(frame)
+        else:
+            frames = [frame]
+        if (getattr(self.connection, "maxFrameSize", None) is not None):
+            frames = self._SplitFrames(frames, self.connection.maxFrameSize)
+        return frames
+
+    # function splitting frames which are larger than the given size into frames with an offset
+    # Used for connections which can only send frames of limited size at once, e.g. UDP datagrams within the MTU.
+    # All parts keep the time stamp of their frame, so they are shown at the same time.
+    # Only frames without a command or with the clear command are split; the clear command is sent with the first part
+    # @param frames: a list of frames
+    # @param maxFrameSize: the maximum size of a frame including its header in bytes
+    # @return: a list of frames which are not larger than maxFrameSize if possible
+    def _SplitFrames(self, frames, maxFrameSize):
+        maxLeds = (maxFrameSize - Frame.HEADER_SIZE) // 3
+        result = []
+        for frame in frames:
+            bodySize = frame._BodySize()
+            if (Frame.HEADER_SIZE + bodySize <= maxFrameSize or frame.command not in (Command.NONE, Command.CLEAR)):
+                result.append(frame)
+                continue
+            body = frame._PackedBody()
+            if (body is None):
+                body = memoryview(frame._BodyToBytes())
+            for start in range(0, bodySize // 3, maxLeds):
+                part = Frame()
+                part.colors = body[start * 3:(start + maxLeds) * 3]
+                part.offset = frame.offset + start
+                part.timestamp = frame.timestamp
+                part.command = frame.command if start == 0 else Command.NONE
+                result.append(part)
+        return result
+
+    # function calculating the frames to send in delta mode.
+    # The given frame is applied to the known LED state of the device and only the changed
+    # spans of LEDs are returned as frames with an offset.
+    # @param frame: the frame which should be sent
+    # @return: a list of frames resulting in the same LED state on the device as the given frame
+    def _DeltaFrames(self, frame):
+        ledCount = self.configuration.ledCount
+        # encode the body only once and reuse the packed colors for all resulting frames
+        if (self.bodyCache is not None and frame._PackedBody() is None):
+            body = self.bodyCache.Body(frame)
+        else:
+            body = frame._BodyToBytes()
+        frame = frame._WithColors(body)
+        oldState = self._ledState
+
+        if (frame.command == Command.CLEAR):
+            # all other LEDs are set to black by the clear command
+            newState = bytearray(ledCount * 3)
+        elif (frame.command == Command.NONE and oldState is not None):
+            newState = bytearray(oldState)
+        else:
+            # state of the other LEDs is unknown
+            newState = None
+
+        if (frame.offset < 0 or frame.offset * 3 + len(body) > ledCount * 3):
+            # invalid frame, let the device reject it
+            self._ledState = None
+            return [frame]
+
+        if (newState is None):
+            # the state is only known if the frame sets all LEDs
+            if (frame.offset == 0 and len(body) == ledCount * 3):
+                self._ledState = bytearray(body)
+            else:
+                self._ledState = None
+            return [frame]
+
+        newState[frame.offset * 3:frame.offset * 3 + len(body)] = body
+        self._ledState = newState
+        if (frame.command != Command.NONE):
+            return [frame]
+
+        spans = self._MergeSpans(self._FindDirtySpans(oldState, newState))
+        if (len(spans) == 0):
+            # nothing changed; send an empty frame to keep the frame timing and acknowledgement
+            frame.colors = b''
+            frame.offset = 0
+            return [frame]
+
+        deltaSize = sum((end - start) * 3 + self._FRAME_OVERHEAD for start, end in spans)
+        if (deltaSize >= len(body) + self._FRAME_OVERHEAD):
+            # sending the delta is not cheaper than the original frame
+            return [frame]
+
+        frames = []
+        for start, end in spans:
+            spanFrame = Frame()
+            spanFrame.colors = bytes(newState[start * 3:end * 3])
+            spanFrame.offset = start
+            spanFrame.timestamp = frame.timestamp
+            frames.append(spanFrame)
+        self.logger.debug("Delta mode: sending %d frame(s) with %d bytes instead of %d bytes", len(frames), deltaSize, len(body) + self._FRAME_OVERHEAD)
+        return frames
+
+    # function finding all spans of LEDs which differ between two LED states
+    # @param oldState: packed RGB values of the old LED state
+    # @param newState: packed RGB values of the new LED state with the same size as the old state
+    # @return: a sorted list of (start, end) LED index tuples for each changed span, end being exclusive
+    def _FindDirtySpans(self, oldState, newState):
+        if (oldState == newState):
+            return []
+
+        if (numpy is not None):
+            old = numpy.frombuffer(oldState, dtype=numpy.uint8).reshape(-1, 3)
+            new = numpy.frombuffer(newState, dtype=numpy.uint8).reshape(-1, 3)
+            changed = numpy.flatnonzero((old != new).any(axis=1))
+            # split the changed LEDs into consecutive runs
+            breaks = numpy.flatnonzero(numpy.diff(changed) > 1)
+            starts = changed[numpy.concatenate(([0], breaks + 1))]
+            ends = changed[numpy.concatenate((breaks, [changed.size - 1]))] + 1
+            return list(zip(starts.tolist(), ends.tolist()))
+
+        # compare blocks of LEDs first and only check single LEDs in changed blocks
+        blockSize = 16 * 3
+        spans = []
+        for blockStart in range(0, len(newState), blockSize):
+            blockEnd = blockStart + blockSize
+            if (oldState[blockStart:blockEnd] == newState[blockStart:blockEnd]):
+                continue
+            for i in range(blockStart, min(blockEnd, len(newState)), 3):
+                if (oldState[i:i + 3] == newState[i:i + 3]):
+                    continue
+                led = i // 3
+                if (len(spans) > 0 and spans[-1][1] == led):
+                    # extend the previous span
+                    spans[-1][1] = led + 1
+                else:
+                    spans.append([led, led + 1])
+        return [(start, end) for start, end in spans]
+
+    # function merging changed spans of LEDs if sending the unchanged LEDs in between is cheaper
+    # than the overhead of an extra frame. Also limits the number of spans to deltaMaxSpans
+    # @param spans: a sorted list of (start, end) LED index tuples
+    # @return: a sorted list of merged (start, end) LED index tuples
+    def _MergeSpans(self, spans):
+        merged = []
+        for start, end in spans:
+            if (len(merged) > 0 and (start - merged[-1][1]) * 3 <= self._FRAME_OVERHEAD):
+                merged[-1][1] = end
+            else:
+                merged.append([start, end])
+
+        # merge the spans with the smallest gaps until the limit is met
+        while (len(merged) > max(1, self.deltaMaxSpans)):
+            i = min(range(len(merged) - 1), key=lambda i: merged[i + 1][0] - merged[i][1])
+            merged[i][1] = merged[i + 1][1]
+            del merged[i + 1]
+        return [(start, end) for start, end in merged]
 
     # Set all LEDs to black by sending a clear command
     # @param timestamp: the timestamp at which the command should be applied
@@ -207,34 +972,22 @@ class Device:
     # @throws: ConfigurationException if the protocol version of the devices are incompatible
     def _ReadConfiguration(self):
         self.logger.protocol("Waiting for configuration start")
-        # wait for the configuration start byte
-        while(self.connection.Read(1, self._DEFAULT_READ_TIMEOUT) != self._CONFIGURATION_START_BYTE):
-            pass
+        # wait for the configuration
+        event, _ = self._NextEvent(self._DEFAULT_READ_TIMEOUT)
+        while (not isinstance(event, ConfigurationEvent)):
+            event, _ = self._NextEvent(self._DEFAULT_READ_TIMEOUT)
+        config = event.configuration
 
-        config = Configuration()
-        #read in the protocol version
-        config.protocolVersion = self._ReadString()
         # check if the protocol version is compatible
         if (not self._CheckProtocolVersion(config.protocolVersion)):
             self.logger.error("Incompatible protocol versions: Supported versions: " + str(self.PROTOCOL_VERSIONS)+ " but device has: " + config.protocolVersion)
             raise ConfigurationException("Incompatible protocol versions: Supported versions: " + str(self.PROTOCOL_VERSIONS)+ " but device has: " + config.protocolVersion)
 
-        # read the configuration values
-        config.deviceName = self._ReadString()
-        config.ledCount = self._ReadInt(bytes=4)
-        config.frameBufferSize = self._ReadUInt(bytes=1)
-        config.dataPin = self._ReadInt(bytes=4)
-        config.clockPin = self._ReadInt(bytes=4)
-        config.extraValues = self._ReadString()
-
         self.logger.protocol("Received device configuration: " + str(config))
         self._SendByte(self._CONFIGURATION_ACKNOWLEDGEMENT_BYTE)
         self.logger.debug("Configuration acknowledgement sent.")
         return config
 
-
-
-
     # function checking the protocol versions of both devices for compatibility
     # @param protocolVersion: a string representing the protocol version
     # @return: True if versions are compatible, else False
@@ -253,38 +1006,24 @@ class Device:
     def _WaitForConnectionRequest(self):
         self.logger.protocol("Waiting for connection request from device")
         # wait for the connection request
-        while(True):
-            if (self.connection.Read(1, self._DEFAULT_READ_TIMEOUT) == self._CONNECTION_REQUEST_BYTE):
-                self.logger.protocol("Received connection request from device")
-                return
-
-
-
-    # function reading a null-terminated string from the connection
-    # @return: the received utf-8 string
-    def _ReadString(self):
-        receivedBytes = b''
-        # read in all bytes until a null terminator is read
-        b = self.connection.Read(1, self._DEFAULT_READ_TIMEOUT)
-        while(b != b'\x00'):
-            receivedBytes += b
-            b = self.connection.Read(1, self._DEFAULT_READ_TIMEOUT)
-
-        return receivedBytes.decode('utf-8')
-
-    # function reading a 2s complement integer value from the connection
-    # @param bytes: the number of bytes the integer has (eg. 4 Bytes for 32bit Integer)
-    # @return: the received number
-    def _ReadInt(self, bytes):
-        b = self.connection.Read(bytes, self._DEFAULT_READ_TIMEOUT)
-        return int.from_bytes(b, byteorder='big', signed=True)
-    
-    # function reading an unsigned integer value from the connection
-    # @param bytes: the number of bytes the integer has (eg. 4 Bytes for 32bit Integer)
-    # @return: the received number
-    def _ReadUInt(self, bytes):
-        b = self.connection.Read(bytes, self._DEFAULT_READ_TIMEOUT)
-        return int.from_bytes(b, byteorder='big', signed=False)
+        event, _ = self._NextEvent(self._DEFAULT_READ_TIMEOUT)
+        while (not isinstance(event, ConnectionRequestEvent)):
+            event, _ = self._NextEvent(self._DEFAULT_READ_TIMEOUT)
+        self.logger.protocol("Received connection request from device")
+
+    # function returning the next message received from the device
+    # All data available on the connection is read and decoded at once,
+    # so following messages are returned without reading from the connection again
+    # @param timeout: timeout in ms for reading from the connection. 0 for non-blocking mode, None for full blocking mode
+    # @return: a tuple with the decoded event (see ProtocolDecoder) and the time in ms when it was received
+    # @raises: TimeoutError if no complete message is received within the timeout
+    def _NextEvent(self, timeout):
+        while (len(self._receivedEvents) == 0):
+            data = self.connection.ReadAvailable(timeout)
+            receiveTime = time.time_ns() // 1000000
+            for event in self._decoder.Feed(data):
+                self._receivedEvents.append((event, receiveTime))
+        return self._receivedEvents.popleft()
 
     # function sending a single byte over the connection
     def _SendByte(self, b):
@@ -299,26 +1038,31 @@ class Device:
         # Read in all remaining responses, but only truly wait for the first one
 
         # wait until the time stamp of the most recently sent frame is reached
-        if (self._unansweredFrames[-1].timestamp == 0): 
+        newestFrame = next(reversed(self._unansweredFrames.values()))
+        if (newestFrame.timestamp == 0): 
             # time stamps are disabled; don't wait at all
             # NOTE: this is especially needed for cases where the time synchronization is not done yet or inaccurate
             remaining_time = 0
         else: 
 
-            remaining_time = max((time.time_ns() // 1_000_000) - self._unansweredFrames[-1].timestamp, 0)
+            remaining_time = max((time.time_ns() // 1_000_000) - newestFrame.timestamp, 0)
 
-        self.logger.protocol("Waiting for frame response from device for "+ str(remaining_time) + " ms")
+        self.logger.protocol("Waiting for frame response from device for %d ms", remaining_time)
         # check if there is more space in the buffer
         if(len(self._unansweredFrames) >= self.configuration.frameBufferSize):
             # buffer is full; wait additional 15s for response
-            timeout = remaining_time + self._FRAME_DROP_TIMEOUT
+            timeout = remaining_time + self._AckTimeout()
             try:
                 self._HandleFrameResponse(timeout=timeout)
             except TimeoutError:
+                if (getattr(self.connection, "lossy", False)):
+                    # lost frames are expected on lossy connections; keep on sending
+                    self._DropLostFrame()
+                    return
                 # timeout has been reached, treat device to be dead
                 # treat packet as dropped for robustness with lossy communciation protocols
                 # remove oldest frame from buffer
-                dropped_frame = self._unansweredFrames.popleft()
+                dropped_frame = self._DropOldestFrame()
                 # pass exception on to caller
                 self.logger.error(f"TimeoutError: No Frame Acknowledgement or Frame Error for frame {dropped_frame._id} received from receiver within a time of {timeout} ms. Dropped frame from queue.")
                 raise TimeoutError(f"No Frame Acknowledgement or Frame Error for frame {dropped_frame._id} received from receiver within a time of {timeout} ms. Dropped frame from queue.")
@@ -348,85 +1092,143 @@ class Device:
 
 
     def _HandleFrameResponse(self, timeout):
-        # read in next byte from connection, wait until the timeout has passed
-        response = self.connection.Read(1, timeout=timeout)
+        # read in next message from connection, wait until the timeout has passed
+        event, _t_response_in = self._NextEvent(timeout)
+        tracer = self.tracer
+        if (tracer is not None):
+            handleStart = tracer.Now()
 
-        # read in all the trash that is on the line and print it out for debugging
-        # this may happen if parts of the answer were dropped or when debugging
-        while (not (response == self._FRAME_ACKNOWLEDGEMENT_BYTE or response == self._FRAME_ERROR_BYTE)):
-            self.logger.debug("Received Unknown Response: " + str(response))
-            response = self.connection.Read(1, timeout=timeout)
+        # skip all other messages, e.g. repeated connection requests
+        while (not isinstance(event, (FrameAcknowledgementEvent, FrameErrorEvent))):
+            self.logger.debug("Received Unexpected Message: " + type(event).__name__)
+            event, _t_response_in = self._NextEvent(timeout)
 
         # handle response
-        if(response == self._FRAME_ACKNOWLEDGEMENT_BYTE):
-            # read in the acknowledgement data
-            response_id = self._ReadUInt(bytes=1)
-            _t_receiver_in = self._ReadUInt(bytes=4)
-            _t_receiver_out = self._ReadUInt(bytes=4)
-
-            self.logger.protocol(f"Received frame acknowledgement: ID: {response_id}")
-            # find corresponding frame
-            frame = self._PopFrameWithID(response_id, self._unansweredFrames)
-
-            # save response timestamp in ms
-            frame._t_response_in = time.time_ns() // 1000000
-
-            # read in timestamps from receiver
-            frame._t_receiver_in = _t_receiver_in
-            frame._t_receiver_out = _t_receiver_out
-
+        if(isinstance(event, FrameAcknowledgementEvent)):
+            response_id = event.frameID
+            _t_receiver_in = event.t_receiver_in
+            _t_receiver_out = event.t_receiver_out
+
+            self.logger.protocol("Received frame acknowledgement: ID: %d", response_id)
+            with self._lock:
+                # find corresponding frame
+                frame = self._PopFrameWithID(response_id)
+                if (frame is not None):
+                    frame._t_response_in = _t_response_in
+                    # read in timestamps from receiver
+                    frame._t_receiver_in = _t_receiver_in
+                    frame._t_receiver_out = _t_receiver_out
+                    self.stats.AddAcknowledgement(frame)
+
+                    # all timestamps are saved, update time synchronization
+                    # with the frame's time stamps
+                    self._SynchronizeDeviceTime(frame)
+                    self._UpdatePacingEstimate(frame)
+                    self._UpdateTxLatencyEstimate(frame)
+                self._lock.notify_all()
+
+            if (frame is None):
+                return
             # call the callback function if defined
             if(self._onFrameResponse is not None):
                 self._onFrameResponse(frame)
-
-            # all timestamps are saved, update time synchronization
-            # with the frame's time stamps 
-            self._SynchronizeDeviceTime(frame)
+            if (frame._future is not None):
+                frame._future.set_result(frame)
+            if (tracer is not None):
+                self._TraceResponse(tracer, frame, handleStart)
             return
         
-        elif (response == self._FRAME_ERROR_BYTE):
+        else:
             # response is a frame error
-            response_id = self._ReadUInt(bytes=1)
-            error_code = ErrorCode(self._ReadUInt(bytes=1))
-            self.logger.error("Received ALUP Frame Error for frame ID " + str(response_id) + ". Error Code: " + str(error_code.name) + "(" + str(error_code.value) +")")
-            # remove frame as it now is answered
-            self._PopFrameWithID(response_id, self._unansweredFrames)
+            response_id = event.frameID
+            error_code = ErrorCode(event.errorCode)
+            self.logger.error("Received ALUP Frame Error for frame ID %d. Error Code: %s(%d)", response_id, error_code.name, error_code.value)
+            with self._lock:
+                self.stats.frameErrors[error_code] += 1
+                # remove frame as it now is answered
+                frame = self._PopFrameWithID(response_id)
+                # the frame was not applied, so the LED state of the device is unknown now
+                self._ledState = None
+                self._lock.notify_all()
+            if (frame is not None and frame._future is not None):
+                frame._future.set_exception(FrameException(response_id, error_code))
             #TODO: maybe throw an exception here?
             return
-        # If the received data is neither a frame error or acknowledgement it gets ignored
-
 
 
                
 
-    # pop the first frame with the given id from the given queue of frames
+    # function recording the spans of an acknowledged frame
+    # Besides the handling of the acknowledgement, the processing on the device and the time the
+    # frame is shown are recorded on a separate track of the device, converted to the sender's time
+    # @param tracer: the Tracer to record the spans with
+    # @param frame: the SentFrame record of the acknowledged frame
+    # @param handleStart: the time the handling of the acknowledgement started in ns
+    def _TraceResponse(self, tracer, frame, handleStart):
+        tracer.Record("Device._HandleFrameResponse", handleStart, tracer.Now(), frameID=frame._id)
+        track = tracer.Track(f"{self.configuration.deviceName} ({self.connection})")
+        tracer.Record("Receiver",
+                      tracer.FromUnixTimeMs(frame._t_receiver_in - self.time_delta_ms),
+                      tracer.FromUnixTimeMs(frame._t_receiver_out - self.time_delta_ms),
+                      track=track, frameID=frame._id)
+        if (frame.timestamp != 0):
+            tracer.Record("Apply", tracer.FromUnixTimeMs(frame.timestamp), track=track, frameID=frame._id)
+
+    # function returning a free ID for the next frame
+    # IDs of unanswered frames are never reused. IDs of dropped frames are only reused
+    # if there is no other free ID, so that late responses for them can be recognized
+    # @return: the frame ID to use
+    def _AllocateFrameID(self):
+        if (len(self._unansweredFrames) >= self._FRAME_ID_COUNT):
+            raise RuntimeError(f"All {self._FRAME_ID_COUNT} frame IDs are in use by unanswered frames")
+        if (len(self._unansweredFrames) + len(self._droppedFrameIDs) >= self._FRAME_ID_COUNT):
+            # give up the ID of the frame which was dropped first
+            self._droppedFrameIDs.popitem(last=False)
+
+        id = self._nextFrameID
+        while (id in self._unansweredFrames or id in self._droppedFrameIDs):
+            id = (id + 1) % self._FRAME_ID_COUNT
+        self._nextFrameID = (id + 1) % self._FRAME_ID_COUNT
+        self._answeredFrameIDs.discard(id)
+        return id
+
+    # function adding a sent frame to the unanswered frames
+    # @param frame: the SentFrame record of the sent frame
+    def _AddUnansweredFrame(self, frame):
+        self._unansweredFrames[frame._id] = frame
+
+    # function removing the oldest unanswered frame after it timed out
+    # @return: the SentFrame record of the dropped frame
+    def _DropOldestFrame(self):
+        id, frame = self._unansweredFrames.popitem(last=False)
+        self._droppedFrameIDs[id] = None
+        self.stats.timeouts += 1
+        # the LED state of the device is unknown now
+        self._ledState = None
+        return frame
+
+    # pop the unanswered frame with the given id
+    # Responses which do not belong to an unanswered frame are counted as late, duplicate or unknown
     # @param id: the ID of the frame to pop
-    # @param queue: a deque containing frames
     # @return: the found and removed frame. None if not found
-    def _PopFrameWithID(self, id : int, queue : collections.deque) -> Frame:
-
-        # check if queue has items
-        if len(queue) == 0:
-            return None
-        
-        # find the element with the ID by rotating through the 
-        # queue and checking the ID of the leftmost element
-        # this is implemented according to the recommendations in the python docs: 
-        # https://docs.python.org/3/library/collections.html#collections.deque
-        for i in range(len(queue)):
-            if (queue[0]._id == id):
-                # found matching ID 
-                frame = queue.popleft()
-                # rotate queue back to original state 
-                queue.rotate(i)
-                self.logger.debug("Found frame with ID " + str(id) + " in deque at index " + str(i))
-                return frame
-            queue.rotate(-1) 
-         
-        # went through whole queue but did not find frame with ID
-        # This should never happen because we only wait for answers of frames which 
-        # were actually sent at some point
-        self.logger.error("Could not find frame with ID " + str(id) + " in deque: " + str([str(i._id) for i in self._unansweredFrames]))
+    def _PopFrameWithID(self, id : int) -> SentFrame:
+        frame = self._unansweredFrames.pop(id, None)
+        if (frame is not None):
+            self._answeredFrameIDs.add(id)
+            return frame
+
+        if (id in self._droppedFrameIDs):
+            # the frame was already dropped because its response took too long
+            del self._droppedFrameIDs[id]
+            self._answeredFrameIDs.add(id)
+            self.lateResponses += 1
+            self.logger.warning(f"Received late response for dropped frame with ID {id}")
+        elif (id in self._answeredFrameIDs):
+            self.duplicateResponses += 1
+            self.logger.warning(f"Received duplicate response for frame with ID {id}")
+        else:
+            self.unknownResponses += 1
+            self.logger.error(f"Received response for unknown frame ID {id}. Unanswered frames: {list(self._unansweredFrames)}")
         return None
     
 
@@ -441,13 +1243,18 @@ class Device:
         # With: 
         # time_delta_ms = time_receiver -  time_sender
         self._time_delta_ms_raw = (-frame._t_frame_out + frame._t_receiver_in + frame._t_receiver_out - frame._t_response_in)/ 2
-        # we collect multiple measurements and take the median to smooth out inconsistencies
-        self._time_deltas_ms_raw.append(self._time_delta_ms_raw)
-        self.time_delta_ms = statistics.median(self._time_deltas_ms_raw)
-        self.logger.protocol(f"Synchronizing Time (Frame {frame._id}): t1: {frame._t_frame_out} t2: {frame._t_receiver_in} t3: {frame._t_receiver_out} t4: {frame._t_response_in}\nResult: {self._time_delta_ms_raw}")
-        self.logger.protocol(f"TX Latency:  {frame._t_receiver_in - frame._t_frame_out}ms (corrected {frame._t_receiver_in - frame._t_frame_out - self.time_delta_ms}ms)")
-        self.logger.protocol(f"RX Latency:  {frame._t_response_in - frame._t_receiver_out}ms (corrected {frame._t_response_in - frame._t_receiver_out + self.time_delta_ms}ms)")
-        self.logger.protocol(f"RTT by Time Stamps: {frame._t_response_in- frame._t_frame_out}ms; ")
+        # the round-trip time without the processing time on the receiver
+        rtt = (frame._t_response_in - frame._t_frame_out) - (frame._t_receiver_out - frame._t_receiver_in)
+        # we collect multiple measurements and let the estimator smooth out inconsistencies
+        accepted = self.syncEstimator.AddSample((frame._t_frame_out + frame._t_response_in) / 2, self._time_delta_ms_raw, rtt)
+        self.time_delta_ms = self.syncEstimator.Offset(frame._t_response_in)
+        if (accepted and self._calibrationEstimates is not None):
+            self._calibrationEstimates.append(self.time_delta_ms)
+        if (self.logger.isEnabledFor(logging.PROTOCOL)):
+            self.logger.protocol(f"Synchronizing Time (Frame {frame._id}): t1: {frame._t_frame_out} t2: {frame._t_receiver_in} t3: {frame._t_receiver_out} t4: {frame._t_response_in}\nResult: {self._time_delta_ms_raw}")
+            self.logger.protocol(f"TX Latency:  {frame._t_receiver_in - frame._t_frame_out}ms (corrected {frame._t_receiver_in - frame._t_frame_out - self.time_delta_ms}ms)")
+            self.logger.protocol(f"RX Latency:  {frame._t_response_in - frame._t_receiver_out}ms (corrected {frame._t_response_in - frame._t_receiver_out + self.time_delta_ms}ms)")
+            self.logger.protocol(f"RTT by Time Stamps: {frame._t_response_in- frame._t_frame_out}ms; ")
 
 
 # an enum containing all supported ALUP commands
@@ -459,3 +1266,12 @@ class ErrorCode(IntEnum):
 
 class ConfigurationException(Exception):
     pass
+
+# exception for frames which were answered with a frame error by the device
+class FrameException(Exception):
+    # @param frameID: the ID of the rejected frame
+    # @param errorCode: the ErrorCode sent by the device
+    def __init__(self, frameID, errorCode):
+        super().__init__(f"Frame {frameID} was rejected by the device: {errorCode.name} ({errorCode.value})")
+        self.frameID = frameID
+        self.errorCode = errorCode
@@ -1,10 +1,31 @@
 from enum import IntEnum
+import array
+import struct
+import sys
+
+try:
+    import numpy
+except ImportError:
+    # numpy is optional; it is only needed when colors are given as numpy arrays
+    numpy = None
 
 
 class Frame:
+    __slots__ = ('colors', 'offset', 'timestamp', 'command', '_id')
+
+    # precompiled struct for the frame header:
+    # ID (uint8), command (uint8), body size (int32), offset (int32), time stamp (uint32)
+    _HEADER_STRUCT = struct.Struct('>BBiiI')
+    # the size of the frame header in bytes
+    HEADER_SIZE = _HEADER_STRUCT.size
+
     def __init__(self):
         # an array containing the color for each LED
         # each color is represented as hex integer (e.g. 0x00ff00)
+        # Supported types:
+        #   - a list/tuple or array.array of integer colors (e.g. [0xffffff, 0x00ff00])
+        #   - a numpy array of integer colors with shape (N,) or of uint8 RGB values with shape (N, 3)
+        #   - a bytes, bytearray or memoryview object containing packed RGB values (3 bytes per LED)
         self.colors = []
         # the offset of the color values
         self.offset = 0
@@ -19,37 +40,66 @@ class Frame:
 
         self._id = 0 # the ID of this frame for identifying the corresponding response; unsigned 8bit integer (0-255)
 
-        # time stamps for the frame in ms
-        self._t_frame_out = 0 # time when frame was sent out
-        self._t_receiver_in = 0 # time when receiver got the frame
-        self._t_receiver_out = 0 # time when receiver sent out acknowledgement
-        self._t_response_in = 0 # time when acknowledgement was received
+    # function returning a shallow copy of this frame with different colors
+    # @param colors: the colors of the new frame
+    # @return: a new frame with the same header values as this frame
+    def _WithColors(self, colors):
+        frame = Frame()
+        frame.colors = colors
+        frame.offset = self.offset
+        frame.timestamp = self.timestamp
+        frame.command = self.command
+        return frame
 
     # function returning a binary representation of this frame according to
     # the ALUP protocol definition
     # @param time_delta_ms: the time offset for the device this frame is sent to
     # @return: a bytes object containing this frame
     def ToBytes(self, time_delta_ms):
-        b = b''
-        b += self._HeaderToBytes(time_delta_ms)
-        b += self._BodyToBytes()
-        return b
+        buffer = bytearray(self.HEADER_SIZE + self._BodySize())
+        self.ToBytesInto(buffer, time_delta_ms)
+        return bytes(buffer)
+
+    # function writing the binary representation of this frame into the given buffer
+    # without allocating intermediate bytes objects
+    # @param buffer: a writable bytes-like object (e.g. a bytearray) to write the frame to, starting at index 0.
+    #                A bytearray is grown if it is too small for the frame, other buffers have to be large enough
+    # @param time_delta_ms: the time offset for the device this frame is sent to
+    # @return: the number of bytes written to the buffer
+    # @raises: ValueError if the buffer is too small and can not be grown
+    def ToBytesInto(self, buffer, time_delta_ms):
+        bodySize = self._BodySize()
+        size = self.HEADER_SIZE + bodySize
+        if (len(buffer) < size):
+            if (not isinstance(buffer, bytearray)):
+                raise ValueError(f"Buffer of {len(buffer)} bytes is too small for a frame of {size} bytes")
+            buffer.extend(bytes(size - len(buffer)))
+
+        self._HeaderInto(buffer, bodySize, time_delta_ms)
+        with memoryview(buffer) as view, view[self.HEADER_SIZE:size] as body:
+            self._BodyInto(body)
+        return size
 
     # function returning a binary representation of this frame's header
     # @param time_delta_ms: the time offset for the device this frame is sent to
     # @return: a bytes object containing the header of this frame
     def _HeaderToBytes(self, time_delta_ms):
-        #convert the header values into binary format
-        b = self._id.to_bytes(1, byteorder='big', signed=False)
-        b += self.command.value.to_bytes(1, byteorder='big', signed=False)
-        b += (len(self.colors) * 3).to_bytes(4, byteorder='big', signed=True)
-        b += self.offset.to_bytes(4, byteorder='big', signed=True)
-        
-        receiver_time_stamp = self._LocalTimeToReceiverTime(time_delta_ms)
-        b += receiver_time_stamp.to_bytes(4, byteorder='big', signed=False)
-        # return the parsed bytes
-        return b
-    
+        buffer = bytearray(self.HEADER_SIZE)
+        self._HeaderInto(buffer, self._BodySize(), time_delta_ms)
+        return bytes(buffer)
+
+    # function writing the header of this frame to the start of the given buffer
+    # @param buffer: a writable bytes-like object with at least HEADER_SIZE bytes
+    # @param bodySize: the size of the frame body in bytes
+    # @param time_delta_ms: the time offset for the device this frame is sent to
+    def _HeaderInto(self, buffer, bodySize, time_delta_ms):
+        self._HEADER_STRUCT.pack_into(buffer, 0,
+                                      self._id,
+                                      int(self.command),
+                                      bodySize,
+                                      self.offset,
+                                      self._LocalTimeToReceiverTime(time_delta_ms))
+
     # Convert the frame's time stamp in the receiver's time domain 
     # by using the time synchronization data
     # @param time_delta_ms: the time offset for the device this frame is sent to
@@ -62,19 +112,61 @@ class Frame:
         # NOTE: Limit the timestamp to 32 bit unsigned integer values
         return int((self.timestamp + time_delta_ms) % 2**32)
 
+    # function returning the size of this frame's body in bytes
+    # without encoding it
+    # @return: the number of bytes the body of this frame has
+    def _BodySize(self):
+        colors = self.colors
+        if isinstance(colors, (bytes, bytearray, memoryview)):
+            # packed RGB values
+            size = memoryview(colors).nbytes
+            if (size % 3 != 0):
+                raise ValueError(f"Packed RGB colors need 3 bytes per LED but got {size} bytes")
+            return size
+        if (numpy is not None and isinstance(colors, numpy.ndarray)):
+            if (colors.ndim == 1 and colors.dtype == numpy.uint8):
+                # packed RGB values in a flat byte array
+                if (colors.size % 3 != 0):
+                    raise ValueError(f"Packed RGB colors need 3 bytes per LED but got {colors.size} bytes")
+                return colors.size
+            return colors.shape[0] * 3
+        return len(colors) * 3
+
     # function returning a binary representation of this frame's body
     # @return: a bytes object containing the body of this frame
     def _BodyToBytes(self):
-        b = b''
-        for color in self.colors:
-            # convert each hex color into binary and append the result
-            b += color.to_bytes(3, byteorder='big', signed = False)
-        return b
-    
+        body = bytearray(self._BodySize())
+        self._BodyInto(memoryview(body))
+        return bytes(body)
+
+    # function returning the body of this frame without copying it, if the colors are already packed RGB values
+    # @return: a byte memoryview of the colors or None if the colors have to be encoded first
+    def _PackedBody(self):
+        colors = self.colors
+        if isinstance(colors, (bytes, bytearray, memoryview)):
+            return memoryview(colors).cast('B')
+        if (numpy is not None and isinstance(colors, numpy.ndarray) and colors.dtype == numpy.uint8
+                and colors.flags.c_contiguous and (colors.ndim == 1 or colors.shape[1:] == (3,))):
+            return memoryview(colors).cast('B')
+        return None
+
+    # function writing the body of this frame into the given buffer
+    # @param target: a writable byte memoryview with exactly the size of the body (see _BodySize())
+    def _BodyInto(self, target):
+        colors = self.colors
+        if isinstance(colors, (bytes, bytearray, memoryview)):
+            # colors are already packed RGB values
+            with memoryview(colors) as packed, packed.cast('B') as raw:
+                target[:] = raw
+        elif (numpy is not None and isinstance(colors, numpy.ndarray)):
+            _NumpyColorsInto(colors, target)
+        else:
+            _IntColorsInto(colors, target)
+
     def __str__(self):
         output = "Header:" \
         "\n\tID: " + str(self._id) + \
-        "\tFrame Body Size: " + str(len(self.colors) * 3) + \
+        "\tFrame Body Size: " + str(self._BodySize()) + \
         "\n\tFrame Body Offset: " + str(self.offset) + \
         "\n\tTime Stamp: " + str(self.timestamp) + \
         "\n\tCommand: " + self.command.name  + " (" + str(self.command.value) + ")" + \
@@ -82,6 +174,77 @@ class Frame:
         return output
 
 
+# A compact record of a sent frame which is kept until the frame's response is received.
+# Only stores the header values and time stamps but not the colors of the frame,
+# so the frame itself can be modified or reused as soon as it was sent.
+class SentFrame:
+    __slots__ = ('_id', 'command', 'offset', 'timestamp', 'size',
+                 '_t_frame_out', '_t_receiver_in', '_t_receiver_out', '_t_response_in',
+                 '_future')
+
+    # @param frame: the frame which is sent
+    # @param size: the total size of the sent frame in bytes
+    def __init__(self, frame, size):
+        self._id = frame._id # the ID of the frame for identifying the corresponding response
+        self.command = frame.command
+        self.offset = frame.offset
+        self.timestamp = frame.timestamp # the local time stamp of the frame
+        self.size = size
+
+        # time stamps for the frame in ms
+        self._t_frame_out = 0 # time when frame was sent out
+        self._t_receiver_in = 0 # time when receiver got the frame
+        self._t_receiver_out = 0 # time when receiver sent out acknowledgement
+        self._t_response_in = 0 # time when acknowledgement was received
+
+        # a concurrent.futures.Future resolved when the frame is answered; None for frames sent with Device.Send()
+        self._future = None
+
+    def __str__(self):
+        return f"SentFrame(ID: {self._id}, Command: {self.command.name}, Size: {self.size} Bytes, Time Stamp: {self.timestamp})"
+
+
+# convert a sequence of integer colors (e.g. a list or an array.array) to packed RGB values
+# The conversion is done in C by packing all colors as 32bit big endian values
+# and then dropping the most significant byte of each color
+# @param colors: a sequence of integer colors in the range 0x000000 to 0xffffff
+# @param target: a writable byte memoryview with 3 bytes per color
+def _IntColorsInto(colors, target):
+    # NOTE: raises an OverflowError for negative colors
+    values = array.array('I', colors)
+    if (sys.byteorder == 'little'):
+        values.byteswap()
+    width = values.itemsize
+    with memoryview(values) as view, view.cast('B') as raw:
+        # the most significant bytes of each color have to be zero
+        if (any(raw[i::width].tobytes().strip(b'\x00') for i in range(width - 3))):
+            raise OverflowError("Color values have to be in the range 0x000000 to 0xffffff")
+        target[0::3] = raw[width - 3::width]
+        target[1::3] = raw[width - 2::width]
+        target[2::3] = raw[width - 1::width]
+
+# convert a numpy array of colors to packed RGB values
+# @param colors: a numpy array with either integer colors with shape (N,),
+#                uint8 RGB values with shape (N, 3) or packed uint8 RGB values with shape (3*N,)
+# @param target: a writable byte memoryview with 3 bytes per color
+def _NumpyColorsInto(colors, target):
+    out = numpy.frombuffer(target, dtype=numpy.uint8)
+    if (colors.ndim == 2):
+        if (colors.shape[1] != 3):
+            raise ValueError(f"RGB color arrays need a shape of (N, 3) but got {colors.shape}")
+        if (colors.dtype != numpy.uint8 and colors.size > 0 and (colors.min() < 0 or colors.max() > 0xff)):
+            raise OverflowError("RGB values have to be in the range 0 to 255")
+        out.reshape(-1, 3)[:] = colors
+    elif (colors.dtype == numpy.uint8):
+        # already packed RGB values
+        out[:] = colors
+    else:
+        if (colors.size > 0 and (colors.min() < 0 or colors.max() > 0xffffff)):
+            raise OverflowError("Color values have to be in the range 0x000000 to 0xffffff")
+        # convert to 32bit big endian and drop the most significant byte of each color
+        out.reshape(-1, 3)[:] = colors.astype('>u4').view(numpy.uint8).reshape(-1, 4)[:, 1:]
+
+
 # an enum containing all supported ALUP commands
 class Command(IntEnum):
     NONE = 0
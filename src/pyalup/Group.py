@@ -1,42 +1,217 @@
 from .Device import Device
-from .Frame import Command
+from .Frame import Frame, Command
+from .Statistics import DeviceStatistics
 
+from concurrent.futures import ThreadPoolExecutor, wait
 import threading
+import logging
 import time
 from timeit import default_timer as timer
 
+# the connect functions of Device for the connection types of Group.ConnectAll()
+_CONNECT_FUNCTIONS = {
+    "tcp": "TcpConnect",
+    "udp": "UdpConnect",
+    "serial": "SerialConnect",
+}
+
+class AlignedCommit:
+    """
+    The frames sent by one Group.SendAligned() call
+
+    Once the devices acknowledged their frames, ApplySkew() estimates how late each device applied
+    its frame compared to the common time stamp, based on the times the devices received their frames.
+    """
+
+    def __init__(self, timestamp, frames):
+        # the common time stamp of all frames in ms (sender time)
+        self.timestamp = timestamp
+        # the SentFrame record of each device's frame by device; filled in when acknowledged
+        self.frames = frames
+
+    def ApplySkew(self):
+        """
+        Estimate how late each device applied its frame.
+        A frame which arrived in time is applied at the time stamp; a frame which arrived late is applied
+        as soon as it arrived. The arrival is the receiver time stamp of the acknowledgement converted to
+        sender time. NOTE: the time the device sent its acknowledgement is only an upper bound for the
+        apply time, as the device may acknowledge a frame long after applying it.
+
+        @return: a dict with the delay in ms after the common time stamp for each device (0 if in time,
+                 +/- device.syncUncertainty), or None for devices which did not acknowledge their frame yet
+        """
+        skew = {}
+        for device, frame in self.frames.items():
+            if (frame is None or frame._t_response_in == 0):
+                skew[device] = None
+                continue
+            arrived = frame._t_receiver_in - device.time_delta_ms
+            skew[device] = max(arrived - self.timestamp, 0)
+        return skew
+
+    def MaxSkew(self):
+        """
+        @return: the largest difference in ms between the apply times of the devices which acknowledged their frames,
+                 or None if no device acknowledged its frame yet
+        """
+        skews = [skew for skew in self.ApplySkew().values() if skew is not None]
+        if (len(skews) == 0):
+            return None
+        return max(skews) - min(skews)
+
+    def __str__(self):
+        out = f"Aligned commit at {self.timestamp}\n"
+        for device, skew in self.ApplySkew().items():
+            out += f"\t{device.configuration.deviceName}: " + ("not acknowledged" if skew is None else f"+{skew:.1f} ms") + "\n"
+        return out
+
+
 class Group:
     """
     A group of ALUP devices which are updated synchronously
 
     The colors of each device can be set to the device directly
     and then synchronously sent with its group
+
+    By default, each device is sent to from a persistent pool of worker threads. With an IoEngine,
+    all devices are driven from the calling thread instead, which scales to many more devices.
     
     """
 
-    def __init__(self):
+    # the time in ms SendAligned() gives devices which have no latency measurements yet
+    _DEFAULT_ALIGN_LEAD = 100
+
+    def __init__(self, engine=None, sendDeadline=None):
+        """
+        @param engine: an IoEngine the devices of this group are attached to, or None to send using threads
+        @param sendDeadline: the maximum time in ms Send() waits for the devices, or None to wait for all of them.
+                             Devices which are not done by then are reported in slowDevices and skipped
+                             by the following sends until they are done
+        """
         # the ALUP devices in this group
         self.devices = []
+        # the IoEngine driving the devices or None
+        self.engine = engine
         # the round-trip latency of the last frame sent
         # equivalent to the maximum latency of any device in practice 
         self.latency = 0
+        # the Tracing.Tracer recording the fan-out of Send(); None to disable tracing
+        # NOTE: the spans of the devices themselves are only recorded if device.tracer is set
+        self.tracer = None
+        self.sendDeadline = sendDeadline
+        # the devices which missed the send deadline of the last Send()
+        # With an IoEngine: the devices which did not acknowledge their frames in time
+        self.slowDevices = []
+        # the worker threads sending to the devices; created on the first Send()
+        self._executor = None
+        self._workers = 0
+        # the result of the last send of each device
+        self._sends = {}
+        # the AlignedCommit of the last SendAligned()
+        self.lastCommit = None
+        self.logger = logging.getLogger(__name__)
     
     def Add(self, device: Device):
         """
         Add the given device to this group
         """
+        if (self.engine is not None):
+            self.engine.Attach(device)
         self.devices.append(device)
 
+    def ConnectAll(self, specs, timeout=30_000, calibrate=True, tolerance=None):
+        """
+        Connect to multiple devices at once and add them to this group.
+        The connection, the ALUP handshake and the time calibration run concurrently for all devices,
+        so the startup takes as long as the slowest device instead of the sum of all devices.
+
+        @param specs: a list of connections, each a tuple of the connection type ("tcp", "udp" or "serial")
+                      and the arguments of the matching connect function, optionally followed by a dict
+                      of keyword arguments. E.g. [("tcp", "192.168.0.10", 5012), ("serial", "/dev/ttyUSB0", 115200)]
+        @param timeout: the maximum time in ms to wait for all devices. Devices which are not ready by then
+                        fail with a TimeoutError and are disconnected as soon as their connection finishes
+        @param calibrate: True to calibrate the time synchronization of each device after connecting
+        @param tolerance: see Device.Calibrate()
+        @return: a tuple of the list of connected devices (in the order of specs) and a list of (spec, exception)
+                 tuples for the devices which failed
+        """
+        for spec in specs:
+            if (spec[0] not in _CONNECT_FUNCTIONS):
+                raise ValueError(f"Unknown connection type {spec[0]!r}, expected one of {', '.join(_CONNECT_FUNCTIONS)}")
+        lock = threading.Lock()
+        expired = False
+        # the connected devices by index of their spec
+        ready = {}
+
+        def Connect(index, spec):
+            device = Device()
+            args = spec[1:]
+            kwargs = {}
+            if (len(args) > 0 and isinstance(args[-1], dict)):
+                kwargs = args[-1]
+                args = args[:-1]
+            try:
+                getattr(device, _CONNECT_FUNCTIONS[spec[0]])(*args, **kwargs)
+                if (calibrate):
+                    device.Calibrate(tolerance=tolerance)
+            except BaseException:
+                # release the socket or serial port, so the spec can be retried
+                # NOTE: errors while cleaning up must not hide the original exception
+                closed = False
+                if (device.connected):
+                    try:
+                        device.Disconnect()
+                        closed = True
+                    except Exception as e:
+                        device.logger.warning(f"Could not disconnect after a failed connect: {e!r}")
+                if (not closed and device.connection is not None):
+                    try:
+                        device.connection.Disconnect()
+                    except Exception as e:
+                        device.logger.debug(f"Could not close the connection after a failed connect: {e!r}")
+                raise
+            with lock:
+                if (not expired):
+                    ready[index] = device
+                    return device
+            # the caller gave up on this device already
+            device.logger.warning("Disconnecting %s which was ready after the timeout", device.configuration.deviceName)
+            device.Disconnect()
+            raise TimeoutError("The device was ready after the timeout")
+
+        executor = ThreadPoolExecutor(max_workers=max(len(specs), 1), thread_name_prefix="Group.ConnectAll")
+        connects = [executor.submit(Connect, index, spec) for index, spec in enumerate(specs)]
+        wait(connects, timeout=timeout / 1000)
+        with lock:
+            expired = True
+        # let late devices finish in the background
+        executor.shutdown(wait=False)
+
+        devices = []
+        failures = []
+        for index, (spec, connect) in enumerate(zip(specs, connects)):
+            if (index in ready):
+                device = ready[index]
+                self.Add(device)
+                devices.append(device)
+                continue
+            error = connect.exception() if connect.done() else TimeoutError(f"Not ready within {timeout} ms")
+            self.logger.error(f"Could not connect to {spec}: {error!r}")
+            failures.append((spec, error))
+        return devices, failures
+
     def Remove(self, device: Device):
         """
         Remove the first occurrence of the given device from this group
         """
         self.devices.remove(device)
+        if (self.engine is not None):
+            self.engine.Detach(device)
 
     def Send(self, delayTarget=None):
         """
         Send to all devices in the group at the same time,
-        using multithreading
+        using multithreading or the IoEngine of the group
 
         @param delayTarget: Synchronously update all devices after the given delay target (in ms) passed.
                             All group devices update their LEDs after the given delay target, based on the
@@ -57,23 +232,121 @@ class Group:
 
         # send frame and wait for response while measuring time
         start = timer()
+        tracer = self.tracer
+        if (tracer is not None):
+            traceStart = tracer.Now()
 
-        threads = []
-        # configure one thread for each device
-        for device in self.devices:
-            thread = threading.Thread(target=device.Send)
-            threads.append(thread)
+        frames = self._FramesToSend()
 
-        # start all threads
-        for thread in threads:
-            thread.start()
+        if (self.engine is not None):
+            # the engine writes all frames from this thread
+            errors = self.engine.Send(frames)
+            # devices which did not acknowledge their frames in time are slow, same as missing the send deadline
+            self.slowDevices = [device for device, error in errors.items() if isinstance(error, TimeoutError)]
+            for device, error in errors.items():
+                self.logger.error(f"Sending to {device.configuration.deviceName} failed: {error!r}")
+            self.latency = (timer() - start) * 1000
+            if (tracer is not None):
+                tracer.Record("Group.Send", traceStart, tracer.Now())
+            return
 
-        # wait for all threads to finish
-        for thread in threads:
-            thread.join()
+        # hand the devices to the worker threads
+        # NOTE: a device which is still busy with a previous send is skipped
+        executor = self._Executor()
+        sends = {}
+        busy = []
+        for device in self.devices:
+            previous = self._sends.get(device)
+            if (previous is not None and not previous.done()):
+                busy.append(device)
+                continue
+            if (tracer is None):
+                send = executor.submit(device.Send, frames[device])
+            else:
+                send = executor.submit(self._TracedSend, tracer, device, frames[device])
+            self._sends[device] = send
+            sends[send] = device
+
+        # wait for all devices to finish or the deadline to pass
+        done, notDone = wait(sends, timeout=None if self.sendDeadline is None else self.sendDeadline / 1000)
+        self.slowDevices = busy + [sends[send] for send in notDone]
+        for send in done:
+            if (send.exception() is not None):
+                self.logger.error(f"Sending to {sends[send].configuration.deviceName} failed: {send.exception()!r}")
+        if (len(busy) > 0):
+            self.logger.warning("Skipped devices which are still busy with a previous send: %s",
+                                ", ".join(device.configuration.deviceName for device in busy))
+        if (len(notDone) > 0):
+            self.logger.warning("Devices missed the send deadline of %d ms: %s", self.sendDeadline,
+                                ", ".join(sends[send].configuration.deviceName for send in notDone))
 
         # measure the total latency of the group
         self.latency = (timer() - start)* 1000
+        if (tracer is not None):
+            tracer.Record("Group.Send", traceStart, tracer.Now())
+
+    def _Executor(self):
+        """
+        Get the worker threads for sending, with one worker per device
+        """
+        if (self._executor is None or self._workers < len(self.devices)):
+            if (self._executor is not None):
+                # the old workers exit as soon as their current sends are done
+                self._executor.shutdown(wait=False)
+            self._workers = max(len(self.devices), 1)
+            self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="Group.Send")
+        return self._executor
+
+    def SendAligned(self, margin=2):
+        """
+        Send to all devices so that they apply their frames at the same time, as early as possible.
+        The common time stamp is chosen from the measured transmission latency of each device plus the
+        uncertainty of its time synchronization (see Device.Calibrate()), so every frame arrives before it is due.
+        Devices without measurements yet are given _DEFAULT_ALIGN_LEAD ms.
+        NOTE: This overrides time stamps of all group devices' frames
+
+        @param margin: additional time in ms added to the time stamp, e.g. for the time it takes to start sending
+        @return: an AlignedCommit to check how late each device applied its frame (also stored in lastCommit)
+        """
+        leads = [device._TxLatencyBound() for device in self.devices]
+        lead = max((self._DEFAULT_ALIGN_LEAD if lead is None else lead for lead in leads), default=0)
+        timestamp = time.time_ns() // 1_000_000 + int(lead + margin + 0.5)
+        for device in self.devices:
+            device.frame.timestamp = timestamp
+            device._lastSentFrame = None
+        self.Send()
+        self.lastCommit = AlignedCommit(timestamp, {device: device._lastSentFrame for device in self.devices})
+        return self.lastCommit
+
+    def _FramesToSend(self):
+        """
+        Get the frame to send for each device; None to send the device's own frame.
+        If the frames of multiple devices share the same colors object, the colors are encoded only once
+        and the devices get a copy of their frame with the encoded colors. Only the headers are
+        then encoded per device.
+        """
+        frames = dict.fromkeys(self.devices)
+        byColors = {}
+        for device in self.devices:
+            colors = device.frame.colors
+            if (len(colors) > 0 and device.frame._PackedBody() is None):
+                byColors.setdefault(id(colors), []).append(device)
+        for devices in byColors.values():
+            if (len(devices) > 1):
+                body = devices[0].frame._BodyToBytes()
+                for device in devices:
+                    frames[device] = device.frame._WithColors(body)
+        return frames
+
+    def _TracedSend(self, tracer, device, frame=None):
+        """
+        Send the given frame of the given device, recording the span in the given tracer
+        """
+        start = tracer.Now()
+        try:
+            device.Send(frame)
+        finally:
+            tracer.Record("Device.Send", start, tracer.Now())
 
 
     def SetColors(self, colors):
@@ -81,10 +354,19 @@ class Group:
         Set the colors of all grouped devices, overriding their current color.
         If a device has less LEDs than color values given, the colors given are cut to size for this device.
 
-        @param colors: A list with integer color values.
+        The colors are encoded only once into packed RGB values, which are shared by all devices.
+
+        @param colors: A list with integer color values or any other colors supported by Frame.colors.
         """
+        encoder = Frame()
+        encoder.colors = colors
+        if (encoder._BodySize() == len(colors) * 3):
+            # one entry per LED (not packed RGB values with 3 bytes per LED):
+            # only encode as many colors as the largest device can show
+            encoder.colors = colors[:max((device.configuration.ledCount for device in self.devices), default=0)]
+        body = memoryview(encoder._BodyToBytes())
         for device in self.devices:
-            device.SetColors(colors[:device.configuration.ledCount])
+            device.SetColors(body[:device.configuration.ledCount * 3])
 
     def SetCommand(self, command):
         """
@@ -102,9 +384,27 @@ class Group:
         self.Send()
 
 
+    @property
+    def stats(self):
+        """
+        Statistics of all grouped devices combined into one DeviceStatistics object.
+        Counters and histograms are summed up, the fps is the total frame rate of all devices.
+        Use device.stats to find single devices which are struggling.
+        """
+        return DeviceStatistics.Combine(device.stats for device in self.devices)
+
     def Disconnect(self):
+        # let the devices which missed a send deadline finish first
+        wait(self._sends.values())
+        self._sends.clear()
         for device in self.devices:
+            if (self.engine is not None):
+                # disconnecting uses the device's own connection
+                self.engine.Detach(device)
             device.Disconnect()
+        if (self._executor is not None):
+            self._executor.shutdown()
+            self._executor = None
 
 
     def __str__(self):
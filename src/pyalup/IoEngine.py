@@ -0,0 +1,404 @@
+from .TcpConnection import TcpConnection
+from .UdpConnection import UdpConnection
+from .SerialConnection import SerialConnection
+
+import collections
+import logging
+import os
+import selectors
+import time
+from timeit import default_timer as timer
+
+
+class IoEngine:
+    """
+    Drives the connections of many devices from a single thread
+
+    Instead of one thread per device, the engine waits on the sockets and serial ports of all attached
+    devices with the selectors module (epoll/kqueue/select). Frames are written as soon as the
+    connection of their device is writable and acknowledgements are handled as soon as they arrive,
+    all in the thread calling Send() or Flush().
+
+    While a device is attached, its connection is owned by the engine: Device.Send() and the other
+    sending functions of the device must not be used until it is detached again (see Group(engine=...)).
+
+    Supports TCP, UDP and serial connections with a file descriptor (not on Windows).
+    Devices connected over a shared UdpEndpoint are not supported, as the endpoint already receives
+    for all of its devices in one thread.
+
+    Example:
+        engine = IoEngine()
+        group = Group(engine=engine)
+        group.Add(device)
+        group.Send()
+    """
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        # the channels of all attached devices by device
+        self._channels = {}
+        self.logger = logging.getLogger(__name__)
+
+    # function handing the connection of the given device to the engine
+    # All frames of the device which are not answered yet are flushed first
+    # @param device: a connected Device
+    # @raises: ValueError if the connection type is not supported
+    def Attach(self, device):
+        if (device in self._channels):
+            return
+        if (getattr(device, "_readerThread", None) is not None):
+            raise ValueError("Devices using SendNoWait() or SendLatest() can not be attached to an IoEngine")
+        device.FlushBuffer()
+        channel = _Channel(device)
+        self._channels[device] = channel
+        self._selector.register(channel.fileobj, selectors.EVENT_READ, channel)
+        device.connection = _EngineConnection(self, channel)
+
+    # function giving the given device its own connection back
+    # Writes all data which is still pending first
+    def Detach(self, device):
+        channel = self._channels.get(device)
+        if (channel is None):
+            return
+        self._Run(lambda: len(channel.pending) == 0)
+        if (not channel.closed):
+            self._selector.unregister(channel.fileobj)
+        del self._channels[device]
+        device.connection = channel.connection
+
+    # function sending a frame to each of the given devices
+    # Returns as soon as all frames were written. Like Device.Send(), only waits for acknowledgements
+    # if the buffer of a device is full; all acknowledgements received meanwhile are handled.
+    # @param devices: an iterable of attached devices, or a dict of attached devices to the frames to send.
+    #                 If a device is given without a frame, device.frame is sent
+    # @return: a dict of the devices which failed to the raised exceptions
+    def Send(self, devices):
+        frames = devices if isinstance(devices, dict) else dict.fromkeys(devices)
+        start = timer()
+        channels = []
+        for device, frame in frames.items():
+            channel = self._channels[device]
+            # drop the lost frames before computing the delta, so it is not based on frames the device never showed
+            self._ExpireLostFrames(channel)
+            channel.backlog.extend(device._FramesToSend(device.frame if frame is None else frame))
+            channel.error = None
+            channel.start = start
+            channels.append(channel)
+        self._Run(lambda: all(len(channel.backlog) == 0 and len(channel.pending) == 0 for channel in channels))
+        return {channel.device: channel.error for channel in channels if channel.error is not None}
+
+    # function waiting until all frames of the attached devices are answered or dropped
+    # @param timeout: the maximum time to wait in ms
+    # @return: a dict of the devices which failed to the raised exceptions.
+    #          Devices with frames which were not answered within the timeout fail with a TimeoutError
+    def Flush(self, timeout=10_000):
+        channels = list(self._channels.values())
+        for channel in channels:
+            channel.error = None
+        self._Run(lambda: all(len(channel.device._unansweredFrames) == 0 and len(channel.pending) == 0 for channel in channels),
+                  deadline=timer() + timeout / 1000)
+        for channel in channels:
+            if (channel.error is None and len(channel.device._unansweredFrames) > 0):
+                channel.error = TimeoutError(f"No response for {len(channel.device._unansweredFrames)} frames received within {timeout} ms")
+        return {channel.device: channel.error for channel in channels if channel.error is not None}
+
+    # function handling all I/O of the attached devices until the given condition is met
+    # @param done: a function returning True once the engine should stop
+    # @param deadline: the timer() value after which to stop anyways, or None
+    def _Run(self, done, deadline=None):
+        while True:
+            for channel in self._channels.values():
+                self._SubmitBacklog(channel)
+            if (done()):
+                return
+            timeout = self._NextTimeout()
+            if (deadline is not None):
+                remaining = deadline - timer()
+                if (remaining <= 0):
+                    return
+                timeout = remaining if timeout is None else min(timeout, remaining)
+            for key, mask in self._selector.select(timeout):
+                channel = key.data
+                if (mask & selectors.EVENT_READ):
+                    self._Receive(channel)
+                if (mask & selectors.EVENT_WRITE):
+                    self._Write(channel)
+            now = timer()
+            for channel in self._channels.values():
+                if (channel.writeResumeAt is not None and channel.writeResumeAt <= now):
+                    # the serial adapter should have space in its write buffer again
+                    channel.writeResumeAt = None
+                    self._Write(channel)
+                self._CheckTimeout(channel)
+
+    # function sending the frames of the backlog of a channel as long as there is space in the device's buffer
+    def _SubmitBacklog(self, channel):
+        device = channel.device
+        if (channel.closed):
+            if (len(channel.backlog) > 0):
+                channel.error = ConnectionError(f"{channel.connection} failed before")
+                channel.backlog.clear()
+            return
+        while (len(channel.backlog) > 0):
+            self._ExpireLostFrames(channel)
+            if (len(device._unansweredFrames) >= device.configuration.frameBufferSize):
+                if (channel.blockedSince is None):
+                    channel.blockedSince = time.time_ns() // 1000000
+                return
+            channel.blockedSince = None
+            frame = channel.backlog.popleft()
+            frame._id = device._AllocateFrameID()
+            device._AddUnansweredFrame(device._SendFrame(frame))
+            device.logger.protocol("Added frame to unanswered Frames. Total: %d", len(device._unansweredFrames))
+        if (channel.start is not None and len(channel.pending) == 0):
+            self._Finish(channel)
+
+    # @return: the time in seconds until the next channel with a full buffer times out
+    #          or can write again, or None
+    def _NextTimeout(self):
+        now = time.time_ns() // 1000000
+        timeout = None
+        for channel in self._channels.values():
+            device = channel.device
+            if (channel.writeResumeAt is not None):
+                resume = (channel.writeResumeAt - timer()) * 1000
+                if (timeout is None or resume < timeout):
+                    timeout = resume
+            if (len(device._unansweredFrames) == 0):
+                continue
+            if (channel.blockedSince is not None):
+                deadline = channel.blockedSince + device._AckTimeout()
+            elif (getattr(channel.connection, "lossy", False)):
+                # let lost frames expire while flushing
+                deadline = device._ResponseDeadline(next(iter(device._unansweredFrames.values())))
+            else:
+                continue
+            if (timeout is None or deadline - now < timeout):
+                timeout = deadline - now
+        return None if timeout is None else max(timeout, 0) / 1000
+
+    # function dropping the oldest frame of a channel if the device's buffer was full for too long
+    def _CheckTimeout(self, channel):
+        device = channel.device
+        self._ExpireLostFrames(channel)
+        if (channel.blockedSince is None or len(device._unansweredFrames) == 0):
+            return
+        if (time.time_ns() // 1000000 - channel.blockedSince < device._AckTimeout()):
+            return
+        channel.blockedSince = None
+        if (getattr(channel.connection, "lossy", False)):
+            device._DropLostFrame()
+            return
+        # treat the oldest frame as dropped, same as Device.Send()
+        dropped_frame = device._DropOldestFrame()
+        error = TimeoutError(f"No Frame Acknowledgement or Frame Error for frame {dropped_frame._id} received from receiver within a time of {device._AckTimeout()} ms. Dropped frame from queue.")
+        if (dropped_frame._future is not None):
+            dropped_frame._future.set_exception(error)
+        device.logger.error("TimeoutError: " + str(error))
+        channel.error = error
+
+    # function dropping the overdue frames of a channel with a lossy connection (see Device._ExpireLostFrames())
+    # All responses which were already received are handled first, so only frames without a response are dropped
+    def _ExpireLostFrames(self, channel):
+        device = channel.device
+        if (not getattr(channel.connection, "lossy", False) or len(device._unansweredFrames) == 0):
+            return
+        if (time.time_ns() // 1000000 <= device._ResponseDeadline(next(iter(device._unansweredFrames.values())))):
+            return
+        while (not channel.closed and self._Receive(channel)):
+            pass
+        device._ExpireLostFrames()
+
+    # function handling all data the connection of a channel received
+    # @return: True if data was received
+    def _Receive(self, channel):
+        device = channel.device
+        try:
+            data = channel.connection.ReadAvailable(0)
+        except TimeoutError:
+            # nothing received, or only datagrams of foreign addresses
+            return False
+        except OSError as e:
+            self._Fail(channel, e)
+            return False
+        receiveTime = time.time_ns() // 1000000
+        for event in device._decoder.Feed(data):
+            device._receivedEvents.append((event, receiveTime))
+        while (len(device._receivedEvents) > 0):
+            try:
+                device._HandleFrameResponse(timeout=0)
+            except TimeoutError:
+                # only other messages were received
+                break
+        return True
+
+    # function writing as much pending data of a channel as the connection takes without blocking
+    def _Write(self, channel):
+        if (channel.closed):
+            return
+        try:
+            while (len(channel.pending) > 0):
+                view = channel.pending[0]
+                written = channel.WriteSome(view)
+                if (written is None):
+                    if (channel.writeResumeAt is not None):
+                        # nothing to write until the resume time; the file descriptor would stay writable
+                        self._Watch(channel, selectors.EVENT_READ)
+                    return
+                if (written < len(view)):
+                    channel.pending[0] = view[written:]
+                    break
+                channel.pending.popleft()
+        except OSError as e:
+            self._Fail(channel, e)
+            return
+        if (len(channel.pending) == 0):
+            self._Watch(channel, selectors.EVENT_READ)
+            if (channel.start is not None and len(channel.backlog) == 0):
+                self._Finish(channel)
+        else:
+            self._Watch(channel, selectors.EVENT_READ | selectors.EVENT_WRITE)
+
+    # function called by the connection of a channel when data should be sent
+    # The data is written once the connection is writable
+    # @param parts: a list of bytes-like objects which are sent as one datagram on datagram connections
+    def _Enqueue(self, channel, parts):
+        if (channel.writeResumeAt is None):
+            self._Watch(channel, selectors.EVENT_READ | selectors.EVENT_WRITE)
+        if (channel.datagram):
+            channel.pending.append(b''.join(parts))
+        else:
+            channel.pending.extend(memoryview(part).cast('B') for part in parts)
+
+    # function changing the events the selector waits for on the connection of a channel
+    def _Watch(self, channel, events):
+        if (channel.events != events):
+            self._selector.modify(channel.fileobj, events, channel)
+            channel.events = events
+
+    # function measuring the latency of a device once all of its frames were written
+    def _Finish(self, channel):
+        device = channel.device
+        device.latency = (timer() - channel.start) * 1000
+        device.stats.sendLatency.Add(device.latency)
+        channel.start = None
+
+    # function failing all frames of a channel after an error of its connection
+    # The connection is not watched anymore afterwards, all further frames of the device fail
+    def _Fail(self, channel, error):
+        device = channel.device
+        device.logger.error(f"Connection error: {error!r}")
+        channel.error = error
+        channel.backlog.clear()
+        channel.pending.clear()
+        channel.blockedSince = None
+        channel.writeResumeAt = None
+        while (len(device._unansweredFrames) > 0):
+            _, sentFrame = device._unansweredFrames.popitem(last=False)
+            if (sentFrame._future is not None):
+                sentFrame._future.set_exception(error)
+        self._selector.unregister(channel.fileobj)
+        channel.closed = True
+        channel.start = None
+
+    def __str__(self):
+        return f"IoEngine({len(self._channels)} devices)"
+
+
+class _Channel:
+    """
+    The state of a device attached to an IoEngine
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self.connection = device.connection
+        # the frames which wait for space in the device's buffer
+        self.backlog = collections.deque()
+        # the data which is not written yet
+        self.pending = collections.deque()
+        # the time in ms since the device's buffer is full, or None
+        self.blockedSince = None
+        # the time the current Send() started, or None if all frames were written
+        self.start = None
+        # the last error of the device, or None
+        self.error = None
+        # True after the connection failed
+        self.closed = False
+        # the timer() value after which the serial adapter has space for more data again, or None
+        self.writeResumeAt = None
+        # the events the selector waits for on the connection
+        self.events = selectors.EVENT_READ
+
+        connection = self.connection
+        if (isinstance(connection, UdpConnection)):
+            if (getattr(connection, "endpoint", None) is not None):
+                raise ValueError("Devices connected over a UdpEndpoint can not be attached to an IoEngine")
+            self.fileobj = connection.socket
+            self.datagram = True
+        elif (isinstance(connection, TcpConnection)):
+            self.fileobj = connection.socket
+            self.datagram = False
+        elif (isinstance(connection, SerialConnection)):
+            self.fileobj = connection.connection.fileno()
+            self.datagram = False
+        else:
+            raise ValueError(f"{type(connection).__name__} is not supported by IoEngine")
+
+    # function writing data without blocking
+    # Writes may be partial; the caller keeps the rest of the data
+    # @param view: a memoryview or bytes object of the data to write
+    # @return: the number of bytes written, or None if the connection can not take any data right now.
+    #          For serial connections, writeResumeAt is set then
+    def WriteSome(self, view):
+        connection = self.connection
+        try:
+            if (self.datagram):
+                connection._SetTimeout(0)
+                connection.socket.sendto(view, connection._remote_address)
+                return len(view)
+            if (isinstance(connection, SerialConnection)):
+                # only fill the free space of the adapter's hardware write buffer (see SerialConnection)
+                space = connection.writeBufferSize - connection.connection.out_waiting
+                if (space <= 0):
+                    # wait for the time the adapter needs to send enough bytes for the next chunk
+                    excess = min(len(view), connection.writeBufferSize) - space
+                    self.writeResumeAt = timer() + excess * connection._BITS_PER_BYTE / connection.baud
+                    return None
+                return os.write(self.fileobj, view[:space])
+            connection._SetTimeout(0)
+            return connection.socket.send(view)
+        except BlockingIOError:
+            return None
+
+
+class _EngineConnection:
+    """
+    Stands in for the connection of a device attached to an IoEngine
+
+    Data sent by the device is queued and written by the engine. The engine reads from the
+    original connection itself, so reading through this connection never returns data.
+    """
+
+    def __init__(self, engine, channel):
+        self._engine = engine
+        self._channel = channel
+        self.lossy = getattr(channel.connection, "lossy", False)
+        self.maxFrameSize = getattr(channel.connection, "maxFrameSize", None)
+
+    # the data is copied, as it may be a view of a reused buffer
+    def Send(self, data):
+        self._engine._Enqueue(self._channel, [bytes(data)])
+
+    # the parts are sent before IoEngine.Send() returns, so only the reused header has to be copied
+    def SendParts(self, parts):
+        self._engine._Enqueue(self._channel, [bytes(parts[0])] + list(parts[1:]))
+
+    def Read(self, size, timeout=0):
+        raise TimeoutError
+
+    def ReadAvailable(self, timeout=0):
+        raise TimeoutError
+
+    def __str__(self):
+        return str(self._channel.connection)
@@ -0,0 +1,175 @@
+from .Configuration import Configuration
+
+import logging
+import struct
+
+
+# event: the device requested a connection
+class ConnectionRequestEvent:
+    __slots__ = ()
+
+# event: the device sent its configuration
+class ConfigurationEvent:
+    __slots__ = ('configuration',)
+
+    # @param configuration: the received Configuration.
+    #                       NOTE: if the protocol version is not supported, only the protocolVersion is set
+    def __init__(self, configuration):
+        self.configuration = configuration
+
+# event: the device acknowledged a frame
+class FrameAcknowledgementEvent:
+    __slots__ = ('frameID', 't_receiver_in', 't_receiver_out')
+
+    # @param frameID: the ID of the acknowledged frame
+    # @param t_receiver_in: the receiver's time in ms when it received the frame
+    # @param t_receiver_out: the receiver's time in ms when it sent the acknowledgement
+    def __init__(self, frameID, t_receiver_in, t_receiver_out):
+        self.frameID = frameID
+        self.t_receiver_in = t_receiver_in
+        self.t_receiver_out = t_receiver_out
+
+# event: the device rejected a frame
+class FrameErrorEvent:
+    __slots__ = ('frameID', 'errorCode')
+
+    # @param frameID: the ID of the rejected frame
+    # @param errorCode: the error code sent by the device as integer (see Device.ErrorCode)
+    def __init__(self, frameID, errorCode):
+        self.frameID = frameID
+        self.errorCode = errorCode
+
+
+class ProtocolDecoder:
+    """
+    Transport independent, incremental decoder for all messages sent by an ALUP device
+
+    Feed it any chunk of received bytes and it returns the events of all messages which are
+    complete. Incomplete messages are kept until the rest of them is fed.
+    The decoder does not do any I/O itself, so it can be used with any (sync or async) connection.
+    """
+
+    # protocol constants
+    _CONNECTION_REQUEST_BYTE = 0xff
+    _CONFIGURATION_START_BYTE = 0xfd
+    _FRAME_ACKNOWLEDGEMENT_BYTE = 0xfa
+    _FRAME_ERROR_BYTE = 0xf9
+
+    # frame acknowledgement after the acknowledgement byte: ID (uint8), receiver in time (uint32), receiver out time (uint32)
+    _ACKNOWLEDGEMENT_STRUCT = struct.Struct('>BII')
+    # frame error after the error byte: ID (uint8), error code (uint8)
+    _ERROR_STRUCT = struct.Struct('>BB')
+    # configuration values between the device name and the extra values:
+    # LED count (int32), frame buffer size (uint8), data pin (int32), clock pin (int32)
+    _CONFIGURATION_STRUCT = struct.Struct('>iBii')
+
+    # @param protocolVersions: the supported protocol versions. The configuration of devices with other versions
+    #                          is not decoded further than the protocol version
+    def __init__(self, protocolVersions):
+        self.protocolVersions = protocolVersions
+        # received bytes which were not decoded yet
+        self._buffer = bytearray()
+        # the number of bytes at the start of the buffer which are already decoded
+        self._position = 0
+        self.logger = logging.getLogger(__name__)
+
+    # function decoding the given bytes
+    # @param data: a bytes-like object with the next received bytes
+    # @return: a list with the events of all messages completed by the data
+    def Feed(self, data):
+        self._buffer += data
+        events = []
+        while (self._position < len(self._buffer)):
+            event = self._DecodeNext()
+            if (event is None):
+                # the next message is incomplete
+                break
+            if (event is not _SKIPPED):
+                events.append(event)
+
+        # remove all decoded bytes at once
+        if (self._position > 0):
+            del self._buffer[:self._position]
+            self._position = 0
+        return events
+
+    # function decoding the message at the current position
+    # @return: the decoded event, _SKIPPED if a byte was skipped or None if the message is incomplete
+    def _DecodeNext(self):
+        buffer = self._buffer
+        start = self._position
+        messageType = buffer[start]
+
+        if (messageType == self._FRAME_ACKNOWLEDGEMENT_BYTE):
+            end = start + 1 + self._ACKNOWLEDGEMENT_STRUCT.size
+            if (len(buffer) < end):
+                return None
+            event = FrameAcknowledgementEvent(*self._ACKNOWLEDGEMENT_STRUCT.unpack_from(buffer, start + 1))
+        elif (messageType == self._FRAME_ERROR_BYTE):
+            end = start + 1 + self._ERROR_STRUCT.size
+            if (len(buffer) < end):
+                return None
+            event = FrameErrorEvent(*self._ERROR_STRUCT.unpack_from(buffer, start + 1))
+        elif (messageType == self._CONNECTION_REQUEST_BYTE):
+            end = start + 1
+            event = ConnectionRequestEvent()
+        elif (messageType == self._CONFIGURATION_START_BYTE):
+            result = self._DecodeConfiguration(start + 1)
+            if (result is None):
+                return None
+            event, end = result
+        else:
+            # skip all trash on the line, e.g. if parts of a message were dropped
+            self.logger.debug("Received Unknown Response: " + str(bytes([messageType])))
+            self._position = start + 1
+            return _SKIPPED
+
+        self._position = end
+        return event
+
+    # function decoding a configuration
+    # @param position: the position of the first byte after the configuration start byte
+    # @return: a tuple with the ConfigurationEvent and the position after the configuration
+    #          or None if the configuration is incomplete
+    def _DecodeConfiguration(self, position):
+        config = Configuration()
+        result = self._DecodeString(position)
+        if (result is None):
+            return None
+        config.protocolVersion, position = result
+        if (config.protocolVersion not in self.protocolVersions):
+            # the rest of the configuration can not be decoded for unknown versions
+            return ConfigurationEvent(config), position
+
+        result = self._DecodeString(position)
+        if (result is None):
+            return None
+        config.deviceName, position = result
+
+        if (len(self._buffer) < position + self._CONFIGURATION_STRUCT.size):
+            return None
+        (config.ledCount,
+         config.frameBufferSize,
+         config.dataPin,
+         config.clockPin) = self._CONFIGURATION_STRUCT.unpack_from(self._buffer, position)
+        position += self._CONFIGURATION_STRUCT.size
+
+        result = self._DecodeString(position)
+        if (result is None):
+            return None
+        config.extraValues, position = result
+        return ConfigurationEvent(config), position
+
+    # function decoding a null-terminated utf-8 string
+    # @param position: the position of the first byte of the string
+    # @return: a tuple with the string and the position after the null terminator
+    #          or None if the string is incomplete
+    def _DecodeString(self, position):
+        end = self._buffer.find(b'\x00', position)
+        if (end < 0):
+            return None
+        return self._buffer[position:end].decode('utf-8'), end + 1
+
+
+# marker for skipped bytes
+_SKIPPED = object()
@@ -1,5 +1,7 @@
 import serial
+from serial.tools import list_ports
 import logging
+import time
 
 #
 #   This class requires pySerial to be installed
@@ -7,27 +9,56 @@ import logging
 #
 class SerialConnection:
 
+    # the default size of the hardware write buffer in bytes if the adapter is unknown
+    # on most systems, this should be 64, in case of problems reduce to 32
+    _DEFAULT_WRITE_BUFFER_SIZE = 64
+    # the sizes of the transmit buffers of common USB to serial adapters by USB vendor ID
+    _ADAPTER_WRITE_BUFFER_SIZES = {
+        0x0403: 256, # FTDI
+        0x10c4: 512, # Silicon Labs CP210x
+        0x1a86: 32,  # WCH CH34x
+        0x067b: 256, # Prolific PL2303
+    }
+    # the number of bits sent per byte (8N1: 1 start bit, 8 data bits, 1 stop bit)
+    _BITS_PER_BYTE = 10
+
     # default constructor
     # @param port: a string containing the Serial port to connect to
     # @param baud: an integer defining the communication speed
-    def __init__(self, port, baud):
+    # @param writeBufferSize: the size of the hardware write buffer in bytes. Data is only written to the serial port
+    #                         as long as it fits into this buffer to prevent buffer overflows on linux.
+    #                         None to detect it from the USB adapter of the port when connecting
+    def __init__(self, port, baud, writeBufferSize=None):
         self.port = port
         self.baud = baud
         self.connection = None
+        # received bytes which were not read yet start at _rxPosition
         self._rxBuffer = bytearray()
-        # assume a hardware buffer of 64 bytes for writing data
-        # NOTE: this is used to prevent buffer overflows on linux
-        # on most systems, this should be 64, in case of problems reduce to 32
-        self._HARDWARE_WRITE_BUFFER_SIZE = 64
-        # split large amounts of data to the chunk size in bytes before sending
-        self._MAX_CHUNK_SIZE = 64 
+        self._rxPosition = 0
+        # the timeout of the serial port in seconds, cached to only reconfigure the port if it changes
+        self._timeout = None
+        self.writeBufferSize = writeBufferSize
         self.logger = logging.getLogger(__name__)
 
     # Establishes the connection; Blocks until finished
     def Connect(self):
-        self.connection = serial.Serial(self.port, self.baud)
+        self.connection = serial.Serial(self.port, self.baud, timeout=self._timeout)
         self.connection.reset_output_buffer()
         self.connection.reset_input_buffer()
+        if (self.writeBufferSize is None):
+            self.writeBufferSize = self._DetectWriteBufferSize()
+        self.logger.debug("Serial write buffer size: %d Bytes", self.writeBufferSize)
+
+    # function guessing the size of the hardware write buffer from the USB adapter of the port
+    # @return: the size of the buffer in bytes
+    def _DetectWriteBufferSize(self):
+        try:
+            for info in list_ports.comports():
+                if (info.device == self.port):
+                    return self._ADAPTER_WRITE_BUFFER_SIZES.get(info.vid, self._DEFAULT_WRITE_BUFFER_SIZE)
+        except Exception as e:
+            self.logger.debug("Could not list serial ports: %r", e)
+        return self._DEFAULT_WRITE_BUFFER_SIZE
 
     # function terminating the connection
     def Disconnect(self):
@@ -35,23 +66,29 @@ class SerialConnection:
         self.connection.close()
 
     # function sending the given data over the connection
-    # @param data: a bytes object containing the data to send
+    # The data is written in chunks which fit into the hardware write buffer. Returns as soon as
+    # the last chunk was handed to the operating system; use Disconnect() to wait until everything was sent.
+    # @param data: a bytes-like object (e.g. bytes or memoryview) containing the data to send
     def Send(self, data):
-        # split data in 64 byte chunks and write them separately
-        for i in range(0, len(data), self._MAX_CHUNK_SIZE):
-            # calculate the size of the next chunk to send
-            chunk_size = len(data[i:i+self._MAX_CHUNK_SIZE])
-
-            self.logger.debug(f"Chunk Size: {chunk_size}, serial write buffer occupation: {self.connection.out_waiting}")
+        chunkSize = self.writeBufferSize
+        for i in range(0, len(data), chunkSize):
+            chunk = data[i:i + chunkSize]
             # block until there is enough space in the serial output buffer for the chunk
-            while(self._HARDWARE_WRITE_BUFFER_SIZE - self.connection.out_waiting < chunk_size):
-                pass
-    
+            self._WaitForWriteSpace(len(chunk))
             # write the chunk to the serial connection
-            self.connection.write(data[i:i+self._MAX_CHUNK_SIZE])
-            self.logger.physical("[>>>]: " + str([int(b) for b in data[i:i+self._MAX_CHUNK_SIZE]]))
-        # flush the write buffer
-        self.connection.flush()
+            self.connection.write(chunk)
+            if (self.logger.isEnabledFor(logging.PHYSICAL)):
+                self.logger.physical("[>>>]: " + str([int(b) for b in chunk]))
+
+    # function blocking until the given number of bytes fits into the hardware write buffer
+    # Instead of polling, this sleeps for the time the serial port needs to send the bytes which do not fit
+    # @param size: the number of bytes to write
+    def _WaitForWriteSpace(self, size):
+        while True:
+            excess = self.connection.out_waiting + size - self.writeBufferSize
+            if (excess <= 0):
+                return
+            time.sleep(excess * self._BITS_PER_BYTE / self.baud)
 
 
     # Function reading in the given size of data from the connection
@@ -61,40 +98,78 @@ class SerialConnection:
     #                 0 for non-blocking mode, None for full blocking mode. For more info, see pySerial docs.
     #                 Default: 0
     # @return: a bytes object containing the read bytes
+    # @raises: TimeoutError if the given timeout is exceeded. The bytes received so far stay buffered for the next read
     def Read(self, size, timeout=0):
-        # apply the timeout to the serial connection
-        if (timeout != self.connection.timeout):
-            self.connection.timeout = (timeout / 1_000) if timeout is not None else None
-
-        # NOTE: we need to buffer the incoming bytes here in case of an exception.
-        # The reason for this is the way pySerial handles read timeouts.
-        # When reading the next time, we first check the buffer and then read in the 
-        # remaining needed data 
-
-        #TODO: Where here do we actually add something to the buffer which is not read instantly again?
-        # we just raise a timeout as soon as we dont get enough data so why bother buffering? For the next Read call?
-
-        # check how many bytes are already buffered
-        sizeToRead = size - len(self._rxBuffer)
-        sizeToRead = max(0, sizeToRead)
-
-        #NOTE: this will return all already read bytes even if the timeout is reached
-        # Therefore, if it times out we would be loosing data if we wouldn't buffer.
-        if(sizeToRead > 0):
-            incomingBytes = self.connection.read(sizeToRead)
-            self._rxBuffer += incomingBytes
-            self.logger.physical("[<<<]: " + str(incomingBytes))
-            # check if the read call timed out or returned successfully
-            if len(incomingBytes) < size:
-                # the call took longer than expected and couldn't deliver enough data
-                self.logger.debug(f"Got {len(incomingBytes)} bytes but wanted {size}. Remaining Data: {incomingBytes}")
+        deadline = None if timeout is None else time.monotonic() + timeout / 1_000
+        while (len(self._rxBuffer) - self._rxPosition < size):
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if (not self._Fill(size - (len(self._rxBuffer) - self._rxPosition), remaining)):
+                self.logger.debug("Got %d bytes but wanted %d.", len(self._rxBuffer) - self._rxPosition, size)
+                raise TimeoutError
+
+        result = bytes(self._rxBuffer[self._rxPosition:self._rxPosition + size])
+        self._Consume(size)
+        return result
+
+    # Function reading in all data which is available from the connection
+    # Blocks until at least one byte was received or the timeout is exceeded
+    # @param timeout: timeout in ms. If there is no data received within the timeout, a TimeoutError is raised.
+    #                 0 for non-blocking mode, None for full blocking mode.
+    # @return: a bytes-like object containing all read bytes
+    # @raises: TimeoutError if the given timeout is exceeded
+    def ReadAvailable(self, timeout=0):
+        if (len(self._rxBuffer) == self._rxPosition):
+            if (not self._Fill(1, None if timeout is None else timeout / 1_000)):
                 raise TimeoutError
 
-        # get the requested amount of bytes from the buffer
-        result = self._rxBuffer[:size]
-        #delete the requested bytes from the buffer
-        del self._rxBuffer[:size]
+        if (self._rxPosition == 0):
+            # hand out the whole buffer without copying it
+            result = self._rxBuffer
+            self._rxBuffer = bytearray()
+        else:
+            result = self._rxBuffer[self._rxPosition:]
+            self._rxBuffer.clear()
+            self._rxPosition = 0
         return result
 
+    # function reading all bytes which are waiting in the serial port's buffer into the receive buffer
+    # Only if no bytes are waiting, the port's timeout is set and a read blocks for the missing bytes.
+    # @param size: the number of bytes which are missing
+    # @param timeout: timeout in seconds for blocking. 0 for non-blocking mode, None for full blocking mode
+    # @return: True if any bytes were read, False if the timeout was exceeded
+    def _Fill(self, size, timeout):
+        waiting = self.connection.in_waiting
+        if (waiting > 0):
+            # does not block as the bytes are already there
+            incomingBytes = self.connection.read(waiting)
+        else:
+            if (timeout == 0):
+                return False
+            if (timeout != self._timeout):
+                # setting the timeout reconfigures the port, so only do it if it changed
+                self.connection.timeout = timeout
+                self._timeout = timeout
+            incomingBytes = self.connection.read(size)
+            # take everything else which arrived in the meantime as well
+            waiting = self.connection.in_waiting
+            if (waiting > 0):
+                incomingBytes += self.connection.read(waiting)
+            if (len(incomingBytes) == 0):
+                return False
+        self._rxBuffer += incomingBytes
+        self.logger.physical("[<<<]: %s", incomingBytes)
+        return True
+
+    # function removing the given number of bytes from the front of the receive buffer
+    # The bytes are only marked as read; the buffer is compacted once more than half of it was read
+    def _Consume(self, size):
+        self._rxPosition += size
+        if (self._rxPosition == len(self._rxBuffer)):
+            self._rxBuffer.clear()
+            self._rxPosition = 0
+        elif (self._rxPosition > len(self._rxBuffer) // 2):
+            del self._rxBuffer[:self._rxPosition]
+            self._rxPosition = 0
+
     def __str__(self):
         return f"SerialConnection({self.port}:{self.baud})"
\ No newline at end of file
@@ -0,0 +1,167 @@
+import bisect
+import collections
+import heapq
+from timeit import default_timer as timer
+
+
+# default bucket bounds for durations in ms
+TIME_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+# default bucket bounds for the number of unanswered frames
+OCCUPANCY_BOUNDS = (0, 1, 2, 3, 4, 6, 8, 12, 16, 24, 32, 48, 64, 96, 128, 192, 255)
+
+
+class Histogram:
+    """
+    A histogram with fixed buckets
+
+    Adding a value only costs a binary search over the bucket bounds and a few additions,
+    so it can be updated for every frame.
+    """
+
+    # @param bounds: the ascending, inclusive upper bounds of the buckets.
+    #                Values above the last bound are counted in an extra overflow bucket
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.maximum = None
+
+    # function adding a value to the histogram
+    def Add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if (self.maximum is None or value > self.maximum):
+            self.maximum = value
+
+    # @return: the mean of all values. None if there are no values
+    def Mean(self):
+        if (self.count == 0):
+            return None
+        return self.total / self.count
+
+    # function estimating a percentile of the values
+    # @param percent: the percentile between 0 and 100
+    # @return: the upper bound of the bucket containing the percentile, limited to the maximum value.
+    #          None if there are no values
+    def Percentile(self, percent):
+        if (self.count == 0):
+            return None
+        rank = percent / 100 * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if (cumulative >= rank and count > 0):
+                return min(self.bounds[i], self.maximum) if i < len(self.bounds) else self.maximum
+        return self.maximum
+
+    # function adding all values of another histogram with the same bounds to this histogram
+    # @raises: ValueError if the bounds of the histograms differ
+    def Merge(self, other):
+        if (other.bounds != self.bounds):
+            raise ValueError("Can not merge histograms with different bucket bounds")
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.total += other.total
+        if (other.maximum is not None and (self.maximum is None or other.maximum > self.maximum)):
+            self.maximum = other.maximum
+
+    def __str__(self):
+        if (self.count == 0):
+            return "no values"
+        return f"n: {self.count} mean: {self.Mean():.2f} p50: {self.Percentile(50)} p99: {self.Percentile(99)} max: {self.maximum}"
+
+
+class DeviceStatistics:
+    """
+    Counters and histograms describing the traffic of a device (see Device.stats)
+
+    All values are updated with plain arithmetic while sending and receiving,
+    so they can stay enabled in production. Use str() to get a readable summary.
+    """
+
+    # the time in seconds the frame rate is measured over
+    _RATE_INTERVAL = 1.0
+
+    def __init__(self):
+        self.framesSent = 0
+        self.bytesSent = 0
+        self.framesAcknowledged = 0
+        # the number of frame errors by Device.ErrorCode
+        self.frameErrors = collections.Counter()
+        # the number of frames which were dropped because no response was received in time
+        self.timeouts = 0
+        # the time Send() took in ms
+        self.sendLatency = Histogram(TIME_BOUNDS_MS)
+        # the time from sending a frame to receiving its acknowledgement in ms
+        self.ackLatency = Histogram(TIME_BOUNDS_MS)
+        # the number of unanswered frames in the device's buffer when a frame was sent
+        self.inFlight = Histogram(OCCUPANCY_BOUNDS)
+        # the times of the acknowledgements within the last _RATE_INTERVAL, oldest first (see fps)
+        self._ackTimes = collections.deque()
+        self._rateStart = timer()
+
+    # function counting a sent frame
+    # @param size: the size of the frame in bytes
+    # @param inFlight: the number of unanswered frames before the frame was sent
+    def AddSentFrame(self, size, inFlight):
+        self.framesSent += 1
+        self.bytesSent += size
+        self.inFlight.Add(inFlight)
+
+    # function counting an acknowledged frame
+    # @param frame: the SentFrame record of the acknowledged frame
+    def AddAcknowledgement(self, frame):
+        self.framesAcknowledged += 1
+        self.ackLatency.Add(frame._t_response_in - frame._t_frame_out)
+        now = timer()
+        self._ackTimes.append(now)
+        while (self._ackTimes[0] < now - self._RATE_INTERVAL):
+            self._ackTimes.popleft()
+
+    # the number of acknowledged frames per second over the last _RATE_INTERVAL
+    # Calculated when read, so it drops to 0 once no more frames are acknowledged
+    @property
+    def fps(self):
+        now = timer()
+        # NOTE: copying the deque is atomic, so acknowledgements may be added by another thread meanwhile
+        ackTimes = self._ackTimes.copy()
+        count = len(ackTimes) - bisect.bisect_left(ackTimes, now - self._RATE_INTERVAL)
+        interval = min(self._RATE_INTERVAL, now - self._rateStart)
+        if (interval <= 0):
+            return 0.0
+        return count / interval
+
+    # function adding all values of other statistics to these statistics
+    # The frame rates are summed up
+    def Merge(self, other):
+        self.framesSent += other.framesSent
+        self.bytesSent += other.bytesSent
+        self.framesAcknowledged += other.framesAcknowledged
+        self.frameErrors.update(other.frameErrors)
+        self.timeouts += other.timeouts
+        self.sendLatency.Merge(other.sendLatency)
+        self.ackLatency.Merge(other.ackLatency)
+        self.inFlight.Merge(other.inFlight)
+        self._ackTimes = collections.deque(heapq.merge(self._ackTimes.copy(), other._ackTimes.copy()))
+        self._rateStart = min(self._rateStart, other._rateStart)
+
+    # @param statistics: an iterable of DeviceStatistics
+    # @return: new DeviceStatistics combining all given statistics
+    @classmethod
+    def Combine(cls, statistics):
+        combined = cls()
+        for stats in statistics:
+            combined.Merge(stats)
+        return combined
+
+    def __str__(self):
+        errors = ", ".join(f"{getattr(code, 'name', code)}: {count}" for code, count in self.frameErrors.items())
+        out = f"Frames sent: {self.framesSent} ({self.bytesSent} Bytes), acknowledged: {self.framesAcknowledged}, {self.fps:.1f} fps\n"
+        out += f"Frame errors: {errors or 'none'}, timeouts: {self.timeouts}\n"
+        out += f"Send latency (ms): {self.sendLatency}\n"
+        out += f"Acknowledgement latency (ms): {self.ackLatency}\n"
+        out += f"Frames in flight: {self.inFlight}\n"
+        return out
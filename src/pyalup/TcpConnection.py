@@ -1,8 +1,16 @@
 import socket
 import logging
+import selectors
+from timeit import default_timer as timer
 
 
 class TcpConnection:
+
+    # the initial size of the receive buffer in bytes; grows if a message does not fit
+    _RX_BUFFER_SIZE = 4096
+    # timeout in ms for sending if the socket is not writable
+    _SEND_TIMEOUT = 15_000
+
     # default constructor
     # @param ip: a string containing the ip address of the remote device
     # @param port: the port number of the remote socket
@@ -11,9 +19,13 @@ class TcpConnection:
         self.remote_ip = ip
         self.remote_port = port
         self.socket = None
-        # a buffer for incoming bytes. recv() only seems to be able to read whole packages,
-        # docs are unclear, so this seems to be needed
-        self._rxBuffer = bytearray()
+        # a preallocated buffer for incoming bytes which is filled with recv_into()
+        # the received bytes which were not read yet are stored from _rxStart to _rxEnd
+        self._rxBuffer = bytearray(self._RX_BUFFER_SIZE)
+        self._rxStart = 0
+        self._rxEnd = 0
+        # the timeout of the socket in ms, cached to only change it if needed
+        self._timeout = None
 
         self.logger = logging.getLogger(__name__)
 
@@ -23,6 +35,7 @@ class TcpConnection:
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         self.socket.settimeout(15)
+        self._timeout = 15_000
         self.socket.connect((self.remote_ip, self.remote_port))
 
     # function disconnecting the TCP connection
@@ -30,10 +43,79 @@ class TcpConnection:
         self.socket.close()
 
     # function sending the given data over the Socket connection
-    # @param data: a bytes object containing the binary data to send
+    # @param data: a bytes-like object (e.g. bytes or memoryview) containing the binary data to send
     def Send(self, data):
-        self.logger.physical("[>>>]: " + str(data))
-        self.socket.send(data)
+        if (self.logger.isEnabledFor(logging.PHYSICAL)):
+            self.logger.physical("[>>>]: " + str(bytes(data)))
+        with memoryview(data) as view, view.cast('B') as raw:
+            self._SendViews([raw])
+
+    # function sending multiple parts of data at once without concatenating them (scatter-gather)
+    # Used to send the header and the body of a frame without copying the body
+    # @param parts: a list of byte memoryviews containing the binary data to send
+    def SendParts(self, parts):
+        if (self.logger.isEnabledFor(logging.PHYSICAL)):
+            self.logger.physical("[>>>]: " + str(b''.join(parts)))
+        self._SendViews(list(parts))
+
+    # function sending all given memoryviews, handling partial writes
+    # The timeout of the socket belongs to the reading side (e.g. non-blocking mode or the short timeout
+    # of the reader thread), so if the socket is not writable, this waits for it without changing the timeout.
+    # @param views: a list of byte memoryviews. The list is modified
+    # @raises: TimeoutError if the socket does not become writable within _SEND_TIMEOUT and nothing was sent
+    # @raises: ConnectionError if sending fails after a part of the data was sent. The stream would be out of
+    #          sync in the middle of a frame, so the connection is shut down
+    def _SendViews(self, views):
+        partial = False
+        deadline = None
+        while (len(views) > 0):
+            try:
+                if (hasattr(self.socket, "sendmsg")):
+                    sent = self.socket.sendmsg(views)
+                else:
+                    # sendmsg is not available on windows
+                    sent = self.socket.send(views[0])
+            except (BlockingIOError, socket.timeout):
+                # the socket's buffer is full; wait until it can take more data
+                if (deadline is None):
+                    deadline = timer() + self._SEND_TIMEOUT / 1000
+                remaining = deadline - timer()
+                if (remaining <= 0 or not self._WaitWritable(remaining)):
+                    self._FailSend(partial, TimeoutError(f"{self} could not send within {self._SEND_TIMEOUT} ms"))
+                continue
+            except OSError as e:
+                self._FailSend(partial, e)
+            if (sent > 0):
+                partial = True
+                deadline = None
+            # remove everything which was sent
+            while (len(views) > 0 and sent >= len(views[0])):
+                sent -= len(views[0])
+                views.pop(0)
+            if (sent > 0):
+                views[0] = views[0][sent:]
+
+    # function waiting until the socket can take more data to send
+    # @param timeout: the maximum time to wait in seconds
+    # @return: True if the socket is writable, False if the timeout was exceeded
+    def _WaitWritable(self, timeout):
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.socket, selectors.EVENT_WRITE)
+            return len(selector.select(timeout)) > 0
+
+    # function raising the error of a failed send
+    # @param partial: True if a part of the data was already sent
+    # @param error: the exception which made sending fail
+    def _FailSend(self, partial, error):
+        if (not partial):
+            raise error
+        # the device would interpret the rest of the stream at the wrong position; the connection is unusable
+        self.logger.error(f"{self} failed in the middle of sending: {error!r}")
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        raise ConnectionError(f"{self} failed after sending a part of the data") from error
 
     # function reading in data from the socket and returning the requested number
     # of bytes.
@@ -44,29 +126,74 @@ class TcpConnection:
     #                 NOTE: the timeout is per-packet, each packet has its own timeout when reading multiple packets
     # @return the binary data received from the socket
     # @raises: TimeoutError if the given timeout is exceeded
+    # @raises: ConnectionError if the connection was closed by the remote device
     def Read(self, size, timeout=0):
-        try:
-            # apply the timeout to the socket
-            self.socket.settimeout((timeout / 1_000) if timeout is not None else None)
-            while (len(self._rxBuffer) < size):
+        if (self._rxEnd - self._rxStart < size):
+            self._SetTimeout(timeout)
+            while (self._rxEnd - self._rxStart < size):
                 # not enough data in buffer
-                # read in a new packet
-                (data, address) = self.socket.recvfrom(4096)
-                # add the read data to the buffer
-                self._rxBuffer += data
+                self._Receive(size)
+
+        # get the requested amount of bytes from the buffer
+        result = bytes(self._rxBuffer[self._rxStart:self._rxStart + size])
+        self._Consume(size)
+        self.logger.physical("[<<<]: %s", result)
+        return result
 
-            # get the requested amount of bytes from the buffer
-            result = self._rxBuffer[:size]
+    # function reading in all data which is available from the socket
+    # Blocks until at least one byte was received or the timeout is exceeded
+    # @param timeout: timeout in ms. If there is no data received within the timeout, a TimeoutError is raised.
+    #                 0 for non-blocking mode, None for full blocking mode.
+    # @return: a bytes-like object containing all read bytes
+    # @raises: TimeoutError if the given timeout is exceeded
+    # @raises: ConnectionError if the connection was closed by the remote device
+    def ReadAvailable(self, timeout=0):
+        if (self._rxEnd == self._rxStart):
+            self._SetTimeout(timeout)
+            self._Receive(1)
+
+        result = bytes(self._rxBuffer[self._rxStart:self._rxEnd])
+        self._Consume(len(result))
+        self.logger.physical("[<<<]: %s", result)
+        return result
 
-            #delete the requested bytes from the buffer
-            del self._rxBuffer[:size]
+    # function receiving the next data from the socket directly into the receive buffer
+    # @param size: the number of bytes which should fit into the buffer after _rxStart
+    # @raises: TimeoutError if no data is received within the socket's timeout
+    # @raises: ConnectionError if the connection was closed by the remote device
+    def _Receive(self, size):
+        unread = self._rxEnd - self._rxStart
+        missing = max(size - unread, 1)
+        if (len(self._rxBuffer) - self._rxEnd < missing):
+            # move the unread bytes to the front to make space
+            self._rxBuffer[:unread] = self._rxBuffer[self._rxStart:self._rxEnd]
+            self._rxStart = 0
+            self._rxEnd = unread
+            if (len(self._rxBuffer) - unread < missing):
+                self._rxBuffer.extend(bytes(max(missing, len(self._rxBuffer))))
+        try:
+            with memoryview(self._rxBuffer) as view, view[self._rxEnd:] as free:
+                received = self.socket.recv_into(free)
         except BlockingIOError:
             # convert the blockingIOError raised when non-blocking mode is used
             # to a timeout exception
             raise TimeoutError
+        if (received == 0):
+            raise ConnectionError(f"{self} was closed by the remote device")
+        self._rxEnd += received
+
+    # function removing the given number of bytes from the front of the receive buffer
+    def _Consume(self, size):
+        self._rxStart += size
+        if (self._rxStart == self._rxEnd):
+            self._rxStart = 0
+            self._rxEnd = 0
+
+    # function applying the given timeout in ms to the socket if it changed
+    def _SetTimeout(self, timeout):
+        if (timeout != self._timeout):
+            self.socket.settimeout((timeout / 1_000) if timeout is not None else None)
+            self._timeout = timeout
 
-        self.logger.physical("[<<<]: " + str(result))
-        return result
-    
     def __str__(self):
         return f"TcpConnection({self.remote_ip}:{self.remote_port})"
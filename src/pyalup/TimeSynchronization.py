@@ -0,0 +1,252 @@
+import collections
+import heapq
+
+
+class SyncEstimator:
+    """
+    Base class for estimators of the time offset between the sender and an ALUP device
+
+    Each acknowledged frame yields one sample: the local time of the measurement, the measured
+    offset (receiver time - sender time) and the round-trip time of the frame.
+    Samples with a round-trip time far above the recent minimum are rejected, as their offset
+    is distorted by asymmetric delays.
+
+    Subclasses implement _Add() and Offset().
+    """
+
+    # @param rttWindowSize: the number of recent round-trip times the minimum is taken from
+    # @param rttTolerance: samples are rejected if their round-trip time exceeds the minimum by this factor ...
+    # @param rttSlackMs: ... plus this constant in ms
+    def __init__(self, rttWindowSize=32, rttTolerance=2.0, rttSlackMs=5):
+        self.rttTolerance = rttTolerance
+        self.rttSlackMs = rttSlackMs
+        self.rejectedSamples = 0
+        # recent round-trip times as (index, rtt) with increasing rtt for a sliding minimum
+        self._rttWindowSize = rttWindowSize
+        self._rttMinimum = collections.deque()
+        self._rttIndex = 0
+
+    # function adding a new measurement
+    # @param localTime: the local time of the measurement in ms
+    # @param offset: the measured offset in ms (receiver time - sender time)
+    # @param rtt: the round-trip time of the measurement without the processing time on the receiver in ms
+    # @return: True if the sample was used, False if it was rejected because of its round-trip time
+    def AddSample(self, localTime, offset, rtt):
+        minimumRtt = self._UpdateRttMinimum(rtt)
+        if (rtt > minimumRtt * self.rttTolerance + self.rttSlackMs):
+            self.rejectedSamples += 1
+            return False
+        self._Add(localTime, offset)
+        return True
+
+    # function returning the estimated offset at the given time
+    # @param localTime: the local time in ms
+    # @return: the estimated offset in ms (receiver time - sender time). 0 if there are no samples yet
+    def Offset(self, localTime):
+        raise NotImplementedError
+
+    # @return: the number of samples the estimate is currently based on
+    def __len__(self):
+        raise NotImplementedError
+
+    def _Add(self, localTime, offset):
+        raise NotImplementedError
+
+    # function adding a round-trip time to the sliding minimum in amortized O(1)
+    # @param rtt: the round-trip time to add
+    # @return: the minimum round-trip time of the window
+    def _UpdateRttMinimum(self, rtt):
+        while (len(self._rttMinimum) > 0 and self._rttMinimum[-1][1] >= rtt):
+            self._rttMinimum.pop()
+        self._rttMinimum.append((self._rttIndex, rtt))
+        if (self._rttMinimum[0][0] <= self._rttIndex - self._rttWindowSize):
+            self._rttMinimum.popleft()
+        self._rttIndex += 1
+        return self._rttMinimum[0][1]
+
+
+class MedianEstimator(SyncEstimator):
+    """
+    Estimates a constant offset as the median of the last samples
+
+    The samples are split into a max-heap of the lower half and a min-heap of the upper half,
+    so each update takes O(log n) instead of sorting the whole window.
+    Samples leaving the window are only marked as removed and are dropped once they reach the
+    top of their heap (lazy deletion).
+    """
+
+    # @param windowSize: the number of samples the median is taken from
+    # @param rttKwargs: see SyncEstimator
+    def __init__(self, windowSize=100, **rttKwargs):
+        super().__init__(**rttKwargs)
+        self.windowSize = windowSize
+        # the samples in the order they were added
+        self._samples = collections.deque()
+        # the lower half of the samples as negated values (max-heap); holds the median
+        self._low = []
+        # the upper half of the samples (min-heap)
+        self._high = []
+        # the number of samples of each half which are still in the window
+        self._lowSize = 0
+        self._highSize = 0
+        # the number of removed samples by value which are still in one of the heaps
+        self._removed = collections.Counter()
+
+    def _Add(self, localTime, offset):
+        if (len(self._samples) >= self.windowSize):
+            self._Remove(self._samples.popleft())
+        self._samples.append(offset)
+        if (self._lowSize == 0 or offset <= -self._low[0]):
+            heapq.heappush(self._low, -offset)
+            self._lowSize += 1
+        else:
+            heapq.heappush(self._high, offset)
+            self._highSize += 1
+        self._Balance()
+        if (len(self._low) + len(self._high) > 2 * max(len(self._samples), 1) + 16):
+            # too many removed samples are buried in the heaps
+            self._Rebuild()
+
+    def Offset(self, localTime):
+        if (self._lowSize == 0):
+            return 0
+        if (self._lowSize > self._highSize):
+            return -self._low[0]
+        return (-self._low[0] + self._high[0]) / 2
+
+    def __len__(self):
+        return len(self._samples)
+
+    # function removing a sample which left the window
+    # NOTE: the top of both heaps is never a removed sample, so comparing with the top
+    #       tells which half the sample belongs to
+    def _Remove(self, offset):
+        self._removed[offset] += 1
+        if (offset <= -self._low[0]):
+            self._lowSize -= 1
+            if (offset == -self._low[0]):
+                self._Prune(self._low, -1)
+        else:
+            self._highSize -= 1
+            if (offset == self._high[0]):
+                self._Prune(self._high, 1)
+        self._Balance()
+
+    # function moving the top sample from one half to the other until the lower half has
+    # as many samples as the upper half or one more
+    def _Balance(self):
+        if (self._lowSize > self._highSize + 1):
+            heapq.heappush(self._high, -heapq.heappop(self._low))
+            self._lowSize -= 1
+            self._highSize += 1
+            self._Prune(self._low, -1)
+        elif (self._lowSize < self._highSize):
+            heapq.heappush(self._low, -heapq.heappop(self._high))
+            self._lowSize += 1
+            self._highSize -= 1
+            self._Prune(self._high, 1)
+
+    # function dropping removed samples from the top of a heap
+    # @param heap: the heap
+    # @param sign: -1 if the heap holds negated values, else 1
+    def _Prune(self, heap, sign):
+        while (len(heap) > 0 and self._removed[sign * heap[0]] > 0):
+            value = sign * heapq.heappop(heap)
+            self._removed[value] -= 1
+            if (self._removed[value] == 0):
+                del self._removed[value]
+
+    # function rebuilding both heaps from the samples in the window, dropping all removed samples
+    def _Rebuild(self):
+        ordered = sorted(self._samples)
+        self._lowSize = (len(ordered) + 1) // 2
+        self._highSize = len(ordered) - self._lowSize
+        self._low = [-offset for offset in reversed(ordered[:self._lowSize])]
+        self._high = ordered[self._lowSize:]
+        self._removed.clear()
+
+
+class DriftEstimator(SyncEstimator):
+    """
+    Estimates the offset and the clock drift (skew) of the device with a linear regression
+    over the last samples: offset(t) = offset(t_ref) + skew * (t - t_ref)
+
+    The offset is extrapolated to the time each frame is sent, so time stamps stay aligned
+    even if the device's clock runs slightly faster or slower than the sender's clock.
+    The regression sums are updated incrementally for each sample.
+    """
+
+    # @param windowSize: the number of samples used for the regression
+    # @param minimumSpanMs: the minimum time span the samples have to cover before a skew is estimated
+    # @param rttKwargs: see SyncEstimator
+    def __init__(self, windowSize=200, minimumSpanMs=1000, **rttKwargs):
+        super().__init__(**rttKwargs)
+        self.windowSize = windowSize
+        self.minimumSpanMs = minimumSpanMs
+        # the samples as (localTime, offset) tuples relative to the reference values in the order they were added
+        self._samples = collections.deque()
+        # local times and offsets are stored relative to the first sample to keep the sums precise
+        self._referenceTime = None
+        self._referenceOffset = None
+        self._sumX = 0.0
+        self._sumY = 0.0
+        self._sumXX = 0.0
+        self._sumXY = 0.0
+        # the number of updates since the sums were last recalculated from scratch
+        self._updatesSinceRecalculation = 0
+
+    # @return: the estimated skew of the device's clock in ms per ms (e.g. 1e-5 for 10 ppm). 0 if unknown
+    def Skew(self):
+        n = len(self._samples)
+        if (n < 2 or self._samples[-1][0] - self._samples[0][0] < self.minimumSpanMs):
+            return 0.0
+        denominator = n * self._sumXX - self._sumX * self._sumX
+        if (denominator == 0):
+            return 0.0
+        return (n * self._sumXY - self._sumX * self._sumY) / denominator
+
+    def Offset(self, localTime):
+        n = len(self._samples)
+        if (n == 0):
+            return 0
+        skew = self.Skew()
+        meanX = self._sumX / n
+        meanY = self._sumY / n
+        return self._referenceOffset + meanY + skew * (localTime - self._referenceTime - meanX)
+
+    def _Add(self, localTime, offset):
+        if (self._referenceTime is None):
+            self._referenceTime = localTime
+            self._referenceOffset = offset
+        if (len(self._samples) >= self.windowSize):
+            oldX, oldY = self._samples.popleft()
+            self._Accumulate(oldX, oldY, -1)
+        x = localTime - self._referenceTime
+        y = offset - self._referenceOffset
+        self._samples.append((x, y))
+        self._Accumulate(x, y, 1)
+
+        # avoid accumulating rounding errors from removed samples
+        self._updatesSinceRecalculation += 1
+        if (self._updatesSinceRecalculation >= self.windowSize):
+            self._Recalculate()
+
+    # function adding (sign=1) or removing (sign=-1) a sample from the regression sums
+    def _Accumulate(self, x, y, sign):
+        self._sumX += sign * x
+        self._sumY += sign * y
+        self._sumXX += sign * x * x
+        self._sumXY += sign * x * y
+
+    # function recalculating the regression sums from the samples relative to the oldest sample
+    def _Recalculate(self):
+        shift = self._samples[0][0]
+        self._referenceTime += shift
+        self._samples = collections.deque((x - shift, y) for x, y in self._samples)
+        self._sumX = self._sumY = self._sumXX = self._sumXY = 0.0
+        for x, y in self._samples:
+            self._Accumulate(x, y, 1)
+        self._updatesSinceRecalculation = 0
+
+    def __len__(self):
+        return len(self._samples)
@@ -0,0 +1,129 @@
+import itertools
+import json
+import threading
+import time
+
+
+class Tracer:
+    """
+    Records spans of the sending and receiving path into a preallocated ring buffer
+
+    Tracing is opt-in: assign a Tracer to Device.tracer and/or Group.tracer. Without a tracer,
+    the traced code only checks for None. Once the ring buffer is full, the oldest spans are overwritten.
+    The recorded spans can be exported in the Chrome trace event format, which can be opened with
+    chrome://tracing or https://ui.perfetto.dev
+
+    Example:
+        tracer = Tracer()
+        device.tracer = tracer
+        ...
+        tracer.Dump("trace.json")
+    """
+
+    # @param capacity: the maximum number of spans kept
+    def __init__(self, capacity=65536):
+        self.capacity = capacity
+        # the spans as parallel lists to avoid allocating an object per span
+        self._names = [None] * capacity
+        self._starts = [0] * capacity
+        self._ends = [None] * capacity
+        self._tracks = [0] * capacity
+        self._frameIDs = [None] * capacity
+        # next() on a count is atomic, so threads never write the same slot
+        self._counter = itertools.count()
+        # the number of recorded spans including the overwritten ones
+        self._recorded = 0
+        # names of the tracks; threads use their ident as track ID
+        self._trackNames = {}
+        self._trackIDs = {}
+        # guards adding tracks; spans are recorded without locking
+        self._lock = threading.Lock()
+        # offset from the performance counter to the unix time in ns
+        self._epochOffset = time.time_ns() - time.perf_counter_ns()
+
+    # @return: the current time of the tracer in ns
+    @staticmethod
+    def Now():
+        return time.perf_counter_ns()
+
+    # function converting a unix time in ms (e.g. a time stamp of a SentFrame) to the time of the tracer
+    # @param ms: the unix time in ms
+    # @return: the time in ns
+    def FromUnixTimeMs(self, ms):
+        return int(ms * 1_000_000) - self._epochOffset
+
+    # function recording a span
+    # @param name: the name of the span
+    # @param start: the start time in ns (see Now())
+    # @param end: the end time in ns or None for an instant event
+    # @param track: the ID of the track (see Track()) or None for the current thread
+    # @param frameID: the ID of the frame the span belongs to or None
+    def Record(self, name, start, end=None, track=None, frameID=None):
+        if (track is None):
+            track = threading.get_ident()
+            if (track not in self._trackNames):
+                with self._lock:
+                    self._trackNames[track] = threading.current_thread().name
+        i = next(self._counter) % self.capacity
+        self._names[i] = name
+        self._starts[i] = start
+        self._ends[i] = end
+        self._tracks[i] = track
+        self._frameIDs[i] = frameID
+        self._recorded += 1
+
+    # function returning the ID of a named track for spans which do not belong to a thread,
+    # e.g. the processing on a device
+    # @param name: the name of the track
+    # @return: the ID of the track
+    def Track(self, name):
+        track = self._trackIDs.get(name)
+        if (track is None):
+            with self._lock:
+                track = self._trackIDs.get(name)
+                if (track is None):
+                    track = len(self._trackIDs) + 1
+                    self._trackIDs[name] = track
+                    self._trackNames[track] = name
+        return track
+
+    # function removing all recorded spans
+    def Clear(self):
+        self._counter = itertools.count()
+        self._recorded = 0
+
+    # @return: the recorded spans in the Chrome trace event format
+    def ToChromeTrace(self):
+        count = min(self._recorded, self.capacity)
+        first = self._recorded - count
+        events = []
+        # other threads may add tracks while exporting
+        with self._lock:
+            trackNames = list(self._trackNames.items())
+        for track, name in trackNames:
+            events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": track, "args": {"name": name}})
+        for n in range(first, first + count):
+            i = n % self.capacity
+            event = {
+                "name": self._names[i],
+                "pid": 1,
+                "tid": self._tracks[i],
+                # the trace event format uses microseconds
+                "ts": (self._starts[i] + self._epochOffset) / 1000,
+            }
+            if (self._ends[i] is None):
+                event["ph"] = "i"
+                event["s"] = "t"
+            else:
+                event["ph"] = "X"
+                event["dur"] = (self._ends[i] - self._starts[i]) / 1000
+            if (self._frameIDs[i] is not None):
+                event["args"] = {"frame": self._frameIDs[i]}
+            events.append(event)
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    # function writing the recorded spans to a file in the Chrome trace event format
+    # @param path: the path of the file
+    def Dump(self, path):
+        with open(path, "w") as file:
+            json.dump(self.ToChromeTrace(), file)
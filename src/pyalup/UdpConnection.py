@@ -1,11 +1,24 @@
 import socket
 import logging
+import time
 
 class UdpConnection:
+
+    # the maximum size of a received datagram in bytes
+    _MAX_DATAGRAM_SIZE = 65535
+    # the size of the IPv4 and UDP headers in bytes
+    _IP_UDP_HEADER_SIZE = 28
+
+    # UDP does not retransmit lost datagrams; frames without acknowledgement are dropped
+    # after a short time instead of stalling the device (see Device)
+    lossy = True
+
     # default constructor
     # @param ip: a string containing the ip address of the remote device
     # @param port: the port number of the remote socket
-    def __init__(self, ip, port):
+    # @param mtu: the maximum transmission unit of the network in bytes. Frames are split into
+    #             datagrams which fit into it to avoid IP fragmentation (see maxFrameSize)
+    def __init__(self, ip, port, mtu=1500):
         self.remote_ip = ip
         self.remote_port = port
         self.socket = None
@@ -14,9 +27,17 @@ class UdpConnection:
         self.server_port = port
         #note: the remote ip/port describe the sending ip/port and the server ip/port
         # ones used for listening
-        # a buffer for incoming bytes. recv() only seems to be able to read whole packages,
-        # docs are unclear, so this seems to be needed s
+        # the maximum size of a frame which is sent in a single datagram
+        self.maxFrameSize = mtu - self._IP_UDP_HEADER_SIZE
+        # the resolved address of the remote device; datagrams from other addresses are discarded
+        self._remote_address = None
+        # a buffer for incoming bytes; the received bytes which were not read yet start at _rxStart
         self._rxBuffer = bytearray()
+        self._rxStart = 0
+        # the timeout of the socket in ms, cached to only change it if needed
+        self._timeout = None
+        # the number of datagrams which were discarded because they were not sent by the remote device
+        self.foreignDatagrams = 0
 
         self.logger = logging.getLogger(__name__)
 
@@ -26,36 +47,98 @@ class UdpConnection:
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         # set the ip and port on this end of the connection
         self.socket.bind((self.server_ip, self.server_port))
-        print("Listening to %s, %d:" %(self.server_ip, self.server_port))
-        print("Sending to: %s, %d" %(self.remote_ip, self.remote_port))
+        self._remote_address = (socket.gethostbyname(self.remote_ip), self.remote_port)
+        self.logger.info("Listening to %s:%d, sending to %s:%d", self.server_ip, self.server_port, self.remote_ip, self.remote_port)
 
     # function disconnecting the UDP connection
     def Disconnect(self):
         self.socket.close()
 
-    # function sending the given data over the UDP connection
-    # @param data: a bytes object containing the binary data to send
+    # function sending the given data over the UDP connection as one datagram
+    # @param data: a bytes-like object (e.g. bytes or memoryview) containing the binary data to send
     def Send(self, data):
-        print("Sending: " + str(data))
-        self.socket.sendto(data, (self.remote_ip, self.remote_port))
+        if (self.logger.isEnabledFor(logging.PHYSICAL)):
+            self.logger.physical("[>>>]: " + str(bytes(data)))
+        self.socket.sendto(data, self._remote_address)
+
+    # function sending multiple parts of data as one datagram without concatenating them (scatter-gather)
+    # @param parts: a list of byte memoryviews containing the binary data to send
+    def SendParts(self, parts):
+        if (self.logger.isEnabledFor(logging.PHYSICAL)):
+            self.logger.physical("[>>>]: " + str(b''.join(parts)))
+        if (hasattr(self.socket, "sendmsg")):
+            self.socket.sendmsg(parts, [], 0, self._remote_address)
+        else:
+            # sendmsg is not available on windows
+            self.socket.sendto(b''.join(parts), self._remote_address)
 
     # function reading in data from the socket and returning the requested number
     # of bytes.
-    # Note: This function is blocking until the requested number of bytes has been received
     # @param size: the number of bytes to read from the rx buffer
+    # @param timeout: timeout in ms. If there is no data received within the timeout, a TimeoutError is raised.
+    #                 0 for non-blocking mode, None for full blocking mode.
+    #                 Default: 0
     # @return the binary data received from the socket
-    def Read(self, size):
-        while (len(self._rxBuffer) < size):
+    # @raises: TimeoutError if the given timeout is exceeded. The bytes received so far stay buffered for the next read
+    def Read(self, size, timeout=0):
+        deadline = None if timeout is None else time.monotonic() + timeout / 1_000
+        while (len(self._rxBuffer) - self._rxStart < size):
             # not enough data in buffer
-            # read in a new packet
-            (data, address) = self.socket.recvfrom(4096)
-
-            # add the read data to the buffer
-            self._rxBuffer += data
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0) * 1_000
+            self._Receive(remaining)
 
         # get the requested amount of bytes from the buffer
-        result = self._rxBuffer[:size]
-        #delete the requested bytes from the buffer
-        del self._rxBuffer[:size]
+        result = bytes(self._rxBuffer[self._rxStart:self._rxStart + size])
+        self._rxStart += size
+        if (self._rxStart == len(self._rxBuffer)):
+            self._rxBuffer.clear()
+            self._rxStart = 0
+        self.logger.physical("[<<<]: %s", result)
+        return result
 
+    # function reading in all data which is available from the socket
+    # Blocks until at least one datagram was received or the timeout is exceeded
+    # @param timeout: timeout in ms. If there is no data received within the timeout, a TimeoutError is raised.
+    #                 0 for non-blocking mode, None for full blocking mode.
+    # @return: a bytes-like object containing all read bytes
+    # @raises: TimeoutError if the given timeout is exceeded
+    def ReadAvailable(self, timeout=0):
+        if (len(self._rxBuffer) == self._rxStart):
+            deadline = None if timeout is None else time.monotonic() + timeout / 1_000
+            while (len(self._rxBuffer) == self._rxStart):
+                remaining = None if deadline is None else max(deadline - time.monotonic(), 0) * 1_000
+                self._Receive(remaining)
+
+        result = self._rxBuffer[self._rxStart:]
+        self._rxBuffer = bytearray()
+        self._rxStart = 0
+        self.logger.physical("[<<<]: %s", result)
         return result
+
+    # function receiving the next datagram from the remote device into the receive buffer
+    # Datagrams from other addresses (ip and port) than the remote device are discarded
+    # @param timeout: timeout in ms, see Read()
+    # @raises: TimeoutError if no datagram is received within the timeout
+    def _Receive(self, timeout):
+        self._SetTimeout(timeout)
+        try:
+            (data, address) = self.socket.recvfrom(self._MAX_DATAGRAM_SIZE)
+        except BlockingIOError:
+            # convert the blockingIOError raised when non-blocking mode is used
+            # to a timeout exception
+            raise TimeoutError
+        if (address != self._remote_address):
+            self.foreignDatagrams += 1
+            self.logger.debug("Discarded datagram from foreign address %s:%d", address[0], address[1])
+            return
+        # add the read data to the buffer
+        self._rxBuffer += data
+
+    # function applying the given timeout in ms to the socket if it changed
+    def _SetTimeout(self, timeout):
+        if (timeout != self._timeout):
+            self.socket.settimeout((timeout / 1_000) if timeout is not None else None)
+            self._timeout = timeout
+
+    def __str__(self):
+        return f"UdpConnection({self.remote_ip}:{self.remote_port})"
@@ -0,0 +1,198 @@
+from .UdpConnection import UdpConnection
+
+import collections
+import logging
+import socket
+import threading
+
+
+class UdpEndpoint:
+    """
+    A single UDP socket shared by many devices
+
+    Instead of binding one socket per device, all devices send from the same local port.
+    A receiver thread reads all incoming datagrams and hands each one to the connection
+    of the device it was sent from, so every device still decodes only its own responses.
+
+    Example:
+        endpoint = UdpEndpoint(port=5012)
+        for ip in ips:
+            device = Device()
+            device.UdpConnect(ip, 5012, endpoint=endpoint)
+        ...
+        endpoint.Close()
+    """
+
+    # the maximum size of a received datagram in bytes
+    _MAX_DATAGRAM_SIZE = 65535
+    # the interval in seconds in which the receiver thread checks whether it should stop
+    _POLL_INTERVAL = 0.1
+
+    # @param ip: the local ip address to listen on. Default: all interfaces
+    # @param port: the local port to listen on. 0 to let the operating system choose a port
+    # @param matchIpOnly: True to also accept datagrams of devices which answer from another port than the one
+    #                     they were connected to. Such datagrams are only routed by ip address, and only if
+    #                     there never was more than one device with that ip address on this endpoint
+    def __init__(self, ip='0.0.0.0', port=0, matchIpOnly=False):
+        self.server_ip = ip
+        self.server_port = port
+        self.matchIpOnly = matchIpOnly
+        self.socket = None
+        # the connections by the resolved (ip, port) address of their device
+        self._connections = {}
+        # the connections by the ip address of their device, for devices answering from another port
+        self._connectionsByIp = collections.defaultdict(list)
+        # the ip addresses which ever had more than one device; never routed by ip address only
+        self._sharedIps = set()
+        self._lock = threading.Lock()
+        self._receiverThread = None
+        self._running = False
+        # the number of datagrams which were discarded because no device was registered for their address
+        self.foreignDatagrams = 0
+
+        self.logger = logging.getLogger(__name__)
+
+    # function binding the socket and starting the receiver thread
+    # Called automatically when the first connection is established
+    def Open(self):
+        if (self.socket is not None):
+            return
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((self.server_ip, self.server_port))
+        self.server_port = self.socket.getsockname()[1]
+        self.socket.settimeout(self._POLL_INTERVAL)
+        self._running = True
+        self._receiverThread = threading.Thread(target=self._ReceiveLoop, name=f"UdpEndpoint {self.server_port}", daemon=True)
+        self._receiverThread.start()
+        self.logger.info("Listening to %s:%d", self.server_ip, self.server_port)
+
+    # function stopping the receiver thread and closing the socket
+    # NOTE: the devices using this endpoint should be disconnected first
+    def Close(self):
+        if (self.socket is None):
+            return
+        self._running = False
+        self._receiverThread.join()
+        self._receiverThread = None
+        self.socket.close()
+        self.socket = None
+
+    # function creating a connection to a device which uses this endpoint
+    # @param ip: a string containing the ip address of the remote device
+    # @param port: the port number of the remote socket
+    # @param mtu: see UdpConnection
+    # @return: a SharedUdpConnection which is not connected yet
+    def Connection(self, ip, port, mtu=1500):
+        return SharedUdpConnection(self, ip, port, mtu)
+
+    # function registering a connection so it receives the datagrams of its device
+    def _Register(self, connection):
+        with self._lock:
+            if (connection._remote_address in self._connections):
+                raise ConnectionError(f"{connection._remote_address[0]}:{connection._remote_address[1]} is already connected to this endpoint")
+            self._connections[connection._remote_address] = connection
+            sameIp = self._connectionsByIp[connection._remote_address[0]]
+            sameIp.append(connection)
+            if (len(sameIp) > 1):
+                self._sharedIps.add(connection._remote_address[0])
+
+    # function removing a registered connection
+    def _Unregister(self, connection):
+        with self._lock:
+            if (self._connections.get(connection._remote_address) is not connection):
+                return
+            del self._connections[connection._remote_address]
+            sameIp = self._connectionsByIp[connection._remote_address[0]]
+            sameIp.remove(connection)
+            if (len(sameIp) == 0):
+                del self._connectionsByIp[connection._remote_address[0]]
+
+    # @param address: the (ip, port) address a datagram was received from
+    # @return: the connection the datagram belongs to or None
+    def _ConnectionFor(self, address):
+        connection = self._connections.get(address)
+        if (connection is not None or not self.matchIpOnly):
+            return connection
+        # the device answered from another port; only unambiguous if it is the only device which ever had its ip
+        if (address[0] in self._sharedIps):
+            return None
+        sameIp = self._connectionsByIp.get(address[0])
+        if (sameIp is not None and len(sameIp) == 1):
+            return sameIp[0]
+        return None
+
+    # function run by the receiver thread, handing all received datagrams to their connections
+    def _ReceiveLoop(self):
+        while (self._running):
+            try:
+                (data, address) = self.socket.recvfrom(self._MAX_DATAGRAM_SIZE)
+            except socket.timeout:
+                continue
+            except OSError as e:
+                if (self._running):
+                    self.logger.error(f"UdpEndpoint could not receive: {e!r}")
+                continue
+            with self._lock:
+                connection = self._ConnectionFor(address)
+            if (connection is None):
+                self.foreignDatagrams += 1
+                self.logger.debug("Discarded datagram from foreign address %s:%d", address[0], address[1])
+                continue
+            connection._Deliver(data)
+
+    def __str__(self):
+        return f"UdpEndpoint({self.server_ip}:{self.server_port}, {len(self._connections)} devices)"
+
+
+class SharedUdpConnection(UdpConnection):
+    """
+    A connection to a single device over a shared UdpEndpoint (see UdpEndpoint.Connection())
+
+    Behaves like a UdpConnection, but sends over the socket of the endpoint and
+    reads the datagrams the endpoint received from the device.
+    """
+
+    # @param endpoint: the UdpEndpoint to use
+    # @param ip: a string containing the ip address of the remote device
+    # @param port: the port number of the remote socket
+    # @param mtu: see UdpConnection
+    def __init__(self, endpoint, ip, port, mtu=1500):
+        super().__init__(ip, port, mtu)
+        self.endpoint = endpoint
+        # the datagrams received by the endpoint which were not read yet
+        self._datagrams = collections.deque()
+        self._received = threading.Condition()
+
+    # function registering this connection at the endpoint
+    def Connect(self):
+        self.endpoint.Open()
+        self.socket = self.endpoint.socket
+        self.server_ip = self.endpoint.server_ip
+        self.server_port = self.endpoint.server_port
+        self._remote_address = (socket.gethostbyname(self.remote_ip), self.remote_port)
+        self.endpoint._Register(self)
+        self.logger.info("Sending to %s:%d over %s", self.remote_ip, self.remote_port, self.endpoint)
+
+    # function unregistering this connection; the socket of the endpoint stays open
+    def Disconnect(self):
+        self.endpoint._Unregister(self)
+        self.socket = None
+
+    # function called by the receiver thread of the endpoint for each datagram of the device
+    def _Deliver(self, data):
+        with self._received:
+            self._datagrams.append(data)
+            self._received.notify()
+
+    # function moving the next datagram received by the endpoint into the receive buffer
+    # @param timeout: timeout in ms, see Read()
+    # @raises: TimeoutError if no datagram is received within the timeout
+    def _Receive(self, timeout):
+        with self._received:
+            if (not self._received.wait_for(lambda: len(self._datagrams) > 0, None if timeout is None else timeout / 1_000)):
+                raise TimeoutError
+            while (len(self._datagrams) > 0):
+                self._rxBuffer += self._datagrams.popleft()
+
+    def __str__(self):
+        return f"SharedUdpConnection({self.remote_ip}:{self.remote_port})"
@@ -0,0 +1,93 @@
+import asyncio
+import struct
+import time
+
+from pyalup.AsyncDevice import AsyncDevice
+from pyalup.Frame import Frame
+
+LED_COUNT = 10
+BUFFER_SIZE = 2
+
+# time the device needs to show a frame
+FRAME_TIME = 0.02
+
+
+class _TcpDevice:
+    """Minimal ALUP v0.3 device with a small frame buffer, answering frames one after another."""
+
+    def __init__(self):
+        self.bufferedFrames = 0
+        self.maxBufferedFrames = 0
+        self.shownFrames = 0
+        self.leds = None
+        self._server = None
+
+    async def Start(self):
+        self._server = await asyncio.start_server(self._Serve, '127.0.0.1', 0)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def Close(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _Serve(self, reader, writer):
+        writer.write(b'\xff')
+        while (await reader.readexactly(1) != b'\xfe'):
+            pass
+        writer.write(b'\xfd0.3\0tcp\0' + struct.pack('>iBii', LED_COUNT, BUFFER_SIZE, 0, 0) + b'\0')
+        await reader.readexactly(1)
+
+        frames = asyncio.Queue()
+        shower = asyncio.create_task(self._ShowFrames(frames, writer))
+        try:
+            while True:
+                frameId, command, size, _, _ = struct.unpack('>BBiiI', await reader.readexactly(14))
+                body = await reader.readexactly(size)
+                self.bufferedFrames += 1
+                self.maxBufferedFrames = max(self.maxBufferedFrames, self.bufferedFrames)
+                await frames.put((frameId, body))
+                if (command == 2):
+                    await frames.join()
+                    return
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            shower.cancel()
+            writer.close()
+
+    async def _ShowFrames(self, frames, writer):
+        while True:
+            frameId, body = await frames.get()
+            await asyncio.sleep(FRAME_TIME)
+            if (body):
+                self.leds = body
+            now = int(time.monotonic() * 1000) % 2**32
+            self.bufferedFrames -= 1
+            self.shownFrames += 1
+            writer.write(b'\xfa' + struct.pack('>BII', frameId, now, now))
+            frames.task_done()
+
+
+def test_concurrent_sends_do_not_overfill_the_buffer():
+    async def Run():
+        tcpDevice = _TcpDevice()
+        port = await tcpDevice.Start()
+        device = AsyncDevice()
+        await device.TcpConnect('127.0.0.1', port)
+
+        async def SendColor(color):
+            frame = Frame()
+            frame.colors = [color] * LED_COUNT
+            await device.Send(frame)
+
+        await asyncio.gather(*(SendColor(i) for i in range(8)))
+        await device.FlushBuffer()
+        await device.Disconnect()
+        await tcpDevice.Close()
+
+        assert tcpDevice.maxBufferedFrames <= BUFFER_SIZE
+        assert device.stats.framesAcknowledged == 8
+        # the frames are shown in the order Send() was called
+        assert tcpDevice.leds == bytes([0, 0, 7]) * LED_COUNT
+
+    asyncio.run(Run())
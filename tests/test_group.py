@@ -0,0 +1,29 @@
+from pyalup.Configuration import Configuration
+from pyalup.Device import Device
+from pyalup.Group import Group
+
+
+def _Group(*ledCounts):
+    group = Group()
+    for ledCount in ledCounts:
+        device = Device()
+        device.configuration = Configuration()
+        device.configuration.ledCount = ledCount
+        group.devices.append(device)
+    return group
+
+
+def test_set_colors_cuts_integer_colors_per_device():
+    group = _Group(2, 3)
+    group.SetColors([0x010203, 0x040506, 0x070809, 0x0a0b0c])
+    assert bytes(group.devices[0].frame.colors) == bytes(range(1, 7))
+    assert bytes(group.devices[1].frame.colors) == bytes(range(1, 10))
+
+
+def test_set_colors_cuts_packed_bytes_per_led():
+    group = _Group(9, 10)
+    packed = bytes(range(30))
+    group.SetColors(packed)
+    assert bytes(group.devices[0].frame.colors) == packed[:27]
+    assert bytes(group.devices[1].frame.colors) == packed
+    assert group.devices[1].frame._BodySize() == 30
@@ -0,0 +1,120 @@
+import asyncio
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from pyalup.AsyncDevice import AsyncDevice
+from pyalup.AsyncUdpConnection import AsyncUdpConnection
+from pyalup.Device import Device
+from pyalup.UdpConnection import UdpConnection
+
+LED_COUNT = 10
+
+# idle time between two frames, longer than the ack timeout of a lossy connection with a short rtt
+IDLE_GAP = 0.5
+
+
+class _UdpDevice:
+    """Minimal ALUP v0.3 device answering every frame over udp."""
+
+    def __init__(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('127.0.0.1', 0))
+        self.port = self.socket.getsockname()[1]
+        self.hostPort = _FreeUdpPort()
+        self._buffer = bytearray()
+        self._thread = threading.Thread(target=self._Serve, daemon=True)
+
+    def Start(self):
+        self._thread.start()
+
+    def Close(self):
+        self.socket.close()
+        self._thread.join(1)
+
+    def _Read(self, size):
+        while (len(self._buffer) < size):
+            self._buffer += self.socket.recv(65536)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def _Write(self, data):
+        self.socket.sendto(data, ('127.0.0.1', self.hostPort))
+
+    def _Serve(self):
+        try:
+            self._Write(b'\xff')
+            while (self._Read(1) != b'\xfe'):
+                pass
+            self._Write(b'\xfd0.3\0udp\0' + struct.pack('>iBii', LED_COUNT, 8, 0, 0) + b'\0')
+            self._Read(1)
+            while True:
+                frameId, command, size, _, _ = struct.unpack('>BBiiI', self._Read(14))
+                self._Read(size)
+                now = int(time.monotonic() * 1000) % 2**32
+                self._Write(b'\xfa' + struct.pack('>BII', frameId, now, now))
+                if (command == 2):
+                    return
+        except OSError:
+            return
+
+
+def _FreeUdpPort():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+@pytest.fixture
+def udpDevice():
+    device = _UdpDevice()
+    yield device
+    device.Close()
+
+
+@pytest.mark.parametrize("send", ["Send", "SendNoWait"])
+def test_idle_gap_between_sends(udpDevice, send):
+    device = Device()
+    device.connection = UdpConnection('127.0.0.1', udpDevice.port)
+    device.connection.server_port = udpDevice.hostPort
+    device.connection.Connect()
+    udpDevice.Start()
+    device._AlupConnect()
+
+    for i in range(3):
+        device.SetColors([i] * LED_COUNT)
+        getattr(device, send)()
+        time.sleep(IDLE_GAP)
+    device.FlushBuffer()
+
+    assert device.stats.timeouts == 0
+    assert device.lateResponses == 0
+    assert device.stats.framesAcknowledged == 3
+    device.Disconnect()
+
+
+def test_idle_gap_between_async_sends(udpDevice):
+    async def Run():
+        device = AsyncDevice()
+        device.connection = AsyncUdpConnection('127.0.0.1', udpDevice.port)
+        device.connection.server_port = udpDevice.hostPort
+        await device.connection.Connect()
+        udpDevice.Start()
+        await device._AlupConnect()
+
+        for i in range(3):
+            device.SetColors([i] * LED_COUNT)
+            await device.Send()
+            await asyncio.sleep(IDLE_GAP)
+        await device.FlushBuffer()
+
+        assert device.stats.timeouts == 0
+        assert device.lateResponses == 0
+        assert device.stats.framesAcknowledged == 3
+        await device.Disconnect()
+
+    asyncio.run(Run())
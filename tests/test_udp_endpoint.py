@@ -0,0 +1,66 @@
+import socket
+
+import pytest
+
+from pyalup.UdpEndpoint import UdpEndpoint
+
+
+@pytest.fixture
+def endpoint():
+    endpoint = UdpEndpoint(ip='127.0.0.1')
+    yield endpoint
+    endpoint.Close()
+
+
+def _DeviceSocket():
+    device = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    device.bind(('127.0.0.1', 0))
+    return device
+
+
+def _Connect(endpoint, device):
+    connection = endpoint.Connection('127.0.0.1', device.getsockname()[1])
+    connection.Connect()
+    return connection
+
+
+@pytest.mark.parametrize("matchIpOnly", [False, True])
+def test_two_devices_on_the_same_ip(endpoint, matchIpOnly):
+    endpoint.matchIpOnly = matchIpOnly
+    device1 = _DeviceSocket()
+    device2 = _DeviceSocket()
+    connection1 = _Connect(endpoint, device1)
+    connection2 = _Connect(endpoint, device2)
+    address = ('127.0.0.1', endpoint.server_port)
+
+    device1.sendto(b'one', address)
+    device2.sendto(b'two', address)
+    assert connection1.ReadAvailable(1000) == b'one'
+    assert connection2.ReadAvailable(1000) == b'two'
+
+    # the datagrams of a disconnected device must not reach the other device with the same ip
+    connection1.Disconnect()
+    device1.sendto(b'late', address)
+    device2.sendto(b'two', address)
+    assert connection2.ReadAvailable(1000) == b'two'
+    with pytest.raises(TimeoutError):
+        connection2.ReadAvailable(200)
+    assert endpoint.foreignDatagrams == 1
+
+    connection2.Disconnect()
+    device1.close()
+    device2.close()
+
+
+def test_match_ip_only_routes_other_ports_of_a_single_device(endpoint):
+    endpoint.matchIpOnly = True
+    device = _DeviceSocket()
+    other = _DeviceSocket()
+    connection = _Connect(endpoint, device)
+
+    other.sendto(b'moved', ('127.0.0.1', endpoint.server_port))
+    assert connection.ReadAvailable(1000) == b'moved'
+
+    connection.Disconnect()
+    device.close()
+    other.close()